@@ -291,7 +291,7 @@ class EarthquakeViewModel : ViewModel() {
             try {
                 val response = EarthquakeClient.earthquakeAPI.triggerPrediction()
                 if (response.isSuccessful) {
-                    Toast.makeText(context, "ดึงข้อมูลและวิเคราะห์เสร็จสิ้น", Toast.LENGTH_LONG).show()
+                    Toast.makeText(context, "เริ่มดึงข้อมูลและวิเคราะห์แล้ว (ทำงานเบื้องหลัง)", Toast.LENGTH_LONG).show()
                 } else {
                     Toast.makeText(context, "เกิดข้อผิดพลาดในการวิเคราะห์", Toast.LENGTH_SHORT).show()
                 }
@@ -444,7 +444,7 @@ class EarthquakeViewModel : ViewModel() {
             try {
                 val response = EarthquakeClient.earthquakeAPI.triggerGEE()
                 if (response.isSuccessful) {
-                    Toast.makeText(context, "โหลดข้อมูล GEE สำเร็จ", Toast.LENGTH_LONG).show()
+                    Toast.makeText(context, "เริ่มโหลดข้อมูล GEE แล้ว (ทำงานเบื้องหลัง)", Toast.LENGTH_LONG).show()
                 } else {
                     Toast.makeText(context, "เกิดข้อผิดพลาดในการดึง GEE", Toast.LENGTH_SHORT).show()
                 }
@@ -463,7 +463,7 @@ class EarthquakeViewModel : ViewModel() {
             try {
                 val response = EarthquakeClient.earthquakeAPI.triggerRain()
                 if (response.isSuccessful) {
-                    Toast.makeText(context, "ดึงน้ำฝน + วิเคราะห์สำเร็จ", Toast.LENGTH_LONG).show()
+                    Toast.makeText(context, "เริ่มดึงน้ำฝน + วิเคราะห์แล้ว (ทำงานเบื้องหลัง)", Toast.LENGTH_LONG).show()
                 } else {
                     Toast.makeText(context, "เกิดข้อผิดพลาด", Toast.LENGTH_SHORT).show()
                 }
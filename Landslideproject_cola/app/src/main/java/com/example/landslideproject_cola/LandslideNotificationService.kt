@@ -12,6 +12,7 @@ import kotlinx.coroutines.*
 import okhttp3.OkHttpClient
 import okhttp3.Request
 import org.json.JSONArray
+import org.json.JSONObject
 import java.util.concurrent.TimeUnit
 
 /**
@@ -19,13 +20,14 @@ import java.util.concurrent.TimeUnit
  * และแสดง push notification บน lock screen / status bar
  *
  * วิธีทำงาน:
- *  1. Poll GET /api/notifications/{user_id} ทุก POLL_INTERVAL_MS
- *  2. เปรียบเทียบกับ notification_id ที่เคยเห็นแล้ว (เก็บใน SharedPrefs)
- *  3. ถ้าเจอ notification ใหม่ → โชว์ push notification ทันที
- *  4. บันทึก ID นั้นไว้ ไม่โชว์ซ้ำ
+ *  1. ดึง GET /api/notifications/{user_id} หนึ่งครั้งเพื่อ sync ของที่ค้างอยู่
+ *  2. เปิด stream GET /api/notifications/{user_id}/stream (Server-Sent Events) ค้างไว้
+ *     server จะ push event "notification" มาทันทีที่ admin approve
+ *  3. ถ้า stream หลุด/ใช้ไม่ได้ → รอ POLL_INTERVAL_MS แล้วกลับไปข้อ 1 (ทำงานเหมือน polling เดิม)
+ *  4. เปรียบเทียบกับ notification_id ที่เคยเห็นแล้ว (เก็บใน SharedPrefs) ไม่โชว์ซ้ำ
  *
  * Backend logic (server/main.py verify_alert):
- *   Admin approve → INSERT INTO notifications สำหรับ user ที่อยู่ใกล้ → service จับได้แล้วโชว์
+ *   Admin approve → INSERT INTO notifications สำหรับ user ที่อยู่ใกล้ → publish เข้า stream → service โชว์
  */
 class LandslideNotificationService : Service() {
 
@@ -38,7 +40,8 @@ class LandslideNotificationService : Service() {
         const val TAG = "LandslideService"
 
         // ===== ปรับได้ =====
-        const val POLL_INTERVAL_MS = 30 * 1000L   // ตรวจสอบทุก 30 วินาที
+        const val POLL_INTERVAL_MS = 30 * 1000L   // รอก่อนเชื่อมต่อ stream ใหม่ / poll สำรอง ทุก 30 วินาที
+        const val STREAM_READ_TIMEOUT_S = 45L     // server ส่ง heartbeat ทุก 15 วินาที
 
         fun startService(context: Context) {
             val intent = Intent(context, LandslideNotificationService::class.java)
@@ -64,6 +67,13 @@ class LandslideNotificationService : Service() {
             .build()
     }
 
+    // client สำหรับ SSE: ไม่มี call timeout แต่ read timeout ยาวกว่า heartbeat เพื่อจับ connection ที่ตาย
+    private val streamClient by lazy {
+        httpClient.newBuilder()
+            .readTimeout(STREAM_READ_TIMEOUT_S, TimeUnit.SECONDS)
+            .build()
+    }
+
     private var pollingJob: Job? = null
 
     override fun onCreate() {
@@ -92,6 +102,11 @@ class LandslideNotificationService : Service() {
                 } catch (e: Exception) {
                     Log.e(TAG, "Error checking notifications: ${e.message}")
                 }
+                try {
+                    listenNotificationStream(userId)
+                } catch (e: Exception) {
+                    Log.e(TAG, "Notification stream closed: ${e.message}")
+                }
                 delay(POLL_INTERVAL_MS)
             }
         }
@@ -130,6 +145,66 @@ class LandslideNotificationService : Service() {
         }
     }
 
+    /**
+     * เปิด SSE stream ค้างไว้ แล้วโชว์ push ทันทีที่ได้ event "notification"
+     * event "ready" = server ลงทะเบียน stream แล้ว → sync ซ้ำอีกรอบ เก็บรายการที่เกิดระหว่าง sync ก่อนหน้ากับตอนต่อ stream
+     * return เมื่อ stream ปิดหรือ error (ผู้เรียกจะ sync + reconnect เอง)
+     */
+    private suspend fun listenNotificationStream(userId: String) = withContext(Dispatchers.IO) {
+        val request = Request.Builder()
+            .url("${EarthquakeClient.BASE_URL}api/notifications/$userId/stream")
+            .header("Accept", "text/event-stream")
+            .header("User-Agent", "LandslideNanApp/1.0")
+            .build()
+
+        streamClient.newCall(request).execute().use { response ->
+            if (!response.isSuccessful) {
+                Log.e(TAG, "Stream error ${response.code}")
+                return@withContext
+            }
+            val source = response.body?.source() ?: return@withContext
+            var eventName = ""
+            val data = StringBuilder()
+
+            while (isActive) {
+                val line = source.readUtf8Line() ?: break
+                when {
+                    line.isEmpty() -> {
+                        if (eventName == "ready") {
+                            try {
+                                checkNewNotifications(userId)
+                            } catch (e: Exception) {
+                                Log.e(TAG, "Error re-syncing notifications: ${e.message}")
+                            }
+                        } else if (eventName == "notification" && data.isNotEmpty()) {
+                            handleStreamedNotification(JSONObject(data.toString()))
+                        }
+                        eventName = ""
+                        data.clear()
+                    }
+                    line.startsWith(":") -> Unit   // heartbeat
+                    line.startsWith("event:") -> eventName = line.substringAfter(":").trim()
+                    line.startsWith("data:") -> data.append(line.substringAfter(":").trimStart())
+                }
+            }
+        }
+    }
+
+    private fun handleStreamedNotification(obj: JSONObject) {
+        val notif = NotifPayload(
+            notification_id = obj.optString("notification_id", ""),
+            title   = obj.optString("title", "แจ้งเตือนดินถล่ม"),
+            message = obj.optString("message", ""),
+            sent_at = obj.optString("sent_at", ""),
+            is_read = obj.optInt("is_read", 0)
+        )
+        if (notif.notification_id.isBlank() || notif.notification_id in getSeenNotificationIds()) return
+
+        Log.d(TAG, "Streamed notification: ${notif.notification_id} — ${notif.title}")
+        showPushNotification(notif)
+        markNotificationSeen(notif.notification_id)
+    }
+
     // ===================== API CALL =====================
 
     private suspend fun fetchNotificationsFromServer(userId: String): List<NotifPayload>? =
@@ -3147,3 +3147,101 @@ CREATE TABLE IF NOT EXISTS `prediction_logs` (
 -- 5. Notifications table update (Tracing exactly which prediction triggered the alert)
 -- Add log_id to existing notifications table
 ALTER TABLE `notifications` ADD COLUMN IF NOT EXISTS `log_id` CHAR(36) DEFAULT NULL;
+
+-- 6. Precomputed admin area of each node (เติมตอน seed_data.py / startup ไม่ต้อง geocode ทุก request)
+ALTER TABLE `static_nodes`
+  ADD COLUMN IF NOT EXISTS `tambon` VARCHAR(255) DEFAULT NULL,
+  ADD COLUMN IF NOT EXISTS `district` VARCHAR(100) DEFAULT NULL;
+CREATE INDEX IF NOT EXISTS `idx_static_nodes_district` ON `static_nodes` (`district`);
+
+-- 7. Bounding-box prefilter สำหรับหา user ในรัศมีแจ้งเตือน (verify_alert)
+CREATE INDEX IF NOT EXISTS `idx_user_locations_lat_lon` ON `user_locations` (`latitude`, `longitude`);
+
+-- 8. Keyset pagination ของ notifications ต่อ user
+CREATE INDEX IF NOT EXISTS `idx_notifications_user_sent` ON `notifications` (`user_id`, `sent_at`, `notification_id`);
+
+-- 9. ฝนรายวันต่อ grid แทน rain_grids.rain_values_json (ดึงเฉพาะวันที่ยังขาดตอน refresh)
+CREATE TABLE IF NOT EXISTS `rain_daily` (
+  `grid_id` VARCHAR(50) NOT NULL,
+  `rain_date` DATE NOT NULL,
+  `precipitation_mm` FLOAT NOT NULL DEFAULT 0,
+  `fetched_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`grid_id`, `rain_date`),
+  KEY `idx_rain_daily_date` (`rain_date`),
+  FOREIGN KEY (`grid_id`) REFERENCES `rain_grids`(`grid_id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+-- blob เดิม = 10 วันที่จบที่วันก่อน last_updated
+INSERT IGNORE INTO `rain_daily` (`grid_id`, `rain_date`, `precipitation_mm`)
+SELECT rg.`grid_id`, DATE(rg.`last_updated`) - INTERVAL (10 - d.n) DAY,
+       JSON_EXTRACT(rg.`rain_values_json`, CONCAT('$[', d.n, ']'))
+FROM `rain_grids` rg
+JOIN (SELECT 0 AS n UNION ALL SELECT 1 UNION ALL SELECT 2 UNION ALL SELECT 3 UNION ALL SELECT 4
+      UNION ALL SELECT 5 UNION ALL SELECT 6 UNION ALL SELECT 7 UNION ALL SELECT 8 UNION ALL SELECT 9) d
+WHERE JSON_EXTRACT(rg.`rain_values_json`, CONCAT('$[', d.n, ']')) IS NOT NULL;
+ALTER TABLE `rain_grids` DROP COLUMN `rain_values_json`;
+
+-- 10. prediction_logs แบบ compact: log ใหม่ไม่เขียน features_json แล้ว (คอลัมน์คงไว้ให้ log เก่า)
+--     static features อ้างจาก static_nodes ตาม node_id, ฝน 10 วันของแต่ละรอบเก็บครั้งเดียวต่อ grid
+--     (float64 x 10 แบบ packed) แล้ว /api/admin/alerts/{log_id} ประกอบ features กลับเมื่อเปิดดู
+CREATE TABLE IF NOT EXISTS `prediction_run_rain` (
+  `run_id` CHAR(36) NOT NULL,
+  `grid_id` VARCHAR(50) NOT NULL,
+  `rain_mm` VARBINARY(80) NOT NULL,
+  PRIMARY KEY (`run_id`, `grid_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+ALTER TABLE `prediction_logs`
+  ADD COLUMN IF NOT EXISTS `run_id` CHAR(36) DEFAULT NULL AFTER `log_id`,
+  MODIFY `risk_level` ENUM('Low', 'Medium', 'High') NOT NULL;
+
+-- 11. 1 แถวต่อรอบทำนาย + query ของ admin ผูกกับ run แทน DATE(timestamp) ที่ใช้ index ไม่ได้
+CREATE TABLE IF NOT EXISTS `prediction_runs` (
+  `run_id` CHAR(36) PRIMARY KEY,
+  `started_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `finished_at` TIMESTAMP NULL DEFAULT NULL,
+  `model_version` VARCHAR(64) DEFAULT NULL,
+  `nodes_total` INT NOT NULL DEFAULT 0,
+  `nodes_scored` INT NOT NULL DEFAULT 0,
+  `logs_written` INT NOT NULL DEFAULT 0,
+  KEY `idx_prediction_runs_started` (`started_at`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+-- log เก่าที่ยังไม่มี run_id ผูกกับ run รายวัน 'legacy-YYYYMMDD'
+INSERT IGNORE INTO `prediction_runs` (`run_id`, `started_at`, `finished_at`, `model_version`, `logs_written`)
+SELECT CONCAT('legacy-', DATE_FORMAT(MIN(`timestamp`), '%Y%m%d')), MIN(`timestamp`), MAX(`timestamp`), 'legacy', COUNT(*)
+FROM `prediction_logs`
+WHERE `run_id` IS NULL
+GROUP BY DATE(`timestamp`);
+UPDATE `prediction_logs` SET `run_id` = CONCAT('legacy-', DATE_FORMAT(`timestamp`, '%Y%m%d')) WHERE `run_id` IS NULL;
+CREATE INDEX IF NOT EXISTS `idx_prediction_logs_run_status_prob` ON `prediction_logs` (`run_id`, `status`, `probability`);
+-- pending alerts = log ล่าสุดของแต่ละ node ที่ยังเป็น pending
+CREATE INDEX IF NOT EXISTS `idx_prediction_logs_node_time` ON `prediction_logs` (`node_id`, `timestamp`);
+
+-- 12. retention ของ prediction_logs (ดู server/retention.py)
+--     log pending ที่เก่ากว่า PREDICTION_ROLLUP_AFTER_DAYS วันถูกยุบเป็นสถิติรายวันต่อ node (max_risk_code: 0=Low, 1=Medium, 2=High)
+--     การแบ่ง partition รายเดือน (PK เป็น (log_id, timestamp), ไม่มี foreign key) job `retention` ทำเองตอนรันครั้งแรก
+CREATE TABLE IF NOT EXISTS `prediction_log_daily` (
+  `node_id` INT NOT NULL,
+  `log_date` DATE NOT NULL,
+  `samples` INT NOT NULL DEFAULT 0,
+  `prob_min` FLOAT DEFAULT NULL,
+  `prob_max` FLOAT DEFAULT NULL,
+  `prob_sum` DOUBLE NOT NULL DEFAULT 0,
+  `max_risk_code` TINYINT NOT NULL DEFAULT 0,
+  PRIMARY KEY (`node_id`, `log_date`),
+  KEY `idx_prediction_log_daily_date` (`log_date`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+CREATE INDEX IF NOT EXISTS `idx_prediction_logs_status_time` ON `prediction_logs` (`status`, `timestamp`);
+
+-- 13. keyset pagination ของ admin history (/api/admin/alerts/history, /api/admin/notifications/history)
+--     เรียง (timestamp, log_id) ต่อ status / risk_level — status ใช้ idx_prediction_logs_status_time ของข้อ 12
+--     กรองตาม district ใช้ idx_static_nodes_district ของข้อ 6
+CREATE INDEX IF NOT EXISTS `idx_prediction_logs_risk_time_id` ON `prediction_logs` (`risk_level`, `timestamp`, `log_id`);
+
+-- 14. cursor ของ /api/notifications/{user_id} ใช้ seq (AUTO_INCREMENT, ออกตามลำดับ commit) แทน (sent_at, notification_id)
+--     sent_at ละเอียดแค่วินาที + notification_id เป็น uuid สุ่ม ทำให้ since ข้ามแถวที่ commit ทีหลังในวินาทีเดียวกันได้
+--     แถวเดิมนับ seq ตาม (sent_at, notification_id) ก่อนเปิด AUTO_INCREMENT (ถ้าเพิ่มตรงๆ จะนับตาม PK ที่เป็น uuid สุ่ม)
+ALTER TABLE `notifications` ADD COLUMN IF NOT EXISTS `seq` BIGINT NULL;
+SET @notification_seq := 0;
+UPDATE `notifications` SET `seq` = (@notification_seq := @notification_seq + 1) ORDER BY `sent_at`, `notification_id`;
+ALTER TABLE `notifications` MODIFY `seq` BIGINT NOT NULL AUTO_INCREMENT, ADD UNIQUE KEY `uq_notifications_seq` (`seq`);
+CREATE INDEX IF NOT EXISTS `idx_notifications_user_seq` ON `notifications` (`user_id`, `seq`);
+DROP INDEX IF EXISTS `idx_notifications_user_sent` ON `notifications`;
@@ -8,6 +8,8 @@ from sklearn.metrics import classification_report, accuracy_score, precision_sco
 from sklearn.linear_model import LogisticRegression
 from sklearn.tree import DecisionTreeClassifier
 import os
+import json
+from datetime import datetime
 
 print("=" * 70)
 print("  LANDSLIDE MODEL COMPARISON — วัดที่ Recall เป็นหลัก")
@@ -16,6 +18,8 @@ print("=" * 70)
 print("\n[1/5] Loading dataset...")
 df = pd.read_csv('Landslide_Final_Cleaned_V2.csv')
 TARGET_COL = 'Geohaz_E'
+# threshold ของ risk level ที่ server ใช้กับ version นี้ (เขียนลง metadata.json ของ registry)
+RISK_THRESHOLDS = {"medium": 0.18, "high": 0.60}
 
 features_to_use = [
     'CHIRPS_Day_1', 'CHIRPS_Day_2', 'CHIRPS_Day_3', 'CHIRPS_Day_4', 'CHIRPS_Day_5',
@@ -247,4 +251,31 @@ print(f"   ✅ Saved: models/best_ml_model.pkl ({best_model_name})")
 print(f"   ✅ Saved: models/landslide_scaler.pkl")
 print(f"\n   Model: {os.path.abspath('models/best_ml_model.pkl')}")
 print(f"   Scaler: {os.path.abspath('models/landslide_scaler.pkl')}")
+
+# Model registry: เก็บเป็น version ใหม่พร้อม metadata ให้ server สลับใช้ได้โดยไม่ต้อง restart
+version = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{best_model_name.lower().replace(' ', '-')}"
+version_dir = os.path.join('models', 'registry', version)
+os.makedirs(version_dir, exist_ok=True)
+joblib.dump(scaler, os.path.join(version_dir, 'scaler.pkl'))
+joblib.dump(best_model, os.path.join(version_dir, 'model.pkl'))
+metadata = {
+    "version": version,
+    "created_at": datetime.now().isoformat(timespec='seconds'),
+    "model_type": type(best_model).__name__,
+    "model_name": best_model_name,
+    "feature_order": features_to_use,
+    "thresholds": RISK_THRESHOLDS,
+    "metrics": {
+        "recall": float(recall_score(y_test, y_pred_best, zero_division=0)),
+        "precision": float(precision_score(y_test, y_pred_best, zero_division=0)),
+        "f1": float(f1_score(y_test, y_pred_best, zero_division=0)),
+        "accuracy": float(accuracy_score(y_test, y_pred_best)),
+        "train_rows": int(len(X_train)),
+        "test_rows": int(len(X_test)),
+    },
+}
+with open(os.path.join(version_dir, 'metadata.json'), 'w', encoding='utf-8') as f:
+    json.dump(metadata, f, indent=2, ensure_ascii=False)
+print(f"   ✅ Registry version: {version}")
+print(f"   Activate: POST /api/admin/models/{version}/activate")
 print("=" * 70)
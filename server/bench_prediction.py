@@ -0,0 +1,86 @@
+"""
+Benchmark ขั้นตอนหลัง inference ของ trigger_prediction (risk/color/polygon/log tuples)
+เทียบแบบเดิม (df.iterrows) กับแบบ vectorized ใน main.build_prediction_outputs
+
+Usage:
+    cd server
+    py bench_prediction.py            # 2,727 / 10,000 / 117,000 nodes
+    py bench_prediction.py 50000      # กำหนดจำนวน node เอง
+"""
+import json
+import sys
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from main import FEATURE_ORDER, build_prediction_outputs, calculate_2x2_polygon
+
+
+def make_synthetic_nodes(n, seed=42):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'node_id': np.arange(1, n + 1),
+        'latitude': rng.uniform(18.0, 19.6, n),
+        'longitude': rng.uniform(100.3, 101.3, n),
+    })
+    for col in FEATURE_ORDER:
+        df[col] = rng.random(n) * 10
+    probs = rng.random(n)
+    return df, probs
+
+
+def legacy_post_inference(df, probs):
+    log_inserts = []
+    response_payload = []
+    for i, row in df.iterrows():
+        node_id = row['node_id']
+        prob = float(probs[i])
+        risk = "Low"
+        color = "#00FF00"
+        if prob >= 0.60:
+            risk = "High"
+            color = "#FF0000"
+        elif prob >= 0.18:
+            risk = "Medium"
+            color = "#FFFF00"
+        log_id = str(uuid.uuid4())
+        row_features = df.iloc[i][FEATURE_ORDER].to_dict()
+        log_inserts.append((log_id, node_id, risk, prob, 'pending', json.dumps(row_features)))
+        response_payload.append({
+            "id": str(node_id),
+            "latitude": float(row['latitude']),
+            "longitude": float(row['longitude']),
+            "risk_level": risk,
+            "color": color,
+            "polygon": calculate_2x2_polygon(row['latitude'], row['longitude'])
+        })
+    return log_inserts, response_payload
+
+
+def time_it(fn, *args, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    sizes = [int(a) for a in sys.argv[1:]] or [2727, 10_000, 117_000]
+    print(f"{'nodes':>8} | {'legacy s':>9} | {'vector s':>9} | {'vector s/10k':>12} | speedup")
+    print("-" * 60)
+    for n in sizes:
+        df, probs = make_synthetic_nodes(n)
+        vec = time_it(build_prediction_outputs, df, probs)
+        # แบบเดิมช้ามาก วัดเฉพาะขนาดที่ไม่เกิน 20k
+        legacy = time_it(legacy_post_inference, df, probs, repeat=1) if n <= 20_000 else None
+        legacy_s = f"{legacy:9.3f}" if legacy is not None else f"{'-':>9}"
+        speedup = f"{legacy / vec:6.1f}x" if legacy is not None else "-"
+        print(f"{n:>8} | {legacy_s} | {vec:9.3f} | {vec / n * 10_000:12.4f} | {speedup}")
+
+
+if __name__ == "__main__":
+    main()
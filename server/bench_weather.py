@@ -0,0 +1,102 @@
+"""
+Benchmark การดึงฝนจาก Open-Meteo กับ stub ในเครื่อง (ไม่ต้องต่อ internet)
+เทียบแบบเดิม (1 request ต่อ grid, Semaphore(5) + sleep 0.2) กับ weather.fetch_weather_batch
+
+Usage:
+    cd server
+    py bench_weather.py                    # 300 / 1,000 grids
+    py bench_weather.py 2727 --latency 0.3 --throttle-rate 0.05
+"""
+import argparse
+import asyncio
+import threading
+import time
+
+import httpx
+import numpy as np
+import uvicorn
+
+import weather
+from meteo_stub import STUB_SETTINGS, STUB_STATS, stub_app
+
+STUB_PORT = 8089
+
+
+def start_stub(port):
+    server = uvicorn.Server(uvicorn.Config(stub_app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread
+
+
+def make_grids(n, seed=42):
+    rng = np.random.default_rng(seed)
+    lats = rng.uniform(18.0, 19.6, n)
+    lons = rng.uniform(100.3, 101.3, n)
+    return [{'grid_id': f"G{i}", 'lat': float(la), 'lon': float(lo)} for i, (la, lo) in enumerate(zip(lats, lons))]
+
+
+async def legacy_fetch(grids):
+    semaphore = asyncio.Semaphore(5)
+
+    async def fetch_one(client, g):
+        async with semaphore:
+            await asyncio.sleep(0.2)
+            params = {'latitude': g['lat'], 'longitude': g['lon'], 'daily': 'precipitation_sum',
+                      'past_days': 10, 'forecast_days': 1, 'timezone': 'auto'}
+            try:
+                response = await client.get(weather.OPEN_METEO_URL, params=params, timeout=10.0)
+                return response.json()['daily']['precipitation_sum'][:10]
+            except Exception:
+                return [0] * 10
+
+    async with httpx.AsyncClient() as client:
+        return await asyncio.gather(*[fetch_one(client, g) for g in grids])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("sizes", nargs="*", type=int, default=[300, 1000])
+    parser.add_argument("--latency", type=float, default=0.15)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--skip-legacy", action="store_true")
+    args = parser.parse_args()
+
+    STUB_SETTINGS.update(latency=args.latency, throttle_rate=args.throttle_rate)
+    weather.OPEN_METEO_URL = f"http://127.0.0.1:{STUB_PORT}/v1/forecast"
+    server, thread = start_stub(STUB_PORT)
+
+    print(f"stub latency={args.latency}s throttle={args.throttle_rate:.0%} batch={weather.METEO_BATCH_SIZE} "
+          f"rate={weather.METEO_RATE_PER_SEC}/s concurrency<={weather.METEO_MAX_CONCURRENCY}")
+    print(f"{'grids':>7} | {'legacy s':>9} | {'legacy req':>10} | {'batched s':>9} | {'batched req':>11} | {'retries':>7} | speedup")
+    print("-" * 82)
+    try:
+        for n in args.sizes:
+            grids = make_grids(n)
+            legacy = None
+            legacy_req = "-"
+            if not args.skip_legacy:
+                STUB_STATS["requests"] = 0
+                t0 = time.perf_counter()
+                asyncio.run(legacy_fetch(grids))
+                legacy = time.perf_counter() - t0
+                legacy_req = STUB_STATS["requests"]
+
+            stats = {'requests': 0, 'retries': 0, 'failed_batches': 0}
+            t0 = time.perf_counter()
+            results = asyncio.run(weather.fetch_weather_batch(grids, stats=stats))
+            batched = time.perf_counter() - t0
+            assert [r['grid_id'] for r in results] == [g['grid_id'] for g in grids]
+
+            legacy_s = f"{legacy:9.2f}" if legacy is not None else f"{'-':>9}"
+            speedup = f"{legacy / batched:6.1f}x" if legacy is not None else "-"
+            print(f"{n:>7} | {legacy_s} | {legacy_req:>10} | {batched:9.2f} | {stats['requests']:>11} | {stats['retries']:>7} | {speedup}")
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Shared MySQL data-access layer (connection pool) สำหรับ main.py
+
+- ใช้ MySQLConnectionPool ขนาดคงที่ แทนการเปิด connection ใหม่ทุก request
+- conn.close() บน pooled connection = คืน connection เข้า pool (โค้ดเดิมใช้ได้เหมือนเดิม)
+- ทุกครั้งที่ยืม connection จะตั้ง per-query timeout ของ session ซึ่งทำหน้าที่ health check ไปด้วย
+  ถ้า connection ตายจะ reconnect ให้อัตโนมัติ
+- งาน DB ที่ต้องเรียกจาก async def ให้ใช้ `await run_db(fn, ...)` เพื่อไม่ block event loop
+
+ตั้งค่าได้ผ่าน environment variables:
+    DB_HOST, DB_USER, DB_PASSWORD, DB_NAME
+    DB_POOL_SIZE        จำนวน connection ใน pool (default 10, สูงสุด 32)
+    DB_POOL_TIMEOUT     วินาทีที่รอ connection ว่างเมื่อ pool เต็ม (default 5)
+    DB_QUERY_TIMEOUT    วินาทีสูงสุดต่อ 1 SELECT (default 30, 0 = ไม่จำกัด)
+"""
+import os
+import threading
+import time
+
+import mysql.connector
+from mysql.connector import pooling
+from starlette.concurrency import run_in_threadpool
+
+# Database configuraton
+DB_CONFIG = {
+    'host': os.environ.get('DB_HOST', 'localhost'),
+    'user': os.environ.get('DB_USER', 'root'),
+    'password': os.environ.get('DB_PASSWORD', ''),
+    'database': os.environ.get('DB_NAME', 'landsnot_db'),
+}
+
+DB_POOL_NAME = "landsnot_pool"
+DB_POOL_SIZE = min(int(os.environ.get('DB_POOL_SIZE', 10)), pooling.CNX_POOL_MAXSIZE)
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 5))
+DB_QUERY_TIMEOUT = float(os.environ.get('DB_QUERY_TIMEOUT', 30))
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+_TIMEOUT_STATEMENT = None
+
+
+def _init_pool():
+    """สร้าง pool ครั้งแรกที่มีการเรียกใช้ (lazy เพื่อให้ server ขึ้นได้แม้ DB ยังไม่พร้อม)"""
+    global _POOL, _TIMEOUT_STATEMENT
+    with _POOL_LOCK:
+        if _POOL is not None:
+            return _POOL
+        pool = pooling.MySQLConnectionPool(
+            pool_name=DB_POOL_NAME,
+            pool_size=DB_POOL_SIZE,
+            pool_reset_session=True,
+            **DB_CONFIG,
+        )
+        # MariaDB (XAMPP) ใช้ max_statement_time (วินาที), MySQL ใช้ max_execution_time (ms)
+        probe = pool.get_connection()
+        try:
+            if 'mariadb' in probe.get_server_info().lower():
+                _TIMEOUT_STATEMENT = f"SET SESSION max_statement_time = {DB_QUERY_TIMEOUT:g}"
+            else:
+                _TIMEOUT_STATEMENT = f"SET SESSION max_execution_time = {int(DB_QUERY_TIMEOUT * 1000)}"
+        finally:
+            probe.close()
+        _POOL = pool
+        print(f"[DB] Connection pool ready (size={DB_POOL_SIZE}, query timeout={DB_QUERY_TIMEOUT:g}s)")
+        return _POOL
+
+
+def _prepare_connection(conn):
+    """ตั้ง timeout ของ session; ถ้า connection หลุดให้ reconnect แล้วลองใหม่อีกครั้ง"""
+    if not _TIMEOUT_STATEMENT:
+        return
+    try:
+        cursor = conn.cursor()
+        cursor.execute(_TIMEOUT_STATEMENT)
+        cursor.close()
+    except mysql.connector.Error:
+        conn.ping(reconnect=True, attempts=2, delay=0)
+        cursor = conn.cursor()
+        cursor.execute(_TIMEOUT_STATEMENT)
+        cursor.close()
+
+
+def get_db_connection():
+    """ยืม connection จาก pool (รอได้สูงสุด DB_POOL_TIMEOUT วินาที) คืนค่า None ถ้าไม่สำเร็จ"""
+    try:
+        pool = _POOL or _init_pool()
+    except Exception as e:
+        print(f"Error connecting to DB: {e}")
+        return None
+
+    deadline = time.monotonic() + DB_POOL_TIMEOUT
+    while True:
+        try:
+            conn = pool.get_connection()
+            break
+        except pooling.PoolError:
+            if time.monotonic() >= deadline:
+                print("Error connecting to DB: pool exhausted")
+                return None
+            time.sleep(0.02)
+        except Exception as e:
+            print(f"Error connecting to DB: {e}")
+            return None
+
+    try:
+        _prepare_connection(conn)
+    except Exception as e:
+        print(f"Error connecting to DB: health check failed: {e}")
+        try:
+            conn.close()
+        except Exception:
+            pass
+        return None
+    return conn
+
+
+async def run_db(fn, *args, **kwargs):
+    """รันฟังก์ชัน DB แบบ blocking ใน thread pool เพื่อไม่ให้ค้าง event loop"""
+    return await run_in_threadpool(fn, *args, **kwargs)
+
+
+def db_health():
+    """ตรวจสถานะ DB + pool สำหรับ health endpoint"""
+    t0 = time.perf_counter()
+    conn = get_db_connection()
+    if not conn:
+        return {"status": "down", "pool_size": DB_POOL_SIZE}
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1")
+        cursor.fetchall()
+        cursor.close()
+        return {
+            "status": "ok",
+            "pool_size": DB_POOL_SIZE,
+            "query_timeout_s": DB_QUERY_TIMEOUT,
+            "latency_ms": round((time.perf_counter() - t0) * 1000, 2),
+        }
+    except Exception as e:
+        return {"status": "down", "pool_size": DB_POOL_SIZE, "error": str(e)}
+    finally:
+        conn.close()
@@ -17,6 +17,9 @@ try:
     # Drop tables to allow clean recreation
     tables_to_drop = [
         "user_pinned_locations",
+        "prediction_run_rain",
+        "prediction_runs",
+        "prediction_log_daily",
         "prediction_logs",
         "static_nodes",
         "rain_grids"
@@ -0,0 +1,171 @@
+"""
+Inference executor: รัน SCALER.transform + predict_proba นอก event loop
+
+- batch เล็ก (< 2 x INFERENCE_MIN_ROWS_PER_WORKER แถว) รันใน thread pool ของ server ด้วย model ที่โหลดอยู่
+- batch ใหญ่ แบ่งแถวให้ process pool (INFERENCE_WORKERS process) ที่โหลด model/scaler ไว้แล้วใน initializer
+  feature matrix และผลลัพธ์อยู่ใน shared memory จึงไม่ต้อง pickle array ส่งไปกลับ
+- pool ผูกกับ fingerprint ของ model: prepare() สร้าง pool ของ model ใหม่และรอ worker โหลดเสร็จก่อน
+  activate() สลับไปใช้แล้วปิด pool เก่า (งานที่ค้างอยู่ใน pool เก่ารันต่อจนจบ)
+  รอบที่ยังถือ model เก่าอยู่ตอนสลับ จะรันใน thread แทน
+- ถ้า process pool ใช้ไม่ได้ (เช่น worker ตาย) จะ fallback ไปรันใน thread แทน
+
+ตั้งค่าได้ผ่าน environment variables:
+    INFERENCE_WORKERS               จำนวน process (default = จำนวน core สูงสุด 4, 0/1 = ไม่ใช้ process pool)
+    INFERENCE_MIN_ROWS_PER_WORKER   จำนวนแถวขั้นต่ำต่อ worker (default 5000)
+"""
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context, shared_memory
+
+import joblib
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+
+INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS', min(4, os.cpu_count() or 1)))
+INFERENCE_MIN_ROWS_PER_WORKER = max(1, int(os.environ.get('INFERENCE_MIN_ROWS_PER_WORKER', 5000)))
+
+# predictor ของแต่ละ worker process (โหลด model ครั้งเดียวใน _init_worker)
+_WORKER_PREDICT = None
+
+
+def predict_with(model, scaler, X):
+    """probability ของ class 1 (model ที่มี class เดียวใช้ predict ตรงๆ)"""
+    if scaler is not None:
+        X = scaler.transform(X)
+    return model.predict_proba(X)[:, 1] if model.classes_.shape[0] > 1 else model.predict(X)
+
+
+def build_predictor(model, scaler):
+    """คืนฟังก์ชัน X -> probability ของ model/scaler (None ถ้ายังไม่มี model)"""
+    if model is None:
+        return None
+    return functools.partial(predict_with, model, scaler)
+
+
+def _init_worker(model_path, scaler_path):
+    global _WORKER_PREDICT
+    model = joblib.load(model_path)
+    scaler = joblib.load(scaler_path) if scaler_path and os.path.exists(scaler_path) else None
+    _WORKER_PREDICT = build_predictor(model, scaler)
+
+
+def _ping():
+    return os.getpid()
+
+
+def _score_slice(in_name, out_name, shape, start, stop):
+    """worker: อ่านแถว [start, stop) จาก shared memory แล้วเขียน probability กลับลง output"""
+    # parent เป็นเจ้าของ segment (unlink เอง) worker แค่ attach/close
+    shm_in = shared_memory.SharedMemory(name=in_name)
+    shm_out = shared_memory.SharedMemory(name=out_name)
+    try:
+        X = np.ndarray(shape, dtype=np.float64, buffer=shm_in.buf)
+        out = np.ndarray((shape[0],), dtype=np.float64, buffer=shm_out.buf)
+        out[start:stop] = _WORKER_PREDICT(X[start:stop])
+        del X, out
+        return stop - start
+    finally:
+        shm_in.close()
+        shm_out.close()
+
+
+class InferenceExecutor:
+    def __init__(self, workers=INFERENCE_WORKERS, min_rows_per_worker=INFERENCE_MIN_ROWS_PER_WORKER):
+        self.workers = workers
+        self.min_rows_per_worker = min_rows_per_worker
+        self.pools = {}          # key (fingerprint ของ model) -> ProcessPoolExecutor
+        self.current_key = None  # model ที่ใช้อยู่ (key อื่นไม่ใช้ process pool)
+        self.lock = threading.Lock()
+
+    def _get_pool(self, model_path, scaler_path, key):
+        with self.lock:
+            pool = self.pools.get(key)
+            if pool is None:
+                pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(model_path, scaler_path),
+                )
+                self.pools[key] = pool
+                print(f"[INFERENCE] Started process pool with {self.workers} workers")
+            return pool
+
+    def shutdown(self):
+        with self.lock:
+            for pool in self.pools.values():
+                pool.shutdown(wait=False, cancel_futures=True)
+            self.pools = {}
+
+    def _ping_workers(self, model_path, scaler_path, key):
+        if self.workers <= 1 or not os.path.exists(model_path):
+            return []
+        pool = self._get_pool(model_path, scaler_path, key)
+        return [pool.submit(_ping) for _ in range(self.workers)]
+
+    def warm(self, model_path, scaler_path, key):
+        """สร้าง pool ล่วงหน้าตอน startup (ไม่รอ) ให้ worker โหลด model เสร็จก่อนรอบทำนายแรก"""
+        self.activate(key)
+        self._ping_workers(model_path, scaler_path, key)
+
+    async def prepare(self, model_path, scaler_path, key):
+        """สร้าง pool ของ model ใหม่ข้างๆ pool เดิม แล้วรอจน worker ทุกตัวโหลด model เสร็จ"""
+        futures = self._ping_workers(model_path, scaler_path, key)
+        try:
+            if futures:
+                await asyncio.gather(*[asyncio.wrap_future(f) for f in futures])
+        except Exception:
+            with self.lock:
+                if key != self.current_key and key in self.pools:
+                    self.pools.pop(key).shutdown(wait=False, cancel_futures=True)
+            raise
+
+    def activate(self, key):
+        """สลับไปใช้ pool ของ key แล้วปิด pool อื่น (ไม่ยกเลิกงานที่ส่งไปแล้ว)"""
+        with self.lock:
+            self.current_key = key
+            for old_key in [k for k in self.pools if k != key]:
+                self.pools.pop(old_key).shutdown(wait=False, cancel_futures=False)
+
+    def plan_chunks(self, n):
+        """แบ่ง n แถวเป็นช่วง [start, stop) ต่อ worker (ว่าง = ไม่คุ้มใช้ process pool)"""
+        if self.workers <= 1 or n < 2 * self.min_rows_per_worker:
+            return []
+        k = min(self.workers, n // self.min_rows_per_worker)
+        bounds = np.linspace(0, n, k + 1).astype(int)
+        return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+    async def predict(self, X, predictor, model_path, scaler_path, key):
+        """
+        probability ของทุกแถวใน X (awaitable, ไม่ block event loop)
+        predictor = จาก build_predictor ของ model ที่โหลดอยู่ใน server (ใช้กับ batch เล็ก/fallback)
+        model_path/scaler_path/key = ให้ worker โหลดตัวเดียวกัน
+        """
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        chunks = self.plan_chunks(len(X)) if key == self.current_key else []
+        if not chunks:
+            return await run_in_threadpool(predictor, X)
+
+        shm_in = shared_memory.SharedMemory(create=True, size=max(1, X.nbytes))
+        shm_out = shared_memory.SharedMemory(create=True, size=max(1, len(X) * 8))
+        try:
+            np.ndarray(X.shape, dtype=np.float64, buffer=shm_in.buf)[:] = X
+            pool = self._get_pool(model_path, scaler_path, key)
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*[
+                loop.run_in_executor(pool, _score_slice, shm_in.name, shm_out.name, X.shape, start, stop)
+                for start, stop in chunks
+            ])
+            return np.ndarray((len(X),), dtype=np.float64, buffer=shm_out.buf).copy()
+        except Exception as e:
+            print(f"[INFERENCE] Process pool failed ({e!r}), scoring in thread instead")
+            self.shutdown()
+            return await run_in_threadpool(predictor, X)
+        finally:
+            shm_in.close()
+            shm_in.unlink()
+            shm_out.close()
+            shm_out.unlink()
@@ -1,23 +1,35 @@
-from fastapi import FastAPI, HTTPException, Depends, UploadFile, File
+from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Request, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 import pandas as pd
 import numpy as np
-import joblib
 import json
 import asyncio
-import httpx
 from pydantic import BaseModel
 import datetime
 import math
 from typing import List, Optional
+from collections import OrderedDict
 import os
 import shutil
 import base64
-import mysql.connector
+import gzip
+import hashlib
+import struct
+import threading
+import time
 import uuid
 import bcrypt
 import jwt as pyjwt
+from sklearn.neighbors import BallTree
+from db import get_db_connection, run_db, db_health
+from weather import fetch_rain_ranges
+from scheduler import JobScheduler
+from inference import InferenceExecutor
+from model_registry import LEGACY_VERSION, list_versions, load_bundle, read_active, validate_version, version_paths, write_active
+from retention import PREDICTION_LOG_RETENTION_MONTHS, PREDICTION_ROLLUP_AFTER_DAYS, delete_orphaned_logs, drop_expired, ensure_future_partitions, ensure_partitioned, rollup_pending_logs
 
 app = FastAPI()
 
@@ -43,19 +55,21 @@ SECRET_KEY = "landslide_secret_key_2025"
 
 # Global states
 STATIC_DATA_CACHE = None
-ML_MODEL = None
-SCALER = None
+MODEL_BUNDLE = None       # model version ที่ใช้อยู่ (model, scaler, predictor, fingerprint, thresholds) — สลับทั้งก้อน
+PREVIOUS_BUNDLE = None    # version ก่อนหน้า เก็บไว้ใน memory สำหรับ rollback ทันที
 LOCATION_LOOKUP_DF = None
+LOCATION_TREE = None      # BallTree (haversine) บนพิกัดของ LOCATION_LOOKUP_DF
+LOCATION_TAMBONS = None   # numpy array ชื่อตำบล เรียงตาม index ของ tree
+LOCATION_DISTRICTS = None
 
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PREDICTIONS_PATH = os.path.join(PROJECT_ROOT, 'server', 'data', 'latest_predictions.json')
+
+# Snapshot ของ /api/predictions ที่ serialize + gzip ไว้ล่วงหน้า (เปลี่ยนเฉพาะตอน trigger_prediction)
+PREDICTIONS_SNAPSHOT = None
+PREDICTIONS_VERSION = 0
+PREDICTIONS_LOCK = threading.Lock()
 
-# Database configuraton
-DB_CONFIG = {
-    'host': 'localhost',
-    'user': 'root',
-    'password': '',
-    'database': 'landsnot_db',
-}
 
 class PinRequest(BaseModel):
     user_id: str
@@ -73,6 +87,10 @@ class RegisterRequest(BaseModel):
 class VerifyAlertRequest(BaseModel):
     action: str
 
+class BulkVerifyAlertRequest(BaseModel):
+    log_ids: List[str]
+    action: str
+
 class UpdateEmergencyRequest(BaseModel):
     service_name: str
     phone_number: str
@@ -94,27 +112,13 @@ class PredictionResponseItem(BaseModel):
     polygon: List[List[float]]
     color: str
 
-def get_db_connection():
-    try:
-        return mysql.connector.connect(**DB_CONFIG)
-    except Exception as e:
-        print(f"Error connecting to DB: {e}")
-        return None
-
 def load_resources():
-    global STATIC_DATA_CACHE, ML_MODEL, SCALER, LOCATION_LOOKUP_DF
+    global STATIC_DATA_CACHE, LOCATION_LOOKUP_DF
+    global LOCATION_TREE, LOCATION_TAMBONS, LOCATION_DISTRICTS
     
-    print("Loading ML Model...")
-    try:
-        ML_MODEL = joblib.load(os.path.join(PROJECT_ROOT, 'ml_pipeline', 'models', 'best_ml_model.pkl'))
-    except Exception as e:
-        print("Warning: best_ml_model.pkl not found.")
-        
-    print("Loading Scaler...")
-    try:
-        SCALER = joblib.load(os.path.join(PROJECT_ROOT, 'ml_pipeline', 'models', 'landslide_scaler.pkl'))
-    except Exception as e:
-        print("Warning: landslide_scaler.pkl not found.")
+    # model ที่สลับไปแล้วระหว่างรัน (hot reload) ไม่โหลดทับ — โหลดเฉพาะตอน startup หรือยังไม่มี model
+    if MODEL_BUNDLE is None or MODEL_BUNDLE.model is None:
+        load_active_model()
 
     print("Loading Location Lookup CSV...")
     csv_path = os.path.join(PROJECT_ROOT, 'ml_pipeline', 'data', 'nan_province_data.csv')
@@ -124,11 +128,29 @@ def load_resources():
     except Exception as e:
         print(f"Warning: nan_province_data.csv not found: {e}")
         LOCATION_LOOKUP_DF = None
+
+    LOCATION_TREE = LOCATION_TAMBONS = LOCATION_DISTRICTS = None
+    if LOCATION_LOOKUP_DF is not None and not LOCATION_LOOKUP_DF.empty:
+        try:
+            coords = LOCATION_LOOKUP_DF[['LATITUDE', 'LONGITUDE']].to_numpy(dtype=float)
+            LOCATION_TREE = BallTree(np.radians(coords), metric='haversine')
+            LOCATION_TAMBONS = LOCATION_LOOKUP_DF['TAMBON'].astype(str).to_numpy()
+            LOCATION_DISTRICTS = LOCATION_LOOKUP_DF['DISTRICT'].astype(str).to_numpy()
+            print("Built haversine BallTree for tambon/district lookup.")
+        except Exception as e:
+            print(f"Warning: failed to build location index: {e}")
         
     print("Loading Static Nodes from Database into Cache...")
     conn = get_db_connection()
     if conn:
         try:
+            ensure_node_admin_area(conn)
+            ensure_rain_daily(conn)
+            ensure_prediction_history(conn)
+            ensure_prediction_runs(conn)
+            ensure_prediction_log_daily(conn)
+            ensure_notification_seq(conn)
+            ensure_indexes(conn)
             query = "SELECT * FROM static_nodes"
             STATIC_DATA_CACHE = pd.read_sql(query, conn)
             print(f"Loaded {len(STATIC_DATA_CACHE)} static nodes.")
@@ -137,21 +159,144 @@ def load_resources():
         finally:
             conn.close()
 
-def lookup_tambon_district(lat, lon):
-    if LOCATION_LOOKUP_DF is None or LOCATION_LOOKUP_DF.empty:
-        return None, None
+def load_active_model():
+    """โหลด version ที่ active ใน model registry (ยังไม่เคย activate / โหลดไม่ได้ -> ไฟล์ legacy เดิม)"""
+    global MODEL_BUNDLE
+    version = read_active()['active'] or LEGACY_VERSION
+    print(f"Loading ML Model ({version})...")
     try:
-        df = LOCATION_LOOKUP_DF
-        dist = ((df['LATITUDE'] - lat)**2 + (df['LONGITUDE'] - lon)**2)
-        idx = dist.idxmin()
-        return str(df.loc[idx, 'TAMBON']), str(df.loc[idx, 'DISTRICT'])
+        MODEL_BUNDLE = load_bundle(version, FEATURE_ORDER, RISK_THRESHOLDS, required=version != LEGACY_VERSION)
+    except Exception as e:
+        print(f"Warning: failed to load model {version}: {e}. Using legacy model files.")
+        MODEL_BUNDLE = load_bundle(LEGACY_VERSION, FEATURE_ORDER, RISK_THRESHOLDS, required=False)
+    INFERENCE.activate(MODEL_BUNDLE.fingerprint)
+
+def lookup_tambon_district_batch(lats, lons):
+    """
+    หา TAMBON/DISTRICT ที่ใกล้ที่สุด (ระยะ haversine) ของหลายพิกัดใน query เดียว
+    คืน (tambons, districts) เป็น list ยาวเท่า input (None ถ้าไม่มีข้อมูลหรือพิกัดไม่ถูกต้อง)
+    """
+    n = len(lats)
+    if LOCATION_TREE is None or n == 0:
+        return [None] * n, [None] * n
+    try:
+        coords = np.column_stack([
+            pd.to_numeric(pd.Series(lats), errors='coerce').to_numpy(dtype=float),
+            pd.to_numeric(pd.Series(lons), errors='coerce').to_numpy(dtype=float),
+        ])
+        valid = np.isfinite(coords).all(axis=1)
+        tambons, districts = [None] * n, [None] * n
+        if valid.any():
+            idx = LOCATION_TREE.query(np.radians(coords[valid]), k=1, return_distance=False)[:, 0]
+            for pos, t, d in zip(np.flatnonzero(valid).tolist(), LOCATION_TAMBONS[idx].tolist(), LOCATION_DISTRICTS[idx].tolist()):
+                tambons[pos] = t
+                districts[pos] = d
+        return tambons, districts
     except Exception as e:
         print(f"Lookup Error: {e}")
-        return None, None
+        return [None] * n, [None] * n
+
+def lookup_tambon_district(lat, lon):
+    tambons, districts = lookup_tambon_district_batch([lat], [lon])
+    return tambons[0], districts[0]
+
+def attach_tambon_district(rows, default=None):
+    """
+    เติม row['tambon'] / row['district'] ให้ทุกแถวของผลลัพธ์
+    แถวที่ JOIN static_nodes มาแล้วจะมีค่าอยู่แล้ว จะ geocode (batch ครั้งเดียว) เฉพาะแถวที่ยังว่าง
+    """
+    missing = [row for row in rows if not row.get('tambon') or not row.get('district')]
+    if missing:
+        tambons, districts = lookup_tambon_district_batch(
+            [row.get('latitude') for row in missing], [row.get('longitude') for row in missing]
+        )
+        for row, tambon, district in zip(missing, tambons, districts):
+            row['tambon'] = row.get('tambon') or tambon
+            row['district'] = row.get('district') or district
+    for row in rows:
+        if row.get('tambon') is None:
+            row['tambon'] = default
+        if row.get('district') is None:
+            row['district'] = default
+    return rows
+
+def ensure_node_admin_area(conn):
+    """
+    เพิ่ม column tambon/district ใน static_nodes ถ้ายังไม่มี (migration อัตโนมัติ)
+    แล้วเติมค่าให้ node ที่ยังว่างด้วย batch lookup ครั้งเดียว — node ไม่ขยับ จึงคำนวณครั้งเดียวพอ
+    """
+    try:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("ALTER TABLE static_nodes ADD COLUMN tambon VARCHAR(255) DEFAULT NULL")
+        except: pass
+        try:
+            cursor.execute("ALTER TABLE static_nodes ADD COLUMN district VARCHAR(100) DEFAULT NULL")
+        except: pass
+        try:
+            cursor.execute("CREATE INDEX idx_static_nodes_district ON static_nodes (district)")
+        except: pass
+
+        if LOCATION_TREE is not None:
+            cursor.execute("SELECT node_id, latitude, longitude FROM static_nodes WHERE tambon IS NULL OR district IS NULL")
+            nodes = cursor.fetchall()
+            if nodes:
+                tambons, districts = lookup_tambon_district_batch([n[1] for n in nodes], [n[2] for n in nodes])
+                updates = [(t, d, n[0]) for n, t, d in zip(nodes, tambons, districts) if t is not None]
+                cursor.executemany("UPDATE static_nodes SET tambon = %s, district = %s WHERE node_id = %s", updates)
+                print(f"Backfilled tambon/district for {len(updates)} static nodes.")
+        conn.commit()
+        cursor.close()
+    except Exception as e:
+        print(f"[WARN] ensure_node_admin_area: {e}")
+
+# Secondary indexes ที่ query หลักต้องใช้ (สร้างอัตโนมัติตอน startup ถ้ายังไม่มี)
+DB_INDEXES = [
+    # bbox prefilter หา user ในรัศมีแจ้งเตือน (verify_alert)
+    ("idx_user_locations_lat_lon", "user_locations", "latitude, longitude"),
+    # keyset pagination ของ /api/notifications/{user_id} (seq จาก ensure_notification_seq)
+    ("idx_notifications_user_seq", "notifications", "user_id, seq"),
+    # log ของรอบ (run_id) เช่น retention หาฝนของรอบที่ไม่เหลือ log แล้ว
+    ("idx_prediction_logs_run_status_prob", "prediction_logs", "run_id, status, probability"),
+    # log ล่าสุดของแต่ละ node (pending alerts, retention ไม่ยุบ log ล่าสุดของ node)
+    ("idx_prediction_logs_node_time", "prediction_logs", "node_id, timestamp"),
+    # retention: หา log pending ที่เก่ากว่า N วันทีละวัน (rollup_pending_logs)
+    # + admin alert history ต่อ status (InnoDB ต่อ PK log_id ท้าย index ให้เอง จึงเรียง (timestamp, log_id) ได้เลย)
+    ("idx_prediction_logs_status_time", "prediction_logs", "status, timestamp"),
+    # admin notification history: 1 ช่วงของ index ต่อ risk_level เรียง (timestamp, log_id)
+    ("idx_prediction_logs_risk_time_id", "prediction_logs", "risk_level, timestamp, log_id"),
+]
+
+def ensure_indexes(conn):
+    try:
+        cursor = conn.cursor()
+        for name, table, columns in DB_INDEXES:
+            try:
+                cursor.execute(f"CREATE INDEX {name} ON {table} ({columns})")
+            except: pass
+        conn.commit()
+        cursor.close()
+    except Exception as e:
+        print(f"[WARN] ensure_indexes: {e}")
 
 @app.on_event("startup")
 async def startup_event():
+    global NOTIFICATION_LOOP
+    NOTIFICATION_LOOP = asyncio.get_running_loop()
     load_resources()
+    get_predictions_snapshot()
+    INFERENCE.warm(MODEL_BUNDLE.model_path, MODEL_BUNDLE.scaler_path, MODEL_BUNDLE.fingerprint)
+    if SCHEDULER_ENABLED:
+        SCHEDULER.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await SCHEDULER.stop()
+    INFERENCE.shutdown()
+
+@app.get("/api/health/db")
+def health_db():
+    return db_health()
 
 # Calculate polygon corners (2x2km box)
 def calculate_2x2_polygon(lat, lon):
@@ -165,187 +310,900 @@ def calculate_2x2_polygon(lat, lon):
         [lat - lat_offset, lon - lon_offset]  # Bottom Left
     ]
 
-async def fetch_weather_for_grid(client, grid_id, lat, lon):
-    url = f"https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={lon}&daily=precipitation_sum&past_days=10&forecast_days=1&timezone=auto"
+def calculate_2x2_polygons(lats, lons):
+    """Vectorized calculate_2x2_polygon: คืน array รูป (n, 4, 2) ลำดับมุมเดียวกัน"""
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    lat_offset = 1.0 / 110.574
+    lon_offset = 1.0 / (111.320 * np.cos(np.radians(lats)))
+
+    top, bottom = lats + lat_offset, lats - lat_offset
+    left, right = lons - lon_offset, lons + lon_offset
+    return np.stack([
+        np.stack([top, left], axis=1),     # Top Left
+        np.stack([top, right], axis=1),    # Top Right
+        np.stack([bottom, right], axis=1), # Bottom Right
+        np.stack([bottom, left], axis=1),  # Bottom Left
+    ], axis=1)
+
+# Risk thresholds (probability ของคลาส 1) — ค่า default ถ้า metadata ของ model version ไม่ได้กำหนด
+RISK_HIGH_THRESHOLD = 0.60
+RISK_MEDIUM_THRESHOLD = 0.18
+RISK_THRESHOLDS = (RISK_MEDIUM_THRESHOLD, RISK_HIGH_THRESHOLD)
+RISK_LEVELS = np.array(["Low", "Medium", "High"])
+RISK_COLORS = np.array(["#00FF00", "#FFFF00", "#FF0000"])
+
+def classify_risk(probs, thresholds=RISK_THRESHOLDS):
+    """แปลง probability ทั้ง array เป็น risk code 0=Low, 1=Medium, 2=High (thresholds = (medium, high))"""
+    probs = np.asarray(probs, dtype=float)
+    medium, high = thresholds
+    return (probs >= medium).astype(np.int8) + (probs >= high).astype(np.int8)
+
+FEATURE_ORDER = [
+    'CHIRPS_Day_1', 'CHIRPS_Day_2', 'CHIRPS_Day_3', 'CHIRPS_Day_4', 'CHIRPS_Day_5', 
+    'CHIRPS_Day_6', 'CHIRPS_Day_7', 'CHIRPS_Day_8', 'CHIRPS_Day_9', 'CHIRPS_Day_10', 
+    'elevation_extracted', 'slope_extracted', 'aspect_extracted', 'modis_lc', 
+    'ndvi', 'ndwi', 'twi', 'soil_type', 'road_zone', 
+    'Rain_3D_Prior', 'Rain_5D_Prior', 'Rain_7D_Prior', 'Rain_10D_Prior',
+    'Rain3D_x_Slope', 'Rain5D_x_Slope', 'Rain7D_x_Slope', 'Rain10D_x_Slope'
+]
+
+RAIN_DAYS = 10
+RAIN_PRIOR_WINDOWS = (3, 5, 7, 10)
+
+def build_rain_features(grid_ids, rain_map):
+    """
+    Broadcast ฝน 10 วันของแต่ละ grid ลงทุก node ในครั้งเดียว
+    factorize grid_id -> สร้าง matrix (grid x 10 วัน) -> fancy-index เข้า node rows
+    แล้วคำนวณ Rain_xD_Prior ด้วย cumsum ครั้งเดียว
+    grid ที่ไม่มีข้อมูล (หรือค่าที่เป็น None) ถือเป็น 0 เหมือน default เดิม [0]*10
+    """
+    codes, uniques = pd.factorize(pd.Series(grid_ids), use_na_sentinel=True)
+
+    # แถวสุดท้ายเป็นศูนย์ไว้รองรับ grid_id ที่เป็น NaN (code = -1)
+    grid_rain = np.zeros((len(uniques) + 1, RAIN_DAYS), dtype=float)
+    for g_idx, grid_id in enumerate(uniques):
+        rain = rain_map.get(grid_id)
+        if rain:
+            vals = np.asarray(rain[:RAIN_DAYS], dtype=float)
+            grid_rain[g_idx, :len(vals)] = vals
+    grid_rain = np.nan_to_num(grid_rain, nan=0.0)
+
+    node_rain = grid_rain[codes]
+    cumulative = np.cumsum(node_rain, axis=1)
+
+    features = {f'CHIRPS_Day_{day}': node_rain[:, day - 1] for day in range(1, RAIN_DAYS + 1)}
+    for window in RAIN_PRIOR_WINDOWS:
+        features[f'Rain_{window}D_Prior'] = cumulative[:, window - 1]
+    return features
+
+def build_prediction_outputs(df, probs, log_mask=None, thresholds=RISK_THRESHOLDS, run_id=None):
+    """
+    สร้าง log tuples (สำหรับ prediction_logs) และ response payload ของทุก node แบบ column-wise
+    แทนการวน df.iterrows() ทีละแถว — log_mask (bool array) เลือกเฉพาะ node ที่ต้องเขียน log
+    log ไม่เก็บ features แล้ว (ประกอบกลับจาก static_nodes + prediction_run_rain ตอนเปิดดู)
+    """
+    n = len(df)
+    probs = np.asarray(probs, dtype=float)
+    codes = classify_risk(probs, thresholds)
+    risks = RISK_LEVELS[codes].tolist()
+    colors = RISK_COLORS[codes].tolist()
+
+    node_ids = df['node_id'].tolist()
+    lats = df['latitude'].to_numpy(dtype=float)
+    lons = df['longitude'].to_numpy(dtype=float)
+    polygons = calculate_2x2_polygons(lats, lons).tolist()
+
+    log_idx = np.arange(n) if log_mask is None else np.flatnonzero(log_mask)
+    m = len(log_idx)
+    log_ids = [str(uuid.uuid4()) for _ in range(m)]
+
+    log_inserts = list(zip(
+        log_ids, [run_id] * m, np.asarray(node_ids, dtype=object)[log_idx].tolist(),
+        np.asarray(risks, dtype=object)[log_idx].tolist(), probs[log_idx].tolist(), ['pending'] * m
+    ))
+    response_payload = [
+        {"id": str(nid), "latitude": la, "longitude": lo, "risk_level": r, "color": c, "polygon": poly}
+        for nid, la, lo, r, c, poly in zip(node_ids, lats.tolist(), lons.tolist(), risks, colors, polygons)
+    ]
+    return log_inserts, response_payload
+
+# =============================================================
+# RAIN STORE: ฝนรายวันต่อ grid (rain_daily) + delta refresh
+# =============================================================
+# หน้าต่างฝนของโมเดล = 10 วันย้อนหลังจบที่เมื่อวาน (ตรงกับ past_days=10 เดิม)
+# ฝนของวันที่ผ่านไปแล้วไม่เปลี่ยน จึงเก็บรายวันแล้วดึงเฉพาะวันที่ยังไม่มี
+
+def ensure_rain_daily(conn):
+    """
+    สร้างตาราง rain_daily ถ้ายังไม่มี แล้วย้ายข้อมูลจาก rain_grids.rain_values_json เดิม (ถ้ายังมี column นี้)
+    ค่าใน blob เดิมคือ 10 วันที่จบที่วันก่อน last_updated
+    """
     try:
-        response = await client.get(url, timeout=10.0)
-        data = response.json()
-        precip = data.get('daily', {}).get('precipitation_sum', [0]*11)
-        return {"grid_id": grid_id, "lat": lat, "lon": lon, "rain": precip[:10]}
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS rain_daily (
+                grid_id VARCHAR(50) NOT NULL,
+                rain_date DATE NOT NULL,
+                precipitation_mm FLOAT NOT NULL DEFAULT 0,
+                fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                PRIMARY KEY (grid_id, rain_date),
+                KEY idx_rain_daily_date (rain_date),
+                FOREIGN KEY (grid_id) REFERENCES rain_grids(grid_id) ON DELETE CASCADE
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci
+        """)
+        cursor.execute("SHOW COLUMNS FROM rain_grids LIKE 'rain_values_json'")
+        if cursor.fetchall():
+            cursor.execute(f"""
+                INSERT IGNORE INTO rain_daily (grid_id, rain_date, precipitation_mm)
+                SELECT rg.grid_id, DATE(rg.last_updated) - INTERVAL ({RAIN_DAYS} - d.n) DAY,
+                       JSON_EXTRACT(rg.rain_values_json, CONCAT('$[', d.n, ']'))
+                FROM rain_grids rg
+                JOIN ({" UNION ALL ".join(f"SELECT {i} AS n" for i in range(RAIN_DAYS))}) d
+                WHERE JSON_EXTRACT(rg.rain_values_json, CONCAT('$[', d.n, ']')) IS NOT NULL
+            """)
+            print(f"Migrated {cursor.rowcount} daily rain values from rain_grids.rain_values_json.")
+            cursor.execute("ALTER TABLE rain_grids DROP COLUMN rain_values_json")
+        conn.commit()
+        cursor.close()
     except Exception as e:
-        print(f"Error fetching Open-Meteo for grid {grid_id}: {e}")
-        return {"grid_id": grid_id, "lat": lat, "lon": lon, "rain": [0]*10}
+        print(f"[WARN] ensure_rain_daily: {e}")
 
-async def fetch_weather_batch(grids):
-    semaphore = asyncio.Semaphore(5)
-    
-    async def fetch_with_delay(client, g):
-        async with semaphore:
-            await asyncio.sleep(0.2)
-            return await fetch_weather_for_grid(client, g['grid_id'], g['lat'], g['lon'])
-
-    async with httpx.AsyncClient() as client:
-        tasks = [fetch_with_delay(client, g) for g in grids]
-        results = await asyncio.gather(*tasks)
-        
-    return results
+def rain_window_dates(end_date=None):
+    """RAIN_DAYS วันเรียงจากเก่าไปใหม่ จบที่ end_date (default = เมื่อวาน)"""
+    end_date = end_date or (datetime.date.today() - datetime.timedelta(days=1))
+    return [end_date - datetime.timedelta(days=RAIN_DAYS - 1 - i) for i in range(RAIN_DAYS)]
 
-@app.post("/trigger-prediction")
-async def trigger_prediction():
+def load_rain_daily(start_date, end_date):
+    """ฝนที่เก็บไว้ในช่วงวันที่กำหนด: dict grid_id -> {date: mm} (DB ใช้ไม่ได้ -> {})"""
+    conn = get_db_connection()
+    if not conn:
+        return {}
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT grid_id, rain_date, precipitation_mm FROM rain_daily WHERE rain_date BETWEEN %s AND %s",
+            (start_date, end_date)
+        )
+        stored = {}
+        for grid_id, rain_date, mm in cursor.fetchall():
+            stored.setdefault(grid_id, {})[rain_date] = float(mm)
+        return stored
+    except Exception as e:
+        print(f"Warning: Failed to load rain_daily: {e}")
+        return {}
+    finally:
+        cursor.close()
+        conn.close()
+
+def save_rain_daily(grids, fetched):
+    """Upsert ฝนรายวันที่เพิ่งดึงมา + อัปเดต last_updated ของ grid นั้นใน rain_grids"""
+    if not fetched:
+        return
+    conn = get_db_connection()
+    if not conn:
+        return
+    cursor = conn.cursor()
+    grid_rows = [(g['grid_id'], float(g['lat']), float(g['lon'])) for g in grids if g['grid_id'] in fetched]
+    day_rows = [(gid, d, mm) for gid, days in fetched.items() for d, mm in days.items()]
+    try:
+        cursor.executemany("""
+            INSERT INTO rain_grids (grid_id, center_lat, center_long)
+            VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+            center_lat=VALUES(center_lat), center_long=VALUES(center_long), last_updated=CURRENT_TIMESTAMP
+        """, grid_rows)
+        cursor.executemany("""
+            INSERT INTO rain_daily (grid_id, rain_date, precipitation_mm)
+            VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE precipitation_mm=VALUES(precipitation_mm)
+        """, day_rows)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"Warning: Failed to save rain_daily: {e}")
+    finally:
+        cursor.close()
+        conn.close()
+
+async def refresh_rain_window(grids, end_date=None):
+    """
+    ประกอบหน้าต่างฝน 10 วันของทุก grid จาก rain_daily แล้วดึงจาก Open-Meteo เฉพาะวันที่ยังขาด
+    grid ที่ขาดช่วงวันเดียวกันถูกรวม batch กัน (ปกติขาดแค่เมื่อวาน -> 1 วันต่อ grid)
+    คืน (rain_results แบบเดียวกับ fetch_weather_batch, จำนวน grid ที่ต้องดึง)
+    """
+    dates = rain_window_dates(end_date)
+    stored = await run_db(load_rain_daily, dates[0], dates[-1])
+
+    groups = {}
+    for g in grids:
+        have = stored.get(g['grid_id'], {})
+        missing = [d for d in dates if d not in have]
+        if missing:
+            groups.setdefault((missing[0], missing[-1]), []).append(g)
+
+    fetched = await fetch_rain_ranges(groups) if groups else {}
+    await run_db(save_rain_daily, grids, fetched)
+    grids_fetched = sum(len(v) for v in groups.values())
+    if grids_fetched:
+        print(f"[RAIN] Fetched missing days for {len(fetched)}/{grids_fetched} grids; {len(grids) - grids_fetched} grids already complete in rain_daily.")
+
+    rain_results = []
+    for g in grids:
+        days = {**stored.get(g['grid_id'], {}), **fetched.get(g['grid_id'], {})}
+        rain_results.append({"grid_id": g['grid_id'], "lat": g['lat'], "lon": g['lon'], "rain": [days.get(d, 0) for d in dates]})
+    return rain_results, grids_fetched
+
+def get_rain_trend(cursor, grid_id, end_date=None):
+    """ฝน 10 วันของ grid เดียว (วันที่ไม่มีข้อมูล = 0) สำหรับ dashboard / alert details (cursor แบบ dictionary)"""
+    if not grid_id:
+        return []
+    dates = rain_window_dates(end_date)
+    cursor.execute(
+        "SELECT rain_date, precipitation_mm FROM rain_daily WHERE grid_id = %s AND rain_date BETWEEN %s AND %s",
+        (grid_id, dates[0], dates[-1])
+    )
+    days = {r['rain_date']: float(r['precipitation_mm']) for r in cursor.fetchall()}
+    return [days.get(d, 0) for d in dates]
+
+# =============================================================
+# PREDICTION HISTORY: log แบบ compact + ประกอบ features ย้อนหลัง
+# =============================================================
+# prediction_logs เก็บแค่ node, run_id, risk_level (ENUM = 1 byte), probability, status
+# ฝน 10 วันของรอบเก็บครั้งเดียวต่อ grid ใน prediction_run_rain (float64 x 10 แบบ packed)
+# static features อ้างจาก static_nodes ตาม node_id -> get_alert_details ประกอบ 27 features กลับเมื่อเปิดดู
+# (log เก่าที่มี features_json อยู่แล้วใช้ค่าที่เก็บไว้ตามเดิม)
+STATIC_FEATURES = [
+    'elevation_extracted', 'slope_extracted', 'aspect_extracted', 'modis_lc',
+    'ndvi', 'ndwi', 'twi', 'soil_type', 'road_zone',
+]
+RAIN_VECTOR_DTYPE = np.dtype('<f8')
+
+def ensure_prediction_history(conn):
+    """
+    เปลี่ยน prediction_logs เป็นแบบ compact: เพิ่ม run_id, risk_level เป็น ENUM, สร้าง prediction_run_rain
+    features_json (nullable) คงไว้ให้ log เก่า — log ใหม่ไม่เขียนแล้ว แต่ของเดิมเป็นค่าที่โมเดลเห็นจริง ประกอบกลับไม่ได้
+    """
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS prediction_run_rain (
+                run_id CHAR(36) NOT NULL,
+                grid_id VARCHAR(50) NOT NULL,
+                rain_mm VARBINARY({RAIN_DAYS * RAIN_VECTOR_DTYPE.itemsize}) NOT NULL,
+                PRIMARY KEY (run_id, grid_id)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci
+        """)
+        cursor.execute("SHOW COLUMNS FROM prediction_logs LIKE 'run_id'")
+        if not cursor.fetchall():
+            cursor.execute("ALTER TABLE prediction_logs ADD COLUMN run_id CHAR(36) DEFAULT NULL AFTER log_id")
+        cursor.execute("SHOW COLUMNS FROM prediction_logs LIKE 'risk_level'")
+        column = cursor.fetchone()
+        column_type = column[1].decode() if column and isinstance(column[1], (bytes, bytearray)) else str(column and column[1])
+        if column and not column_type.lower().startswith('enum'):
+            cursor.execute("ALTER TABLE prediction_logs MODIFY risk_level ENUM('Low', 'Medium', 'High') NOT NULL")
+        conn.commit()
+        cursor.close()
+    except Exception as e:
+        print(f"[WARN] ensure_prediction_history: {e}")
+
+def encode_rain_vector(rain):
+    """ฝน RAIN_DAYS วัน -> bytes (ค่าที่ขาด/None = 0 เหมือนที่โมเดลเห็น)"""
+    vec = np.zeros(RAIN_DAYS, dtype=RAIN_VECTOR_DTYPE)
+    if rain:
+        vals = np.asarray(rain[:RAIN_DAYS], dtype=float)
+        vec[:len(vals)] = vals
+    return np.nan_to_num(vec, nan=0.0).tobytes()
+
+def decode_rain_vector(blob):
+    return np.frombuffer(bytes(blob), dtype=RAIN_VECTOR_DTYPE).tolist()
+
+def build_run_rain(run_id, grid_ids, rain_map):
+    """แถวของ prediction_run_rain: 1 แถวต่อ grid ที่มี node ถูก log ในรอบนี้"""
+    grids = pd.unique(pd.Series(grid_ids).dropna())
+    return [(run_id, g, encode_rain_vector(rain_map.get(g))) for g in grids]
+
+def add_rain_features(df, rain_map):
+    """เติมคอลัมน์ฝน 10 วัน + Rain_xD_Prior + RainxD_x_Slope ลง df (ต้องมี grid_id, slope_extracted)"""
+    for col, values in build_rain_features(df['grid_id'], rain_map).items():
+        df[col] = values
+    for window in RAIN_PRIOR_WINDOWS:
+        df[f'Rain{window}D_x_Slope'] = df[f'Rain_{window}D_Prior'] * df['slope_extracted']
+    return df
+
+def rebuild_log_features(static, grid_id, rain):
+    """27 features ที่ใช้ทำนาย log หนึ่งแถว เรียงตาม FEATURE_ORDER (NaN -> None แบบ features_json เดิม)"""
+    df = pd.DataFrame([{**static, 'grid_id': grid_id}])
+    add_rain_features(df, {grid_id: rain})
+    return json.loads(df[FEATURE_ORDER].to_json(orient='records'))[0]
+
+def get_run_rain(cursor, run_id, grid_id):
+    """
+    ฝน 10 วันที่รอบ run_id ใช้กับ grid นี้ (cursor แบบ dictionary)
+    node ที่ไม่มี grid = [] (โมเดลเห็นเป็น 0), ไม่มีแถวของรอบนี้ (run legacy) = None
+    """
+    if not grid_id:
+        return []
+    cursor.execute("SELECT rain_mm FROM prediction_run_rain WHERE run_id = %s AND grid_id = %s", (run_id, grid_id))
+    row = cursor.fetchone()
+    return decode_rain_vector(row['rain_mm']) if row else None
+
+# =============================================================
+# PREDICTION RUNS: 1 แถวต่อรอบทำนาย (model version, จำนวน node / log)
+# =============================================================
+def ensure_prediction_runs(conn):
+    """
+    สร้าง prediction_runs แล้วผูก log เก่าที่ยังไม่มี run_id เข้ากับ run สังเคราะห์รายวัน ('legacy-YYYYMMDD')
+    ให้ query แบบ run-scoped เห็นข้อมูลเดิมครบ
+    """
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS prediction_runs (
+                run_id CHAR(36) PRIMARY KEY,
+                started_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                finished_at TIMESTAMP NULL DEFAULT NULL,
+                model_version VARCHAR(64) DEFAULT NULL,
+                nodes_total INT NOT NULL DEFAULT 0,
+                nodes_scored INT NOT NULL DEFAULT 0,
+                logs_written INT NOT NULL DEFAULT 0,
+                KEY idx_prediction_runs_started (started_at)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci
+        """)
+        cursor.execute("SELECT 1 FROM prediction_logs WHERE run_id IS NULL LIMIT 1")
+        if cursor.fetchall():
+            cursor.execute("""
+                INSERT IGNORE INTO prediction_runs (run_id, started_at, finished_at, model_version, logs_written)
+                SELECT CONCAT('legacy-', DATE_FORMAT(MIN(timestamp), '%Y%m%d')), MIN(timestamp), MAX(timestamp), 'legacy', COUNT(*)
+                FROM prediction_logs
+                WHERE run_id IS NULL
+                GROUP BY DATE(timestamp)
+            """)
+            cursor.execute("UPDATE prediction_logs SET run_id = CONCAT('legacy-', DATE_FORMAT(timestamp, '%Y%m%d')) WHERE run_id IS NULL")
+            print(f"Attached {cursor.rowcount} prediction logs to daily legacy runs.")
+        conn.commit()
+        cursor.close()
+    except Exception as e:
+        print(f"[WARN] ensure_prediction_runs: {e}")
+
+# =============================================================
+# PREDICTION LOG RETENTION: partition รายเดือน + rollup + ลบข้อมูลหมดอายุ (ดู retention.py)
+# =============================================================
+def ensure_prediction_log_daily(conn):
+    """สถิติรายวันต่อ node ของ log pending ที่ถูก rollup แล้ว (max_risk_code: 0=Low, 1=Medium, 2=High)"""
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS prediction_log_daily (
+                node_id INT NOT NULL,
+                log_date DATE NOT NULL,
+                samples INT NOT NULL DEFAULT 0,
+                prob_min FLOAT DEFAULT NULL,
+                prob_max FLOAT DEFAULT NULL,
+                prob_sum DOUBLE NOT NULL DEFAULT 0,
+                max_risk_code TINYINT NOT NULL DEFAULT 0,
+                PRIMARY KEY (node_id, log_date),
+                KEY idx_prediction_log_daily_date (log_date)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci
+        """)
+        conn.commit()
+        cursor.close()
+    except Exception as e:
+        print(f"[WARN] ensure_prediction_log_daily: {e}")
+
+def apply_retention(job=None):
+    """(blocking) แบ่ง partition ถ้ายังไม่แบ่ง -> สร้าง partition ล่วงหน้า -> ลบ log ของ node ที่ไม่มีแล้ว -> rollup log pending เก่า -> ลบข้อมูลหมดอายุ"""
+    conn = get_db_connection()
+    if not conn:
+        raise RuntimeError("Database connection error")
+    try:
+        report_progress(job, 0.05, "Checking prediction_logs partitions")
+        partitioned = ensure_partitioned(conn)
+        partitions_added = ensure_future_partitions(conn) if partitioned else 0
+
+        report_progress(job, 0.1, "Deleting logs of removed nodes")
+        orphaned = delete_orphaned_logs(conn)
+
+        report_progress(job, 0.2, "Rolling up old pending logs")
+        days, rows = rollup_pending_logs(
+            conn, PREDICTION_ROLLUP_AFTER_DAYS,
+            progress=lambda p: report_progress(job, 0.2 + 0.6 * p, "Rolling up old pending logs"),
+        )
+
+        report_progress(job, 0.85, "Dropping expired data")
+        expired = drop_expired(conn, PREDICTION_LOG_RETENTION_MONTHS, partitioned=partitioned)
+        print(f"[RETENTION] Rolled up {rows} logs over {days} days, expired: {expired}")
+        return {
+            "status": "success",
+            "partitioned": partitioned,
+            "partitions_added": partitions_added,
+            "orphaned_logs_deleted": orphaned,
+            "rollup_days": days,
+            "rollup_logs": rows,
+            **expired,
+        }
+    finally:
+        conn.close()
+
+async def run_retention(job=None):
+    return await run_db(apply_retention, job)
+
+def save_prediction_logs(log_inserts, run_rain=(), run=None):
+    """
+    บันทึก prediction_logs + ฝนของรอบ + แถวของรอบใน prediction_runs (transaction เดียวกัน) คืน True ถ้าสำเร็จ
+    run = (run_id, started_at, finished_at, model_version, nodes_total, nodes_scored, logs_written)
+    """
+    conn = get_db_connection()
+    if not conn:
+        return False
+    cursor = conn.cursor()
+    try:
+        if run is not None:
+            cursor.execute("""
+                INSERT INTO prediction_runs (run_id, started_at, finished_at, model_version, nodes_total, nodes_scored, logs_written)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+            """, run)
+        # Batch insert prediction_logs in chunks to avoid max_allowed_packet
+        BATCH_SIZE = 1000
+        for i in range(0, len(run_rain), BATCH_SIZE):
+            cursor.executemany("INSERT INTO prediction_run_rain (run_id, grid_id, rain_mm) VALUES (%s, %s, %s)", run_rain[i:i+BATCH_SIZE])
+        if log_inserts:
+            for i in range(0, len(log_inserts), BATCH_SIZE):
+                batch = log_inserts[i:i+BATCH_SIZE]
+                cursor.executemany("INSERT INTO prediction_logs (log_id, run_id, node_id, risk_level, probability, status) VALUES (%s, %s, %s, %s, %s, %s)", batch)
+            
+        conn.commit()
+        return True
+    except Exception as e:
+        conn.rollback()
+        print(f"Failed to save prediction logs or notifications: {e}")
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+# =============================================================
+# INCREMENTAL PREDICTION: re-score เฉพาะ node ที่ input เปลี่ยน
+# =============================================================
+# fingerprint ต่อ node = hash ของ feature vector ทั้ง 27 ค่า (ฝน 10 วัน + static + interaction)
+# วันที่ฝนไม่เปลี่ยน node ส่วนใหญ่ได้ fingerprint เดิม จึงใช้ probability เดิมได้เลย
+# และเขียน prediction_logs เฉพาะ node ที่ risk เปลี่ยน หรือ probability ขยับเกิน PREDICTION_LOG_DELTA
+PREDICTION_STATE_PATH = os.path.join(PROJECT_ROOT, 'server', 'data', 'prediction_state.npz')
+PREDICTION_LOG_DELTA = float(os.environ.get('PREDICTION_LOG_DELTA', 0.05))
+PREDICTION_STATE = None
+
+def compute_input_fingerprints(X):
+    """uint64 ต่อแถวของ feature matrix (vectorized ทั้ง matrix)"""
+    return pd.util.hash_pandas_object(pd.DataFrame(X), index=False).to_numpy(dtype=np.uint64)
+
+def load_prediction_state():
+    """state ของรอบก่อน (node_ids, fingerprints, probs, logged_probs, logged_codes, model) โหลดจากไฟล์หลัง restart"""
+    global PREDICTION_STATE
+    if PREDICTION_STATE is None:
+        try:
+            with np.load(PREDICTION_STATE_PATH, allow_pickle=False) as data:
+                PREDICTION_STATE = {key: data[key] for key in data.files}
+            PREDICTION_STATE['model'] = str(PREDICTION_STATE['model'])
+        except Exception:
+            return None
+    return PREDICTION_STATE
+
+def save_prediction_state(state):
+    global PREDICTION_STATE
+    PREDICTION_STATE = state
+    try:
+        os.makedirs(os.path.dirname(PREDICTION_STATE_PATH), exist_ok=True)
+        tmp_path = PREDICTION_STATE_PATH + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **state)
+        os.replace(tmp_path, PREDICTION_STATE_PATH)
+    except Exception as e:
+        print(f"Warning: Failed to persist prediction state: {e}")
+
+def align_prediction_state(state, node_ids, model_fingerprint):
+    """เรียง state ของรอบก่อนให้ตรงกับ node_ids ปัจจุบัน (node ใหม่ / model เปลี่ยน = ไม่มี state)"""
+    n = len(node_ids)
+    prev = {
+        'fingerprints': np.zeros(n, dtype=np.uint64),
+        'probs': np.full(n, np.nan),
+        'logged_probs': np.full(n, np.nan),
+        'logged_codes': np.full(n, -1, dtype=np.int8),
+        'known': np.zeros(n, dtype=bool),
+    }
+    if state is None:
+        return prev
+    pos = pd.Index(state['node_ids']).get_indexer(node_ids)
+    found = pos >= 0
+    # ค่า log ล่าสุดยังใช้ได้แม้เปลี่ยน model แต่ probability เดิมใช้ไม่ได้แล้ว
+    prev['logged_probs'][found] = state['logged_probs'][pos[found]]
+    prev['logged_codes'][found] = state['logged_codes'][pos[found]]
+    if state.get('model') == model_fingerprint:
+        prev['fingerprints'][found] = state['fingerprints'][pos[found]]
+        prev['probs'][found] = state['probs'][pos[found]]
+        prev['known'] = found
+    return prev
+
+# scaler + model รันนอก event loop: batch เล็กใช้ thread, batch ใหญ่แบ่งให้ process pool (ดู inference.py)
+INFERENCE = InferenceExecutor()
+
+async def predict_probabilities(X_vals, bundle):
+    return await INFERENCE.predict(X_vals, bundle.predictor, bundle.model_path, bundle.scaler_path, bundle.fingerprint)
+
+def prepare_incremental_inputs(df, bundle):
+    """feature matrix + fingerprint ของทุก node เทียบกับ state รอบก่อน (งาน CPU ล้วน เรียกผ่าน run_in_threadpool)"""
+    node_ids = df['node_id'].to_numpy(dtype=np.int64)
+    X_vals = df[bundle.feature_order].fillna(0).to_numpy(dtype=float)
+    fingerprints = compute_input_fingerprints(X_vals)
+    prev = align_prediction_state(load_prediction_state(), node_ids, bundle.fingerprint)
+    changed = ~prev['known'] | (fingerprints != prev['fingerprints'])
+    return node_ids, X_vals, fingerprints, prev, changed
+
+async def score_nodes_incremental(df, bundle):
+    """
+    คืน (probs ทุก node, log_mask, n_scored, state ใหม่) ด้วย model bundle ที่รอบนี้จับไว้
+    re-score เฉพาะ node ที่ fingerprint เปลี่ยน / ไม่เคยมี / model เปลี่ยน
+    state ใหม่ให้ save_prediction_state หลังเขียน log สำเร็จแล้วเท่านั้น
+    """
+    node_ids, X_vals, fingerprints, prev, changed = await run_in_threadpool(prepare_incremental_inputs, df, bundle)
+    probs = prev['probs'].copy()
+    if changed.any():
+        probs[changed] = await predict_probabilities(X_vals[changed], bundle)
+
+    codes = classify_risk(probs, bundle.thresholds)
+    log_mask = (
+        (codes != prev['logged_codes'])
+        | ~(np.abs(probs - prev['logged_probs']) <= PREDICTION_LOG_DELTA)   # NaN (ไม่เคย log) -> log
+    )
+    logged_probs = np.where(log_mask, probs, prev['logged_probs'])
+    logged_codes = np.where(log_mask, codes, prev['logged_codes']).astype(np.int8)
+
+    state = {
+        'node_ids': node_ids,
+        'fingerprints': fingerprints,
+        'probs': probs,
+        'logged_probs': logged_probs,
+        'logged_codes': logged_codes,
+        'model': np.array(bundle.fingerprint),
+    }
+    return probs, log_mask, int(changed.sum()), state
+
+def report_progress(job, progress, message):
+    """รายงานความคืบหน้าของ job (ถ้าเรียกนอก scheduler job จะเป็น None)"""
+    if job is not None:
+        job.update(progress, message)
+
+async def ensure_static_cache():
     if STATIC_DATA_CACHE is None or STATIC_DATA_CACHE.empty:
         # Reload attempt
-        load_resources()
+        await run_db(load_resources)
         if STATIC_DATA_CACHE is None or STATIC_DATA_CACHE.empty:
             raise HTTPException(status_code=500, detail="Static cache empty. Insert nodes into static_nodes table first.")
-    
+
+def representative_grids(df):
+    """pick representative node coordinates for each grid (first node ของ grid)"""
+    unique_grids = df.drop_duplicates('grid_id')[['grid_id', 'latitude', 'longitude']]
+    return [
+        {'grid_id': g, 'lat': lat, 'lon': lon}
+        for g, lat, lon in zip(unique_grids['grid_id'], unique_grids['latitude'], unique_grids['longitude'])
+    ]
+
+async def run_rain_refresh(job=None):
+    """เติมฝนรายวันที่ขาดของทุก grid ลง rain_daily (ไม่รันโมเดล)"""
+    await ensure_static_cache()
+    grids = representative_grids(STATIC_DATA_CACHE)
+    report_progress(job, 0.1, f"Refreshing rain for {len(grids)} grids")
+    _, grids_fetched = await refresh_rain_window(grids)
+    return {"status": "success", "grids_total": len(grids), "grids_fetched": grids_fetched}
+
+def build_run_outputs(df, probs, log_mask, bundle, run_id, rain_map):
+    log_inserts, response_payload = build_prediction_outputs(df, probs, log_mask, bundle.thresholds, run_id)
+    run_rain = build_run_rain(run_id, df['grid_id'].to_numpy()[log_mask], rain_map)
+    return log_inserts, response_payload, run_rain
+
+async def run_prediction(job=None):
+    await ensure_static_cache()
+    # จับ model ไว้ตั้งแต่ต้นรอบ: ถ้ามีการสลับ version ระหว่างรัน รอบนี้ยังใช้ version เดิมจนจบ
+    bundle = MODEL_BUNDLE
+    if bundle is None or bundle.predictor is None:
+        raise HTTPException(status_code=500, detail="ML model not loaded.")
+    started_at = datetime.datetime.now()
     df = STATIC_DATA_CACHE.copy()
-    
-    unique_grids = df[['grid_id']].drop_duplicates()
-    grids_to_fetch = []
-    
-    for _, row in unique_grids.iterrows():
-        # pick representative node coordinates for this grid
-        grid_data = df[df['grid_id'] == row['grid_id']].iloc[0]
-        grids_to_fetch.append({
-            'grid_id': row['grid_id'],
-            'lat': grid_data['latitude'],
-            'lon': grid_data['longitude']
-        })
+    grids_to_fetch = representative_grids(df)
         
-    rain_results = await fetch_weather_batch(grids_to_fetch)
+    # ฝน 10 วันจาก rain_daily + ดึงเฉพาะวันที่ยังขาด (delta refresh)
+    report_progress(job, 0.05, f"Refreshing rain for {len(grids_to_fetch)} grids")
+    rain_results, grids_fetched = await refresh_rain_window(grids_to_fetch)
     rain_map = {r['grid_id']: r['rain'] for r in rain_results}
     
-    # Optional: Update rain_grids table to store current weather
-    conn = get_db_connection()
-    if conn:
-        cursor = conn.cursor()
-        grid_inserts = []
-        for r in rain_results:
-            grid_inserts.append((r['grid_id'], float(r['lat']), float(r['lon']), json.dumps(r['rain'])))
-        try:
-            # Upsert into rain_grids
-            cursor.executemany("""
-                INSERT INTO rain_grids (grid_id, center_lat, center_long, rain_values_json) 
-                VALUES (%s, %s, %s, %s)
-                ON DUPLICATE KEY UPDATE 
-                center_lat=VALUES(center_lat), center_long=VALUES(center_long), rain_values_json=VALUES(rain_values_json), last_updated=CURRENT_TIMESTAMP
-            """, grid_inserts)
-            conn.commit()
-        except Exception as e:
-            conn.rollback()
-            print(f"Warning: Failed to log to rain_grids: {e}")
-    
-    for day in range(1, 11):
-        df[f'CHIRPS_Day_{day}'] = df['grid_id'].apply(lambda g: rain_map.get(g, [0]*10)[day-1])
-        
-    df['Rain_3D_Prior'] = df['CHIRPS_Day_1'] + df['CHIRPS_Day_2'] + df['CHIRPS_Day_3']
-    df['Rain_5D_Prior'] = df['Rain_3D_Prior'] + df['CHIRPS_Day_4'] + df['CHIRPS_Day_5']
-    df['Rain_7D_Prior'] = df['Rain_5D_Prior'] + df['CHIRPS_Day_6'] + df['CHIRPS_Day_7']
-    df['Rain_10D_Prior'] = df['Rain_7D_Prior'] + df['CHIRPS_Day_8'] + df['CHIRPS_Day_9'] + df['CHIRPS_Day_10']
-    
-    df['Rain3D_x_Slope'] = df['Rain_3D_Prior'] * df['slope_extracted']
-    df['Rain5D_x_Slope'] = df['Rain_5D_Prior'] * df['slope_extracted']
-    df['Rain7D_x_Slope'] = df['Rain_7D_Prior'] * df['slope_extracted']
-    df['Rain10D_x_Slope'] = df['Rain_10D_Prior'] * df['slope_extracted']
+    # Rain join ครั้งเดียว: grid x 10 วัน -> gather เข้า node rows
+    # งาน pandas/numpy ก่อนและหลัง inference รันใน threadpool ทั้งหมด event loop ว่างรับ request ระหว่างรอบ
+    report_progress(job, 0.5, f"Scoring changed nodes out of {len(df)}")
+    await run_in_threadpool(add_rain_features, df, rain_map)
     
-    FEATURE_ORDER = [
-        'CHIRPS_Day_1', 'CHIRPS_Day_2', 'CHIRPS_Day_3', 'CHIRPS_Day_4', 'CHIRPS_Day_5', 
-        'CHIRPS_Day_6', 'CHIRPS_Day_7', 'CHIRPS_Day_8', 'CHIRPS_Day_9', 'CHIRPS_Day_10', 
-        'elevation_extracted', 'slope_extracted', 'aspect_extracted', 'modis_lc', 
-        'ndvi', 'ndwi', 'twi', 'soil_type', 'road_zone', 
-        'Rain_3D_Prior', 'Rain_5D_Prior', 'Rain_7D_Prior', 'Rain_10D_Prior',
-        'Rain3D_x_Slope', 'Rain5D_x_Slope', 'Rain7D_x_Slope', 'Rain10D_x_Slope'
-    ]
-    
-    X_vals = df[FEATURE_ORDER].fillna(0).values
+    probs, log_mask, nodes_scored, state = await score_nodes_incremental(df, bundle)
     
-    if SCALER:
-        X_vals = SCALER.transform(X_vals)
+    # Compile Logs (vectorized: risk/color/polygon ทั้ง batch) + ฝนของรอบ 1 แถวต่อ grid ที่มี log
+    run_id = str(uuid.uuid4())
+    log_inserts, response_payload, run_rain = await run_in_threadpool(build_run_outputs, df, probs, log_mask, bundle, run_id, rain_map)
         
-    probs = ML_MODEL.predict_proba(X_vals)[:, 1] if ML_MODEL.classes_.shape[0] > 1 else ML_MODEL.predict(X_vals)
-    
-    # Compile Logs and Notifications
-    log_inserts = []
-    notification_inserts = []
-    response_payload = []
-    
-    for i, row in df.iterrows():
-        node_id = row['node_id']
-        prob = float(probs[i])
-        
-        risk = "Low"
-        color = "#00FF00"
-        if prob >= 0.60:
-            risk = "High"
-            color = "#FF0000"
-        elif prob >= 0.18:
-            risk = "Medium"
-            color = "#FFFF00"
+    report_progress(job, 0.8, f"Saving {len(log_inserts)} prediction logs")
+    run = (run_id, started_at, datetime.datetime.now(), bundle.version, len(df), nodes_scored, len(log_inserts))
+    if await run_db(save_prediction_logs, log_inserts, run_rain, run):
+        await run_in_threadpool(save_prediction_state, state)
             
-        log_id = str(uuid.uuid4())
-        
-        # Capture the 23 features from this row
-        row_features = df.iloc[i][FEATURE_ORDER].to_dict()
-        features_json = json.dumps(row_features)
-        
-        # Appending status 'pending' and features_json
-        log_inserts.append((log_id, node_id, risk, prob, 'pending', features_json))
+    # sort + json.dumps + gzip + เขียนไฟล์ snapshot (สลับ snapshot ภายใต้ PREDICTIONS_LOCK)
+    snapshot = await run_in_threadpool(publish_predictions, response_payload)
         
-        poly = calculate_2x2_polygon(row['latitude'], row['longitude'])
-        response_payload.append({
-            "id": str(node_id),
-            "latitude": float(row['latitude']),
-            "longitude": float(row['longitude']),
-            "risk_level": risk,
-            "color": color,
-            "polygon": poly
-        })
-        
-    if conn:
+    return {"status": "success", "grids_total": len(grids_to_fetch), "grids_fetched": grids_fetched, "points_predicted": len(response_payload),
+            "nodes_scored": nodes_scored, "logs_written": len(log_inserts), "snapshot_version": snapshot['version'],
+            "model_version": bundle.version, "run_id": run_id}
+
+@app.post("/trigger-prediction")
+async def trigger_prediction(wait: bool = False, force: bool = False):
+    """
+    สั่งรันโมเดลเป็น background job (wait=true เพื่อรอผลแบบเดิม)
+    กดซ้ำระหว่างรัน -> ได้ job เดิม, เพิ่งรันเสร็จไม่เกิน PREDICTION_MIN_INTERVAL_S -> ได้ผลล่าสุด (force=true เพื่อรันใหม่)
+    """
+    return await submit_job_response("prediction", wait, force)
+
+
+# Z-Index Priority: Green (Low) -> Yellow (Medium) -> Red (High)
+PREDICTION_COLOR_ORDER = {"#00FF00": 1, "#FFFF00": 2, "#FF0000": 3}
+
+def publish_predictions(payload, persist=True):
+    """
+    เรียงผลทำนายตาม Z-Index แล้ว serialize + gzip ครั้งเดียว เก็บเป็น snapshot ใน memory
+    พร้อม version/ETag ใหม่ ทุก request ของ /api/predictions จะส่ง bytes ชุดนี้โดยไม่ต้อง parse/sort ซ้ำ
+    """
+    global PREDICTIONS_SNAPSHOT, PREDICTIONS_VERSION
+    items = sorted(payload, key=lambda x: PREDICTION_COLOR_ORDER.get(x.get('color'), 0))
+    body = json.dumps(items, separators=(',', ':')).encode('utf-8')
+    digest = hashlib.sha1(body).hexdigest()[:16]
+    gzip_body = gzip.compress(body, compresslevel=6)
+
+    lats = np.array([x['latitude'] for x in items], dtype=float)
+    lons = np.array([x['longitude'] for x in items], dtype=float)
+    codes = np.array([PREDICTION_COLOR_ORDER.get(x.get('color'), 1) - 1 for x in items], dtype=np.int8)
+    node_ids = np.array([int(x['id']) if str(x['id']).isdigit() else -1 for x in items], dtype=np.int32)
+
+    with PREDICTIONS_LOCK:
+        PREDICTIONS_VERSION += 1
+        snapshot = {
+            "version": PREDICTIONS_VERSION,
+            "etag": f'"{PREDICTIONS_VERSION}-{digest}"',
+            "items": items,
+            "body": body,
+            "gzip_body": gzip_body,
+            "lats": lats,
+            "lons": lons,
+            "risk_codes": codes,
+            "node_ids": node_ids,
+            "grid_index": build_prediction_grid_index(lats, lons),
+        }
+        PREDICTIONS_SNAPSHOT = snapshot
+
+    if persist:
+        os.makedirs(os.path.dirname(PREDICTIONS_PATH), exist_ok=True)
+        tmp_path = PREDICTIONS_PATH + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, PREDICTIONS_PATH)
+    return snapshot
+
+def get_predictions_snapshot():
+    """คืน snapshot ปัจจุบัน (โหลดจาก latest_predictions.json ครั้งแรกหลัง restart)"""
+    if PREDICTIONS_SNAPSHOT is None:
         try:
-            # Batch insert prediction_logs in chunks to avoid max_allowed_packet
-            BATCH_SIZE = 200
-            if log_inserts:
-                for i in range(0, len(log_inserts), BATCH_SIZE):
-                    batch = log_inserts[i:i+BATCH_SIZE]
-                    cursor.executemany("INSERT INTO prediction_logs (log_id, node_id, risk_level, probability, status, features_json) VALUES (%s, %s, %s, %s, %s, %s)", batch)
-                
-            conn.commit()
-        except Exception as e:
-            conn.rollback()
-            print(f"Failed to save prediction logs or notifications: {e}")
-        finally:
-            cursor.close()
-            conn.close()
-            
-    data_dir = os.path.join(PROJECT_ROOT, 'server', 'data')
-    os.makedirs(data_dir, exist_ok=True)
-    with open(os.path.join(data_dir, 'latest_predictions.json'), 'w') as f:
-        json.dump(response_payload, f)
-        
-    return {"status": "success", "grids_fetched": len(unique_grids), "points_predicted": len(response_payload)}
+            with open(PREDICTIONS_PATH, 'r') as f:
+                publish_predictions(json.load(f), persist=False)
+        except Exception:
+            return None
+    return PREDICTIONS_SNAPSHOT
+
+# ---- Viewport query (bbox / zoom / risk) บน snapshot ----
+PREDICTION_INDEX_CELL_DEG = 0.05     # ขนาด cell ของ spatial grid index (~5.5 km)
+PREDICTION_CLUSTER_MAX_ZOOM = 11     # zoom <= ค่านี้ ส่ง cell ที่รวมแล้วแทน node รายตัว
+_GRID_KEY_STRIDE = 1 << 20
+_GRID_KEY_OFFSET = 1 << 19
+
+def _grid_keys(cy, cx):
+    return cy.astype(np.int64) * _GRID_KEY_STRIDE + (cx.astype(np.int64) + _GRID_KEY_OFFSET)
+
+def build_prediction_grid_index(lats, lons, cell_deg=PREDICTION_INDEX_CELL_DEG):
+    """จัดกลุ่ม index ของ node ตาม cell (lat/lon grid) เก็บเป็น sorted keys + slice ต่อ cell"""
+    cy = np.floor(lats / cell_deg)
+    cx = np.floor(lons / cell_deg)
+    keys = _grid_keys(cy, cx)
+    order = np.argsort(keys, kind='stable')
+    unique_keys, starts = np.unique(keys[order], return_index=True)
+    ends = np.append(starts[1:], len(order))
+    return {"cell_deg": cell_deg, "keys": unique_keys, "starts": starts, "ends": ends, "order": order}
+
+def query_prediction_bbox(snapshot, min_lon, min_lat, max_lon, max_lat):
+    """คืน index (เรียงตามลำดับ Z-Index เดิม) ของ node ที่อยู่ใน bbox โดยเปิดเฉพาะ cell ที่ทับ bbox"""
+    index = snapshot['grid_index']
+    cell = index['cell_deg']
+    # จำกัดช่วงก่อนคิด cell: bbox ใหญ่เกินโลกจะทำให้ np.arange ของแถว cell ใหญ่ตาม
+    min_lat, max_lat = min(max(min_lat, -90.0), 90.0), min(max(max_lat, -90.0), 90.0)
+    min_lon, max_lon = min(max(min_lon, -180.0), 180.0), min(max(max_lon, -180.0), 180.0)
+    cy0, cy1 = int(np.floor(min_lat / cell)), int(np.floor(max_lat / cell))
+    cx0, cx1 = int(np.floor(min_lon / cell)), int(np.floor(max_lon / cell))
+
+    rows = np.arange(cy0, cy1 + 1)
+    lo = np.searchsorted(index['keys'], _grid_keys(rows, np.full_like(rows, cx0)), side='left')
+    hi = np.searchsorted(index['keys'], _grid_keys(rows, np.full_like(rows, cx1)), side='right')
+    chunks = [index['order'][index['starts'][a]:index['ends'][b - 1]] for a, b in zip(lo, hi) if b > a]
+    if not chunks:
+        return np.empty(0, dtype=np.int64)
+
+    candidates = np.concatenate(chunks)
+    lats, lons = snapshot['lats'][candidates], snapshot['lons'][candidates]
+    inside = (lats >= min_lat) & (lats <= max_lat) & (lons >= min_lon) & (lons <= max_lon)
+    return np.sort(candidates[inside])
+
+def aggregate_prediction_cells(snapshot, idx, zoom):
+    """
+    รวม node เป็น cell ตามระดับ zoom (ประมาณ 8 cell ต่อความกว้าง 1 tile)
+    แต่ละ cell ใช้ schema เดียวกับ node + count และ risk สูงสุดใน cell
+    """
+    cell_deg = 360.0 / (2 ** zoom) / 8
+    lats, lons, codes = snapshot['lats'][idx], snapshot['lons'][idx], snapshot['risk_codes'][idx]
+    cy, cx = np.floor(lats / cell_deg), np.floor(lons / cell_deg)
+    keys, inverse = np.unique(_grid_keys(cy, cx), return_inverse=True)
+
+    counts = np.bincount(inverse, minlength=len(keys))
+    mean_lat = np.bincount(inverse, weights=lats, minlength=len(keys)) / counts
+    mean_lon = np.bincount(inverse, weights=lons, minlength=len(keys)) / counts
+    max_code = np.zeros(len(keys), dtype=np.int8)
+    np.maximum.at(max_code, inverse, codes)
+    cell_y = keys // _GRID_KEY_STRIDE
+    cell_x = keys % _GRID_KEY_STRIDE - _GRID_KEY_OFFSET
+
+    cells = []
+    for k in np.argsort(max_code, kind='stable').tolist():
+        south, west = float(cell_y[k] * cell_deg), float(cell_x[k] * cell_deg)
+        north, east = south + cell_deg, west + cell_deg
+        cells.append({
+            "id": f"cell_{zoom}_{int(cell_y[k])}_{int(cell_x[k])}",
+            "latitude": float(mean_lat[k]),
+            "longitude": float(mean_lon[k]),
+            "risk_level": str(RISK_LEVELS[max_code[k]]),
+            "color": str(RISK_COLORS[max_code[k]]),
+            "polygon": [[north, west], [north, east], [south, east], [south, west]],
+            "count": int(counts[k]),
+        })
+    return cells
 
+def parse_bbox(bbox: str):
+    """bbox = "minLon,minLat,maxLon,maxLat" (west,south,east,north)"""
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(v) for v in bbox.split(','))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox must be minLon,minLat,maxLon,maxLat")
+    if not all(math.isfinite(v) for v in (min_lon, min_lat, max_lon, max_lat)):
+        raise HTTPException(status_code=400, detail="bbox values must be finite numbers")
+    if min_lon > max_lon or min_lat > max_lat:
+        raise HTTPException(status_code=400, detail="bbox min must be <= max")
+    return min_lon, min_lat, max_lon, max_lat
+
+def parse_risk_filter(risk: str):
+    wanted = {r.strip().lower() for r in risk.split(',') if r.strip()}
+    codes = [i for i, level in enumerate(RISK_LEVELS.tolist()) if level.lower() in wanted]
+    if not codes:
+        raise HTTPException(status_code=400, detail="risk must be a comma list of Low, Medium, High")
+    return codes
+
+# ---- Compact binary feed (Accept: application/x-landslide-predictions) ----
+PREDICTIONS_BINARY_MEDIA_TYPE = "application/x-landslide-predictions"
+PREDICTIONS_BINARY_MAGIC = b'LSPR'
+PREDICTIONS_BINARY_FORMAT = 1
+PREDICTIONS_BINARY_FLAG_DELTA = 0x01
+_PREDICTIONS_BINARY_HEADER = struct.Struct('<4sBBHII')
+
+def encode_predictions_binary(snapshot, idx=None, delta=False):
+    """
+    Packed columnar layout (little-endian) ของ node ใน snapshot:
+
+        header  : magic 'LSPR' | format u8 (=1) | flags u8 | reserved u16 | count u32 | snapshot_version u32
+        node_id : int32[count]
+        lat_e6  : int32[count]   (latitude  * 1e6)
+        lon_e6  : int32[count]   (longitude * 1e6)
+        risk    : uint8[count]   (0=Low, 1=Medium, 2=High)
+
+    flags & 0x01 (delta): node_id/lat_e6/lon_e6 เก็บเป็นผลต่างจากค่าก่อนหน้า (ตัวแรกเป็นค่าจริง)
+    ให้ client ทำ prefix-sum กลับ — ช่วยให้ gzip บีบได้ดีขึ้นมาก
+    ลำดับเหมือน JSON (Low -> Medium -> High) ส่วน color/polygon ให้ client คำนวณเองจาก risk และพิกัด
+    (polygon = กล่อง ±1/110.574 องศา lat, ±1/(111.320*cos(lat)) องศา lon เหมือน calculate_2x2_polygon)
+    """
+    if idx is None:
+        idx = np.arange(len(snapshot['items']))
+    node_ids = snapshot['node_ids'][idx].astype(np.int32)
+    lat_e6 = np.round(snapshot['lats'][idx] * 1e6).astype(np.int32)
+    lon_e6 = np.round(snapshot['lons'][idx] * 1e6).astype(np.int32)
+    risk = snapshot['risk_codes'][idx].astype(np.uint8)
+
+    flags = 0
+    if delta:
+        flags |= PREDICTIONS_BINARY_FLAG_DELTA
+        node_ids, lat_e6, lon_e6 = (np.diff(col, prepend=np.int32(0)).astype(np.int32) for col in (node_ids, lat_e6, lon_e6))
+
+    header = _PREDICTIONS_BINARY_HEADER.pack(
+        PREDICTIONS_BINARY_MAGIC, PREDICTIONS_BINARY_FORMAT, flags, 0, len(idx), snapshot['version'] & 0xFFFFFFFF
+    )
+    return b''.join([header, node_ids.astype('<i4').tobytes(), lat_e6.astype('<i4').tobytes(),
+                     lon_e6.astype('<i4').tobytes(), risk.tobytes()])
+
+def wants_binary_predictions(request: Request):
+    return PREDICTIONS_BINARY_MEDIA_TYPE in request.headers.get('accept', '')
+
+def etag_matches(request: Request, etag: str):
+    if_none_match = request.headers.get('if-none-match')
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in candidates or any(tag.removeprefix('W/') == etag for tag in candidates)
 
 @app.get("/api/predictions", response_model=List[PredictionResponseItem])
-async def get_predictions():
+def get_predictions(request: Request, bbox: Optional[str] = None, zoom: Optional[int] = None, risk: Optional[str] = None, delta: bool = False):
+    """
+    ผลทำนายล่าสุด (เรียง Low -> Medium -> High เพื่อให้สีแดงวาดทับด้านบน)
+    - ไม่ใส่ parameter: ส่ง snapshot ทั้งหมด (bytes ที่ serialize ไว้แล้ว)
+    - bbox=minLon,minLat,maxLon,maxLat: เฉพาะ node ในกรอบที่มองเห็น
+    - zoom<=11: รวมเป็น cell (มี field count) แทน node รายตัว
+    - risk=High,Medium: กรองระดับความเสี่ยง
+    - Accept: application/x-landslide-predictions: ส่งแบบ binary columnar (ดู encode_predictions_binary)
+      ใส่ delta=true เพื่อใช้ delta encoding
+    """
     # Return sorted by Risk where Red (High) is at the back of the array so it draws ON TOP (Z-Index rendering)
-    try:
-        with open(os.path.join(PROJECT_ROOT, 'server', 'data', 'latest_predictions.json'), 'r') as f:
-            data = json.load(f)
-            
-        # Z-Index Priority: Green (Low) -> Yellow (Medium) -> Red (High)
-        color_order = {"#00FF00": 1, "#FFFF00": 2, "#FF0000": 3}
-        data.sort(key=lambda x: color_order.get(x['color'], 0))
-        
-        return data
-    except Exception:
+    snapshot = get_predictions_snapshot()
+    if snapshot is None:
         return []
 
+    clustered = zoom is not None and zoom <= PREDICTION_CLUSTER_MAX_ZOOM
+    filtered = bbox is not None or risk is not None or clustered
+    binary = wants_binary_predictions(request) and not clustered
+    etag = snapshot['etag']
+    if filtered or binary:
+        query_key = f"{bbox}|{zoom}|{risk}|{binary}|{delta}"
+        etag = f'"{snapshot["etag"].strip(chr(34))}-{hashlib.sha1(query_key.encode()).hexdigest()[:8]}"'
+
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept, Accept-Encoding"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    if not filtered and not binary:
+        if 'gzip' in request.headers.get('accept-encoding', ''):
+            headers["Content-Encoding"] = "gzip"
+            return Response(content=snapshot['gzip_body'], media_type="application/json", headers=headers)
+        return Response(content=snapshot['body'], media_type="application/json", headers=headers)
+
+    if bbox is not None:
+        idx = query_prediction_bbox(snapshot, *parse_bbox(bbox))
+    else:
+        idx = np.arange(len(snapshot['items']))
+    if risk is not None:
+        idx = idx[np.isin(snapshot['risk_codes'][idx], parse_risk_filter(risk))]
+
+    media_type = "application/json"
+    if binary:
+        body = encode_predictions_binary(snapshot, idx, delta=delta)
+        media_type = PREDICTIONS_BINARY_MEDIA_TYPE
+    elif clustered:
+        body = json.dumps(aggregate_prediction_cells(snapshot, idx, max(zoom, 0)), separators=(',', ':')).encode('utf-8')
+    else:
+        items = snapshot['items']
+        body = json.dumps([items[i] for i in idx.tolist()], separators=(',', ':')).encode('utf-8')
+
+    if len(body) > 1024 and 'gzip' in request.headers.get('accept-encoding', ''):
+        headers["Content-Encoding"] = "gzip"
+        body = gzip.compress(body, compresslevel=5)
+    return Response(content=body, media_type=media_type, headers=headers)
+
 # =============================================================
 # REGISTER - สมัครสมาชิก
 # =============================================================
 @app.post("/api/register")
-async def register(data: RegisterRequest):
+def register(data: RegisterRequest):
     conn = get_db_connection()
     if not conn:
         raise HTTPException(status_code=500, detail="Database connection error")
@@ -375,7 +1233,7 @@ async def register(data: RegisterRequest):
 # LOGIN - เข้าสู่ระบบ
 # =============================================================
 @app.post("/api/login")
-async def login(data: LoginRequest):
+def login(data: LoginRequest):
     conn = get_db_connection()
     if not conn:
         raise HTTPException(status_code=500, detail="Database connection error")
@@ -414,7 +1272,7 @@ async def login(data: LoginRequest):
 # GET USER PROFILE
 # =============================================================
 @app.get("/api/user/{user_id}")
-async def get_user_profile(user_id: str):
+def get_user_profile(user_id: str):
     conn = get_db_connection()
     if not conn:
         raise HTTPException(status_code=500, detail="Database connection error")
@@ -434,19 +1292,84 @@ async def get_user_profile(user_id: str):
 # =============================================================
 # GET NOTIFICATIONS FOR USER
 # =============================================================
+NOTIFICATION_PAGE_SIZE = 100
+NOTIFICATION_MAX_PAGE_SIZE = 200
+NOTIFICATION_COLUMNS = "seq, notification_id, user_id, event_id, prediction_id, title, message, sent_at, is_read, log_id"
+
+def ensure_notification_seq(conn):
+    """
+    เพิ่ม notifications.seq (AUTO_INCREMENT) เป็น key ของ cursor แทน (sent_at, notification_id)
+    sent_at ละเอียดแค่วินาทีและ notification_id เป็น uuid สุ่ม — แถวที่ commit ทีหลังในวินาทีเดียวกันอาจมี id น้อยกว่า cursor แล้วหลุดจาก since
+    แถวเดิมได้ seq ตาม (sent_at, notification_id): ADD COLUMN ... AUTO_INCREMENT ตรงๆ จะนับตาม PK (uuid สุ่ม) ไม่ใช่ตามเวลา
+    """
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SHOW COLUMNS FROM notifications LIKE 'seq'")
+        column = cursor.fetchone()
+        extra = column[5].decode() if column and isinstance(column[5], (bytes, bytearray)) else str(column and column[5])
+        if column is None or 'auto_increment' not in extra.lower():
+            # column ที่ค้างจาก migration ที่ล้มกลางทาง (ยัง nullable) นับใหม่ทั้งตารางได้เลย — cursor ยังไม่เคยออกไปจาก seq ชุดนี้
+            if column is None:
+                cursor.execute("ALTER TABLE notifications ADD COLUMN seq BIGINT NULL")
+            cursor.execute("SET @notification_seq := 0")
+            cursor.execute("UPDATE notifications SET seq = (@notification_seq := @notification_seq + 1) ORDER BY sent_at, notification_id")
+            backfilled = cursor.rowcount
+            cursor.execute("ALTER TABLE notifications MODIFY seq BIGINT NOT NULL AUTO_INCREMENT, ADD UNIQUE KEY uq_notifications_seq (seq)")
+            print(f"Added notifications.seq ({backfilled} existing rows numbered by sent_at)")
+        conn.commit()
+        cursor.close()
+    except Exception as e:
+        print(f"[WARN] ensure_notification_seq: {e}")
+
+def encode_notification_cursor(seq):
+    return base64.urlsafe_b64encode(str(seq).encode('ascii')).decode('ascii')
+
+def decode_notification_cursor(cursor_value):
+    try:
+        return int(base64.urlsafe_b64decode(cursor_value.encode('ascii')).decode('ascii'))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 @app.get("/api/notifications/{user_id}")
-async def get_notifications(user_id: str):
+def get_notifications(user_id: str, response: Response, since: Optional[str] = None, before: Optional[str] = None, limit: int = NOTIFICATION_PAGE_SIZE):
+    """
+    Keyset pagination บน (user_id, seq) — seq เรียงตามลำดับ commit (ดู insert_notifications)
+    - ไม่ใส่ cursor: หน้าล่าสุด (ใหม่ -> เก่า)
+    - since=<cursor>: เฉพาะรายการที่ใหม่กว่า cursor (เก่า -> ใหม่) ใช้สำหรับ sync แบบ incremental
+    - before=<cursor>: หน้าถัดไปที่เก่ากว่า cursor (ใหม่ -> เก่า)
+    header X-Next-Cursor = cursor ของแถวสุดท้ายในหน้านี้, X-Has-More = มีหน้าถัดไปหรือไม่
+    """
+    limit = max(1, min(limit, NOTIFICATION_MAX_PAGE_SIZE))
+    query = f"SELECT {NOTIFICATION_COLUMNS} FROM notifications WHERE user_id = %s"
+    args = [user_id]
+    if since:
+        query += " AND seq > %s ORDER BY seq ASC"
+        args.append(decode_notification_cursor(since))
+    elif before:
+        query += " AND seq < %s ORDER BY seq DESC"
+        args.append(decode_notification_cursor(before))
+    else:
+        query += " ORDER BY seq DESC"
+    query += " LIMIT %s"
+    args.append(limit + 1)
+
     conn = get_db_connection()
     if not conn:
         raise HTTPException(status_code=500, detail="Database connection error")
     try:
         cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM notifications WHERE user_id = %s ORDER BY sent_at DESC", (user_id,))
+        cursor.execute(query, tuple(args))
         rows = cursor.fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        if rows:
+            response.headers["X-Next-Cursor"] = encode_notification_cursor(rows[-1]['seq'])
+        response.headers["X-Has-More"] = "true" if has_more else "false"
         for row in rows:
-            for key, val in row.items():
-                if isinstance(val, (datetime.datetime, datetime.date)):
-                    row[key] = val.isoformat()
+            row.pop('seq', None)
+            if row.get('sent_at') is not None:
+                row['sent_at'] = row['sent_at'].isoformat()
         return rows
     except Exception as e:
         return []
@@ -454,11 +1377,117 @@ async def get_notifications(user_id: str):
         cursor.close()
         conn.close()
 
+@app.get("/api/notifications/{user_id}/summary")
+def get_notification_summary(user_id: str):
+    """probe แบบเบา: จำนวนที่ยังไม่อ่าน + notification ล่าสุด (ให้ client ตัดสินใจว่าต้อง sync หรือไม่)"""
+    conn = get_db_connection()
+    if not conn:
+        raise HTTPException(status_code=500, detail="Database connection error")
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT COUNT(*) AS unread_count FROM notifications WHERE user_id = %s AND is_read = 0", (user_id,))
+        unread = cursor.fetchone()['unread_count']
+        cursor.execute(
+            "SELECT seq, notification_id, sent_at FROM notifications WHERE user_id = %s ORDER BY seq DESC LIMIT 1",
+            (user_id,)
+        )
+        latest = cursor.fetchone()
+        return {
+            "unread_count": int(unread or 0),
+            "latest_notification_id": latest['notification_id'] if latest else None,
+            "latest_sent_at": latest['sent_at'].isoformat() if latest else None,
+            "latest_cursor": encode_notification_cursor(latest['seq']) if latest else None,
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        cursor.close()
+        conn.close()
+
+# =============================================================
+# NOTIFICATION STREAM (Server-Sent Events) + in-process pub/sub hub
+# =============================================================
+NOTIFICATION_STREAM_HEARTBEAT_S = 15
+NOTIFICATION_STREAM_QUEUE_SIZE = 100
+
+NOTIFICATION_SUBSCRIBERS = {}   # user_id -> set ของ asyncio.Queue (1 queue ต่อ 1 connection)
+NOTIFICATION_LOOP = None        # event loop หลักของ server (ตั้งตอน startup)
+
+def publish_notifications(rows):
+    """
+    ส่ง notification ที่เพิ่ง INSERT ให้ subscriber ที่เชื่อมต่ออยู่ (เรียกได้จาก thread ของ handler หลัง commit)
+    rows = [(notification_id, user_id, log_id, title, message), ...]
+    NOTIFICATION_SUBSCRIBERS ถูกแก้บน event loop เท่านั้น จึงส่ง fan-out ทั้งก้อนไปทำบน loop ด้วย call_soon_threadsafe ครั้งเดียว
+    ไม่ raise: ข้อมูล commit แล้ว client ที่พลาด event จะ sync ผ่าน GET /api/notifications ตอน reconnect
+    """
+    if not rows or NOTIFICATION_LOOP is None:
+        return
+    try:
+        sent_at = datetime.datetime.now().isoformat()
+        events = [
+            {
+                "notification_id": notification_id,
+                "user_id": user_id,
+                "log_id": log_id,
+                "title": title,
+                "message": message,
+                "sent_at": sent_at,
+                "is_read": 0,
+            }
+            for notification_id, user_id, log_id, title, message in rows
+        ]
+        NOTIFICATION_LOOP.call_soon_threadsafe(_fanout_notifications, events)
+    except Exception as e:
+        print(f"[WARN] publish_notifications: {e}")
+
+def _fanout_notifications(events):
+    # รันบน event loop: client ที่อ่านไม่ทัน (queue เต็ม) ถูกทิ้ง event ไป
+    for event in events:
+        for queue in NOTIFICATION_SUBSCRIBERS.get(event["user_id"], ()):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                pass
+
+@app.get("/api/notifications/{user_id}/stream")
+async def stream_notifications(user_id: str, request: Request):
+    """
+    Server-Sent Events: ส่ง event "notification" ทันทีที่ admin approve alert ใกล้ user
+    มี comment heartbeat ทุก NOTIFICATION_STREAM_HEARTBEAT_S วินาทีเพื่อกัน connection idle timeout
+    """
+    queue = asyncio.Queue(maxsize=NOTIFICATION_STREAM_QUEUE_SIZE)
+    NOTIFICATION_SUBSCRIBERS.setdefault(user_id, set()).add(queue)
+
+    async def event_source():
+        try:
+            yield "retry: 5000\nevent: ready\ndata: {}\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=NOTIFICATION_STREAM_HEARTBEAT_S)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": ping\n\n"
+                    continue
+                yield f"id: {event['notification_id']}\nevent: notification\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        finally:
+            subscribers = NOTIFICATION_SUBSCRIBERS.get(user_id)
+            if subscribers is not None:
+                subscribers.discard(queue)
+                if not subscribers:
+                    NOTIFICATION_SUBSCRIBERS.pop(user_id, None)
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # =============================================================
 # MARK NOTIFICATION AS READ
 # =============================================================
 @app.put("/api/notifications/{notification_id}/read")
-async def mark_notification_read(notification_id: str):
+def mark_notification_read(notification_id: str):
     conn = get_db_connection()
     if not conn:
         raise HTTPException(status_code=500, detail="Database connection error")
@@ -477,7 +1506,7 @@ async def mark_notification_read(notification_id: str):
 # GET EMERGENCY SERVICES
 # =============================================================
 @app.get("/api/emergency")
-async def get_emergency_services():
+def get_emergency_services():
     conn = get_db_connection()
     if not conn:
         raise HTTPException(status_code=500, detail="Database connection error")
@@ -501,7 +1530,7 @@ class UpdateProfileRequest(BaseModel):
     password: str = None
 
 @app.put("/api/user/{user_id}")
-async def update_user_profile(user_id: str, request: UpdateProfileRequest):
+def update_user_profile(user_id: str, request: UpdateProfileRequest):
     conn = get_db_connection()
     if not conn:
         raise HTTPException(status_code=500, detail="Database connection error")
@@ -547,7 +1576,7 @@ async def update_user_profile(user_id: str, request: UpdateProfileRequest):
 # GET ALL USERS (admin)
 # =============================================================
 @app.get("/api/users")
-async def get_all_users():
+def get_all_users():
     conn = get_db_connection()
     if not conn:
         raise HTTPException(status_code=500, detail="Database connection error")
@@ -569,34 +1598,38 @@ async def get_all_users():
 # =============================================================
 # ADMIN: GET PENDING ALERTS
 # =============================================================
+# log ล่าสุดของแต่ละ node = สถานะปัจจุบันของ node (incremental logging ไม่เขียน log ซ้ำถ้า risk ไม่เปลี่ยน)
+# เดิน idx_prediction_logs_node_time ทีละ node (loose index scan) ไม่ต้องอ่านแถวของ log
+LATEST_LOG_PER_NODE = "SELECT node_id, MAX(timestamp) AS latest FROM prediction_logs GROUP BY node_id"
+
 @app.get("/api/admin/alerts/pending")
-async def get_pending_alerts():
+def get_pending_alerts():
+    """
+    alert ที่รอ admin ตรวจ = node ที่ log ล่าสุดยังเป็น pending (1 แถวต่อ node)
+    node ที่ยัง High อยู่โดย input ไม่เปลี่ยนจะไม่มี log ใหม่ — log เดิมจึงค้างอยู่ในหน้านี้จนกว่าจะถูกตรวจ
+    หรือ node มี log ใหม่มาแทน (risk เปลี่ยน / probability ขยับ)
+    """
     conn = get_db_connection()
     if not conn:
         raise HTTPException(status_code=500, detail="Database connection error")
     try:
         cursor = conn.cursor(dictionary=True)
-        query = """
-        SELECT pl.log_id, pl.node_id, pl.risk_level, pl.probability, pl.timestamp, 
-               sn.latitude, sn.longitude
-        FROM prediction_logs pl
+        cursor.execute(f"""
+        SELECT pl.log_id, pl.run_id, pl.node_id, pl.risk_level, pl.probability, pl.timestamp, 
+               sn.latitude, sn.longitude, sn.tambon, sn.district
+        FROM ({LATEST_LOG_PER_NODE}) latest
+        JOIN prediction_logs pl ON pl.node_id = latest.node_id AND pl.timestamp = latest.latest
         JOIN static_nodes sn ON pl.node_id = sn.node_id
         WHERE pl.status = 'pending'
-          AND DATE(pl.timestamp) = (
-              SELECT DATE(MAX(timestamp)) FROM prediction_logs WHERE status = 'pending'
-          )
         ORDER BY pl.probability DESC
         LIMIT 100
-        """
-        cursor.execute(query)
+        """)
         rows = cursor.fetchall()
         for row in rows:
             for key, val in row.items():
                 if isinstance(val, (datetime.datetime, datetime.date)):
                     row[key] = val.isoformat()
-            tambon, district = lookup_tambon_district(float(row['latitude']), float(row['longitude']))
-            row['tambon'] = tambon
-            row['district'] = district
+        attach_tambon_district(rows)
         return rows
     except Exception as e:
         return []
@@ -604,95 +1637,136 @@ async def get_pending_alerts():
         cursor.close()
         conn.close()
 
-# =============================================================
-# ADMIN: GET ALERT HISTORY (approved alerts)
-# =============================================================
-@app.get("/api/admin/alerts/history")
-async def get_alert_history(startDate: str = None, endDate: str = None):
+@app.get("/api/admin/prediction-runs")
+def get_prediction_runs(limit: int = 20):
     conn = get_db_connection()
     if not conn:
         raise HTTPException(status_code=500, detail="Database connection error")
     try:
         cursor = conn.cursor(dictionary=True)
-        # Base query (Only show alerts that admin explicitly approved or rejected)
-        query = """
-        SELECT pl.log_id, pl.node_id, pl.risk_level, pl.probability, pl.timestamp, pl.status,
-               sn.latitude, sn.longitude
-        FROM prediction_logs pl
-        JOIN static_nodes sn ON pl.node_id = sn.node_id
-        WHERE pl.status IN ('approved', 'rejected')
-        """
-        
-        args = []
-        if startDate and endDate:
-            query += " AND DATE(pl.timestamp) BETWEEN %s AND %s "
-            args.extend([startDate, endDate])
-        elif startDate:
-            query += " AND DATE(pl.timestamp) >= %s "
-            args.append(startDate)
-        elif endDate:
-            query += " AND DATE(pl.timestamp) <= %s "
-            args.append(endDate)
-            
-        query += " ORDER BY pl.timestamp DESC LIMIT 200 "
-        
-        cursor.execute(query, tuple(args) if args else None)
+        cursor.execute("""
+            SELECT run_id, started_at, finished_at, model_version, nodes_total, nodes_scored, logs_written
+            FROM prediction_runs
+            ORDER BY started_at DESC
+            LIMIT %s
+        """, (max(1, min(limit, 100)),))
         rows = cursor.fetchall()
         for row in rows:
             for key, val in row.items():
                 if isinstance(val, (datetime.datetime, datetime.date)):
                     row[key] = val.isoformat()
-            tambon, district = lookup_tambon_district(float(row['latitude']), float(row['longitude']))
-            row['tambon'] = tambon
-            row['district'] = district
         return rows
     except Exception as e:
-        return []
+        raise HTTPException(status_code=500, detail=str(e))
     finally:
         cursor.close()
         conn.close()
 
-# =============================================================
-# ADMIN: GET SENT NOTIFICATION HISTORY (approved alerts only)
-# =============================================================
-@app.get("/api/admin/notifications/history")
-async def get_sent_notification_history(startDate: str = None, endDate: str = None):
+def parse_query_date(value, name):
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m-%d')
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"{name} must be YYYY-MM-DD")
+
+def timestamp_range_filter(startDate=None, endDate=None, column="pl.timestamp"):
+    """
+    ช่วงวันที่ (รวมทั้งสองวัน) เป็นเงื่อนไขแบบ range บน column ตรงๆ (timestamp >= start AND < end + 1 วัน)
+    แทน DATE(column) ที่ใช้ index / partition pruning ไม่ได้ คืน (SQL, args)
+    """
+    sql, args = "", []
+    if startDate:
+        sql += f" AND {column} >= %s "
+        args.append(parse_query_date(startDate, "startDate"))
+    if endDate:
+        sql += f" AND {column} < %s "
+        args.append(parse_query_date(endDate, "endDate") + datetime.timedelta(days=1))
+    return sql, args
+
+# ---- Admin history (prediction_logs): keyset pagination บน (timestamp, log_id) ----
+HISTORY_PAGE_SIZE = 200
+HISTORY_MAX_PAGE_SIZE = 500
+HISTORY_COLUMNS = """pl.log_id, pl.node_id, pl.risk_level, pl.probability, pl.timestamp, pl.status,
+               sn.latitude, sn.longitude, sn.tambon, sn.district"""
+
+def encode_log_cursor(timestamp, log_id):
+    raw = f"{timestamp.isoformat() if hasattr(timestamp, 'isoformat') else timestamp}|{log_id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_log_cursor(cursor_value):
+    try:
+        raw = base64.urlsafe_b64decode(cursor_value.encode('ascii')).decode('utf-8')
+        timestamp, log_id = raw.split('|', 1)
+        timestamp = datetime.datetime.fromisoformat(timestamp)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not log_id:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return timestamp, log_id   # log_id เป็น UUID (CHAR(36)) เทียบแบบ string ตามลำดับของ index
+
+def history_filters(startDate=None, endDate=None, risk=None, district=None, minProbability=None, maxProbability=None, before=None):
+    """เงื่อนไขกรองของหน้า history (ตรวจ input ก่อนยืม connection) คืน (SQL, args)"""
+    sql, args = timestamp_range_filter(startDate, endDate)
+    if risk:
+        levels = [str(RISK_LEVELS[code]) for code in parse_risk_filter(risk)]
+        sql += f" AND pl.risk_level IN ({', '.join(['%s'] * len(levels))}) "
+        args.extend(levels)
+    if district:
+        sql += " AND sn.district = %s "
+        args.append(district)
+    for value, name, op in ((minProbability, "minProbability", ">="), (maxProbability, "maxProbability", "<=")):
+        if value is None:
+            continue
+        if not 0.0 <= value <= 1.0:
+            raise HTTPException(status_code=400, detail=f"{name} must be between 0 and 1")
+        sql += f" AND pl.probability {op} %s "
+        args.append(value)
+    if minProbability is not None and maxProbability is not None and minProbability > maxProbability:
+        raise HTTPException(status_code=400, detail="minProbability must be <= maxProbability")
+    if before:
+        timestamp, log_id = decode_log_cursor(before)
+        sql += " AND (pl.timestamp < %s OR (pl.timestamp = %s AND pl.log_id < %s)) "
+        args.extend([timestamp, timestamp, log_id])
+    return sql, args
+
+def fetch_log_history(response, column, values, filter_sql, filter_args, limit):
+    """
+    1 หน้าของ prediction_logs ที่ column (status / risk_level) อยู่ใน values เรียงใหม่ -> เก่า
+    แยก query ต่อค่า (UNION ALL) ให้แต่ละส่วนเดิน index (column, timestamp[, log_id]) ถอยหลังแล้วหยุดที่ limit + 1 แถว
+    แทน IN (...) ที่ต้อง filesort ทุกแถวที่ตรงเงื่อนไข — ต้นทุนต่อหน้าจึงคงที่ไม่ว่าจะเลื่อนไปลึกแค่ไหน
+    header X-Next-Cursor = cursor ของแถวสุดท้าย (ส่งกลับมาเป็น before=), X-Has-More = มีหน้าถัดไปหรือไม่
+    """
+    branch = f"""
+        (SELECT {HISTORY_COLUMNS}
+         FROM prediction_logs pl
+         JOIN static_nodes sn ON pl.node_id = sn.node_id
+         WHERE pl.{column} = %s {filter_sql}
+         ORDER BY pl.timestamp DESC, pl.log_id DESC
+         LIMIT %s)"""
+    query = " UNION ALL ".join([branch] * len(values)) + " ORDER BY timestamp DESC, log_id DESC LIMIT %s"
+    args = []
+    for value in values:
+        args.extend([value, *filter_args, limit + 1])
+    args.append(limit + 1)
+
     conn = get_db_connection()
     if not conn:
         raise HTTPException(status_code=500, detail="Database connection error")
     try:
         cursor = conn.cursor(dictionary=True)
-        # Base query to fetch all historical predictions that were Medium or High risk
-        query = """
-        SELECT pl.log_id, pl.node_id, pl.risk_level, pl.probability, pl.timestamp, pl.status,
-               sn.latitude, sn.longitude
-        FROM prediction_logs pl
-        JOIN static_nodes sn ON pl.node_id = sn.node_id
-        WHERE pl.risk_level IN ('Medium', 'High')
-        """
-        
-        args = []
-        if startDate and endDate:
-            query += " AND DATE(pl.timestamp) BETWEEN %s AND %s "
-            args.extend([startDate, endDate])
-        elif startDate:
-            query += " AND DATE(pl.timestamp) >= %s "
-            args.append(startDate)
-        elif endDate:
-            query += " AND DATE(pl.timestamp) <= %s "
-            args.append(endDate)
-            
-        query += " ORDER BY pl.timestamp DESC LIMIT 200 "
-        
-        cursor.execute(query, tuple(args) if args else None)
+        cursor.execute(query, tuple(args))
         rows = cursor.fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        if rows:
+            last = rows[-1]
+            response.headers["X-Next-Cursor"] = encode_log_cursor(last['timestamp'], last['log_id'])
+        response.headers["X-Has-More"] = "true" if has_more else "false"
         for row in rows:
             for key, val in row.items():
                 if isinstance(val, (datetime.datetime, datetime.date)):
                     row[key] = val.isoformat()
-            tambon, district = lookup_tambon_district(float(row['latitude']), float(row['longitude']))
-            row['tambon'] = tambon
-            row['district'] = district
+        attach_tambon_district(rows)
         return rows
     except Exception as e:
         return []
@@ -700,12 +1774,46 @@ async def get_sent_notification_history(startDate: str = None, endDate: str = No
         cursor.close()
         conn.close()
 
+# =============================================================
+# ADMIN: GET ALERT HISTORY (approved alerts)
+# =============================================================
+@app.get("/api/admin/alerts/history")
+def get_alert_history(response: Response, startDate: str = None, endDate: str = None, risk: Optional[str] = None,
+                      district: Optional[str] = None, minProbability: Optional[float] = None,
+                      maxProbability: Optional[float] = None, before: Optional[str] = None, limit: int = HISTORY_PAGE_SIZE):
+    """
+    alert ที่ admin approve/reject แล้ว (ใหม่ -> เก่า) กรองด้วย risk=Medium,High / district / minProbability / maxProbability
+    หน้าถัดไป: before=<X-Next-Cursor ของหน้าก่อน>
+    """
+    filter_sql, filter_args = history_filters(startDate, endDate, risk, district, minProbability, maxProbability, before)
+    limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+    return fetch_log_history(response, "status", ["approved", "rejected"], filter_sql, filter_args, limit)
+
+# =============================================================
+# ADMIN: GET SENT NOTIFICATION HISTORY (approved alerts only)
+# =============================================================
+@app.get("/api/admin/notifications/history")
+def get_sent_notification_history(response: Response, startDate: str = None, endDate: str = None, risk: Optional[str] = None,
+                                  district: Optional[str] = None, minProbability: Optional[float] = None,
+                                  maxProbability: Optional[float] = None, before: Optional[str] = None, limit: int = HISTORY_PAGE_SIZE):
+    """prediction ระดับ Medium/High ทั้งหมด (ใหม่ -> เก่า) ตัวกรองและ cursor แบบเดียวกับ /api/admin/alerts/history"""
+    levels = ["Medium", "High"]
+    if risk:
+        wanted = {str(RISK_LEVELS[code]) for code in parse_risk_filter(risk)}
+        levels = [level for level in levels if level in wanted]
+    filter_sql, filter_args = history_filters(startDate, endDate, None, district, minProbability, maxProbability, before)
+    limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+    if not levels:
+        response.headers["X-Has-More"] = "false"
+        return []
+    return fetch_log_history(response, "risk_level", levels, filter_sql, filter_args, limit)
+
 # =============================================================
 # PUBLIC: GET VERIFIED ALERTS (สำหรับ mobile app ตรวจสอบระยะห่าง)
 # ดึงเฉพาะ alerts ที่แอดมิน approve แล้ว รวมพิกัด + ชื่อท้องถิ่น
 # =============================================================
 @app.get("/api/alerts/verified")
-async def get_verified_alerts():
+def get_verified_alerts():
     """
     ดึง prediction logs ที่ admin approve แล้ว (status='approved')
     สำหรับให้ Android background service ตรวจสอบว่า user อยู่ใกล้หรือไม่
@@ -717,7 +1825,7 @@ async def get_verified_alerts():
         cursor = conn.cursor(dictionary=True)
         query = """
         SELECT pl.log_id, pl.node_id, pl.risk_level, pl.probability, pl.timestamp,
-               sn.latitude, sn.longitude
+               sn.latitude, sn.longitude, sn.tambon, sn.district
         FROM prediction_logs pl
         JOIN static_nodes sn ON pl.node_id = sn.node_id
         WHERE pl.status = 'approved'
@@ -730,9 +1838,7 @@ async def get_verified_alerts():
             for key, val in row.items():
                 if isinstance(val, (datetime.datetime, datetime.date)):
                     row[key] = val.isoformat()
-            tambon, district = lookup_tambon_district(float(row['latitude']), float(row['longitude']))
-            row['tambon'] = tambon or ""
-            row['district'] = district or ""
+        attach_tambon_district(rows, default="")
         return rows
     except Exception as e:
         print(f"[ERROR] get_verified_alerts: {e}")
@@ -746,42 +1852,50 @@ async def get_verified_alerts():
 # ADMIN: GET ALERT DETAILS
 # =============================================================
 @app.get("/api/admin/alerts/{log_id}")
-async def get_alert_details(log_id: str):
+def get_alert_details(log_id: str):
     conn = get_db_connection()
     if not conn:
         raise HTTPException(status_code=500, detail="Database connection error")
     try:
         cursor = conn.cursor(dictionary=True)
-        cursor.execute("""
-            SELECT pl.*, rg.rain_values_json, sn.latitude, sn.longitude
+        cursor.execute(f"""
+            SELECT pl.*, sn.grid_id, sn.latitude, sn.longitude, sn.tambon, sn.district,
+                   {", ".join(f"sn.{col}" for col in STATIC_FEATURES)}
             FROM prediction_logs pl
             JOIN static_nodes sn ON pl.node_id = sn.node_id
-            LEFT JOIN rain_grids rg ON sn.grid_id = rg.grid_id
             WHERE pl.log_id = %s
         """, (log_id,))
         row = cursor.fetchone()
         
         if not row:
             raise HTTPException(status_code=404, detail="Alert not found")
+
+        grid_id = row.pop('grid_id')
+        static = {col: row.pop(col) for col in STATIC_FEATURES}
+        stored = row.get('features_json')
+        if isinstance(stored, (str, bytes, bytearray)):
+            try:
+                stored = json.loads(stored)
+            except ValueError:
+                stored = None
+        if isinstance(stored, dict):
+            # log ก่อนเลิกเก็บ features_json: ใช้ค่าที่โมเดลเห็นจริงตอนทำนาย (static_nodes / rain_daily อาจเปลี่ยนไปแล้ว)
+            row['features_json'] = stored
+            row['rain_values_json'] = [stored.get(f'CHIRPS_Day_{day}') for day in range(1, RAIN_DAYS + 1)]
+        else:
+            # ฝนที่รอบนั้นใช้จริง (เก็บครั้งเดียวต่อ grid ต่อรอบ)
+            rain = get_run_rain(cursor, row['run_id'], grid_id) if row.get('run_id') else None
+            if rain is None:
+                # log legacy ที่ไม่มีทั้ง features_json และฝนของรอบ: ฝน 10 วันที่จบที่วันก่อนวันที่ทำนาย จาก rain_daily
+                predicted_on = row['timestamp'].date() if isinstance(row.get('timestamp'), datetime.datetime) else None
+                rain = get_rain_trend(cursor, grid_id, predicted_on and predicted_on - datetime.timedelta(days=1))
+            row['rain_values_json'] = rain
+            row['features_json'] = rebuild_log_features(static, grid_id, rain)
             
         for key, val in row.items():
             if isinstance(val, (datetime.datetime, datetime.date)):
                 row[key] = val.isoformat()
-                
-        if isinstance(row.get('features_json'), str):
-            try:
-                row['features_json'] = json.loads(row['features_json'])
-            except:
-                pass
-        if isinstance(row.get('rain_values_json'), str):
-            try:
-                row['rain_values_json'] = json.loads(row['rain_values_json'])
-            except:
-                pass
-        
-        tambon, district = lookup_tambon_district(float(row['latitude']), float(row['longitude']))
-        row['tambon'] = tambon
-        row['district'] = district
+        attach_tambon_district([row])
                 
         return row
     except Exception as e:
@@ -790,11 +1904,104 @@ async def get_alert_details(log_id: str):
         cursor.close()
         conn.close()
 
+# =============================================================
+# NEARBY USERS - หา user ในรัศมีของจุดเตือนภัย
+# =============================================================
+ALERT_RADIUS_KM = 20.0
+EARTH_RADIUS_KM = 6371.0088
+NEARBY_BBOX_CHUNK = 50   # จำนวนจุดต่อ 1 query (แต่ละจุดเป็น 1 เงื่อนไข BETWEEN)
+
+def radius_bbox(lat, lon, radius_km):
+    """กรอบสี่เหลี่ยมที่ครอบวงกลมรัศมี radius_km เสมอ (เผื่อ 1% สำหรับค่าประมาณ km/องศา)"""
+    dlat = radius_km / 110.574 * 1.01
+    dlon = radius_km / (111.320 * max(math.cos(math.radians(lat)), 1e-6)) * 1.01
+    return lat - dlat, lat + dlat, lon - dlon, lon + dlon
+
+def find_users_near_points(conn, points, radius_km=ALERT_RADIUS_KM):
+    """
+    คืน list ของ user_id (ไม่ซ้ำ) ที่อยู่ในรัศมี radius_km ของแต่ละจุดใน points [(lat, lon), ...]
+    1. bbox prefilter ใน SQL (ใช้ idx_user_locations_lat_lon) ดึงเฉพาะ user ที่อาจอยู่ในระยะ
+    2. สร้าง BallTree (haversine) ในหน่วยความจำจาก candidate แล้ว query รัศมีจริงทีละจุด
+    """
+    if not points:
+        return []
+    points = [(float(lat), float(lon)) for lat, lon in points]
+    candidates = {}
+    cursor = conn.cursor()
+    try:
+        for start in range(0, len(points), NEARBY_BBOX_CHUNK):
+            chunk = points[start:start + NEARBY_BBOX_CHUNK]
+            clauses, args = [], []
+            for lat, lon in chunk:
+                lat_min, lat_max, lon_min, lon_max = radius_bbox(lat, lon, radius_km)
+                clauses.append("(latitude BETWEEN %s AND %s AND longitude BETWEEN %s AND %s)")
+                args.extend([lat_min, lat_max, lon_min, lon_max])
+            cursor.execute(
+                f"SELECT user_id, latitude, longitude FROM user_locations WHERE {' OR '.join(clauses)}",
+                tuple(args)
+            )
+            for user_id, lat, lon in cursor.fetchall():
+                candidates[(user_id, float(lat), float(lon))] = None
+    finally:
+        cursor.close()
+
+    if not candidates:
+        return [[] for _ in points]
+    keys = list(candidates)
+    user_ids = np.array([k[0] for k in keys], dtype=object)
+    tree = BallTree(np.radians([[k[1], k[2]] for k in keys]), metric='haversine')
+    hits = tree.query_radius(np.radians(points), r=radius_km / EARTH_RADIUS_KM)
+    return [list(dict.fromkeys(user_ids[h].tolist())) for h in hits]
+
+def build_alert_notification(alert):
+    """title/message ของการแจ้งเตือนจาก alert row (ต้องมี risk_level, tambon, district)"""
+    tambon, district = alert.get('tambon'), alert.get('district')
+    t_name = tambon if (tambon and tambon != 'None') else "-"
+    d_name = district if (district and district != 'None') else "-"
+
+    title = "⚠️ แจ้งเตือนด่วน: พบความเสี่ยงดินถล่ม"
+    msg = f"พื้นที่ ต.{t_name} อ.{d_name} มีความเสี่ยงระดับ {alert['risk_level']} โปรดเฝ้าระวังในรัศมี 20 กม."
+    return title, msg
+
+NOTIFICATION_INSERT_CHUNK = 500
+NOTIFICATION_SEQ_LOCK = "landsnot_notification_seq"
+NOTIFICATION_SEQ_LOCK_TIMEOUT_S = 10
+
+def insert_notifications(cursor, rows):
+    """
+    บันทึก notifications แบบ multi-row INSERT ครั้งละ NOTIFICATION_INSERT_CHUNK แถว
+    rows = [(notification_id, user_id, log_id, title, message), ...]
+    ถือ named lock ตั้งแต่ INSERT จนหลัง commit (release_notification_seq) ให้ seq เรียงตามลำดับ commit:
+    transaction ที่ได้ seq น้อยกว่าแต่ commit ทีหลังจะหลุดจาก since ของ client ที่ sync ไปแล้ว
+    (ถ้า rollback แทน lock ถูกปล่อยตอนคืน connection เข้า pool — pool_reset_session)
+    """
+    if not rows:
+        return
+    cursor.execute("SELECT GET_LOCK(%s, %s) AS acquired", (NOTIFICATION_SEQ_LOCK, NOTIFICATION_SEQ_LOCK_TIMEOUT_S))
+    row = cursor.fetchone()
+    if (row['acquired'] if isinstance(row, dict) else row[0]) != 1:
+        raise RuntimeError("timeout waiting for notification seq lock")
+    for start in range(0, len(rows), NOTIFICATION_INSERT_CHUNK):
+        chunk = rows[start:start + NOTIFICATION_INSERT_CHUNK]
+        placeholders = ", ".join(["(%s, %s, %s, %s, %s, NOW(), 0)"] * len(chunk))
+        cursor.execute(
+            f"INSERT INTO notifications (notification_id, user_id, log_id, title, message, sent_at, is_read) VALUES {placeholders}",
+            tuple(v for row in chunk for v in row)
+        )
+
+def release_notification_seq(cursor):
+    # เรียกหลัง commit แล้ว: ถ้าพลาด lock ถูกปล่อยตอนคืน connection อยู่ดี อย่าให้กลายเป็น 500 ของ request ที่สำเร็จแล้ว
+    try:
+        cursor.execute("SELECT RELEASE_LOCK(%s)", (NOTIFICATION_SEQ_LOCK,))
+        cursor.fetchall()
+    except Exception as e:
+        print(f"[WARN] release_notification_seq: {e}")
+
 # =============================================================
 # ADMIN: VERIFY ALERT (Approve/Reject)
 # =============================================================
 @app.put("/api/admin/alerts/{log_id}/verify")
-async def verify_alert(log_id: str, payload: VerifyAlertRequest):
+def verify_alert(log_id: str, payload: VerifyAlertRequest):
     conn = get_db_connection()
     if not conn:
         raise HTTPException(status_code=500, detail="Database connection error")
@@ -806,11 +2013,12 @@ async def verify_alert(log_id: str, payload: VerifyAlertRequest):
         cursor.execute("UPDATE prediction_logs SET status = %s WHERE log_id = %s", (new_status, log_id))
         
         notifications_sent = 0
+        notification_inserts = []
         
         if new_status == 'approved':
             # 2. ดึงพิกัดของจุดที่เกิดเหตุ
             cursor.execute("""
-                SELECT pl.risk_level, sn.latitude, sn.longitude 
+                SELECT pl.risk_level, sn.latitude, sn.longitude, sn.tambon, sn.district
                 FROM prediction_logs pl
                 JOIN static_nodes sn ON pl.node_id = sn.node_id
                 WHERE pl.log_id = %s
@@ -820,31 +2028,19 @@ async def verify_alert(log_id: str, payload: VerifyAlertRequest):
             if alert:
                 lat_a, lon_a = float(alert['latitude']), float(alert['longitude'])
                 
-                # หาชื่อ ตำบล/อำเภอ จากพิกัด (ใช้ตัวพิมพ์ใหญ่ตาม CSV ของคุณ)
-                tambon, district = lookup_tambon_district(lat_a, lon_a)
-                t_name = tambon if (tambon and tambon != 'None') else "-"
-                d_name = district if (district and district != 'None') else "-"
-
-                title = "⚠️ แจ้งเตือนด่วน: พบความเสี่ยงดินถล่ม"
-                msg = f"พื้นที่ ต.{t_name} อ.{d_name} มีความเสี่ยงระดับ {alert['risk_level']} โปรดเฝ้าระวังในรัศมี 20 กม."
+                # ชื่อ ตำบล/อำเภอ ของ node (คำนวณไว้แล้วใน static_nodes)
+                attach_tambon_district([alert])
+                title, msg = build_alert_notification(alert)
 
-                # 3. ค้นหา User ที่ตั้งตำแหน่งอยู่ในระยะ
-                RADIUS_DEGREE = 0.18  # ≈ 20 km
-
-                query_nearby = f"""
-                    SELECT DISTINCT user_id FROM user_locations 
-                    WHERE (POW(latitude - %s, 2) + POW(longitude - %s, 2)) < POW({RADIUS_DEGREE}, 2)
-                """
-                cursor.execute(query_nearby, (lat_a, lon_a))
-                target_users = cursor.fetchall()
+                # 3. ค้นหา User ที่ตั้งตำแหน่งอยู่ในรัศมี 20 กม. (bbox ผ่าน index + haversine จริง)
+                target_users = find_users_near_points(conn, [(lat_a, lon_a)])[0]
 
                 # 4. เตรียมข้อมูลเพื่อ Insert ลงตาราง notifications
-                notification_inserts = []
-                for user in target_users:
+                for user_id in target_users:
                     notifications_sent += 1
                     notification_inserts.append((
                         str(uuid.uuid4()), 
-                        user['user_id'], 
+                        user_id, 
                         log_id, 
                         title, 
                         msg
@@ -852,12 +2048,13 @@ async def verify_alert(log_id: str, payload: VerifyAlertRequest):
 
                 if notification_inserts:
                     # บันทึกการแจ้งเตือนลง DB พร้อมเวลาปัจจุบัน (NOW())
-                    cursor.executemany(
-                        "INSERT INTO notifications (notification_id, user_id, log_id, title, message, sent_at, is_read) VALUES (%s, %s, %s, %s, %s, NOW(), 0)", 
-                        notification_inserts
-                    )
+                    insert_notifications(cursor, notification_inserts)
         
         conn.commit()
+        if notification_inserts:
+            release_notification_seq(cursor)
+        # push ให้ client ที่เปิด stream ค้างไว้ (หลัง commit เท่านั้น)
+        publish_notifications(notification_inserts)
         return {
             "status": "success", 
             "message": f"เหตุการณ์ถูก {new_status} เรียบร้อยแล้ว", 
@@ -873,11 +2070,93 @@ async def verify_alert(log_id: str, payload: VerifyAlertRequest):
             cursor.close()
             conn.close()
 
+# =============================================================
+# ADMIN: BULK VERIFY ALERTS (Approve/Reject หลายรายการพร้อมกัน)
+# =============================================================
+RISK_RANK = {"Low": 0, "Medium": 1, "High": 2}
+
+@app.put("/api/admin/alerts/verify-batch")
+def verify_alerts_bulk(payload: BulkVerifyAlertRequest):
+    """
+    ยืนยัน/ปฏิเสธหลาย alert ในครั้งเดียว
+    user ที่อยู่ใกล้หลายจุดจะได้รับแจ้งเตือนเพียง 1 รายการ (จากจุดที่เสี่ยงสูงสุด)
+    """
+    log_ids = list(dict.fromkeys(payload.log_ids))
+    if not log_ids:
+        raise HTTPException(status_code=400, detail="log_ids is empty")
+
+    conn = get_db_connection()
+    if not conn:
+        raise HTTPException(status_code=500, detail="Database connection error")
+    try:
+        cursor = conn.cursor(dictionary=True)
+        in_clause = ", ".join(["%s"] * len(log_ids))
+
+        # 1. อัปเดตสถานะทั้งหมดใน query เดียว
+        new_status = 'approved' if payload.action.lower() == 'approve' else 'rejected'
+        cursor.execute(f"UPDATE prediction_logs SET status = %s WHERE log_id IN ({in_clause})", (new_status, *log_ids))
+        updated = cursor.rowcount
+
+        notifications_sent = 0
+        if new_status == 'approved':
+            # 2. พิกัด + ชื่อพื้นที่ของทุกจุดใน query เดียว
+            cursor.execute(f"""
+                SELECT pl.log_id, pl.risk_level, pl.probability, sn.latitude, sn.longitude, sn.tambon, sn.district
+                FROM prediction_logs pl
+                JOIN static_nodes sn ON pl.node_id = sn.node_id
+                WHERE pl.log_id IN ({in_clause})
+            """, tuple(log_ids))
+            alerts = cursor.fetchall()
+            attach_tambon_district(alerts)
+
+            # 3. spatial join ทุกจุดกับ user_locations ครั้งเดียว
+            nearby = find_users_near_points(conn, [(a['latitude'], a['longitude']) for a in alerts])
+
+            # 4. dedupe: user แต่ละคนผูกกับ alert ที่เสี่ยงที่สุดที่อยู่ในระยะ
+            best_alert = {}
+            for alert, user_ids in zip(alerts, nearby):
+                rank = (RISK_RANK.get(alert['risk_level'], 0), float(alert['probability']))
+                for user_id in user_ids:
+                    if user_id not in best_alert or rank > best_alert[user_id][0]:
+                        best_alert[user_id] = (rank, alert)
+
+            messages = {}
+            notification_inserts = []
+            for user_id, (_, alert) in best_alert.items():
+                if alert['log_id'] not in messages:
+                    messages[alert['log_id']] = build_alert_notification(alert)
+                title, msg = messages[alert['log_id']]
+                notification_inserts.append((str(uuid.uuid4()), user_id, alert['log_id'], title, msg))
+
+            insert_notifications(cursor, notification_inserts)
+            notifications_sent = len(notification_inserts)
+
+        conn.commit()
+        if new_status == 'approved':
+            if notification_inserts:
+                release_notification_seq(cursor)
+            publish_notifications(notification_inserts)
+        return {
+            "status": "success",
+            "message": f"เหตุการณ์ {updated} รายการถูก {new_status} เรียบร้อยแล้ว",
+            "updated": updated,
+            "notifications_sent": notifications_sent
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        conn.rollback()
+        print(f"[ERROR] verify_alerts_bulk: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        cursor.close()
+        conn.close()
+
 # =============================================================
 # GEOCODE LOCATION - หา TAMBON/DISTRICT จาก lat/lon (ใช้ CSV)
 # =============================================================
 @app.get("/api/geocode-location")
-async def geocode_location(lat: float, lon: float):
+def geocode_location(lat: float, lon: float):
     """ค้นหา TAMBON และ DISTRICT ที่ใกล้ที่สุดจาก nan_province_data.csv"""
     tambon, district = lookup_tambon_district(lat, lon)
     return {
@@ -895,8 +2174,82 @@ class SaveLocationRequest(BaseModel):
     tambon: Optional[str] = None      # ตำบล
     district: Optional[str] = None    # อำเภอ
 
+# cache ตำแหน่งของ user (user_id -> {latitude, longitude, tambon, district} หรือ None = ไม่มีตำแหน่ง)
+# ใช้เติมข้อมูลในหน้ารายงาน — save_user_location ล้าง entry ของ user นั้นเอง
+# TTL กันค่าค้างเมื่อรันหลาย worker process (แต่ละ process มี cache ของตัวเอง)
+USER_LOCATION_CACHE_SIZE = int(os.environ.get('USER_LOCATION_CACHE_SIZE', 5000))
+USER_LOCATION_CACHE_TTL_S = float(os.environ.get('USER_LOCATION_CACHE_TTL_S', 300))
+USER_LOCATION_CACHE = OrderedDict()   # user_id -> (loaded_at, location)
+USER_LOCATION_LOCK = threading.Lock()
+USER_LOCATION_BATCH = 500
+# reader ที่ดึงจาก DB ก่อน save_user_location commit ห้ามเขียนค่าเก่ากลับเข้า cache หลัง invalidate
+USER_LOCATION_GENERATION = 0      # เพิ่มทุกครั้งที่ invalidate
+USER_LOCATION_INVALIDATED = {}    # user_id -> generation ตอน invalidate (เก็บเฉพาะตอนมี reader ค้างอยู่)
+USER_LOCATION_READERS = 0
+
+def invalidate_user_location(user_id):
+    global USER_LOCATION_GENERATION
+    with USER_LOCATION_LOCK:
+        USER_LOCATION_CACHE.pop(user_id, None)
+        USER_LOCATION_GENERATION += 1
+        if USER_LOCATION_READERS:
+            USER_LOCATION_INVALIDATED[user_id] = USER_LOCATION_GENERATION
+
+def get_user_locations(cursor, user_ids):
+    """
+    ตำแหน่งของหลาย user พร้อมกัน {user_id: location หรือ None} (cursor แบบ dictionary)
+    ส่วนที่ไม่อยู่ใน cache ดึงด้วย WHERE user_id IN (...) ครั้งเดียวต่อ USER_LOCATION_BATCH คน แทน 1 query ต่อแถว
+    """
+    global USER_LOCATION_READERS
+    now = time.monotonic()
+    result, missing = {}, []
+    with USER_LOCATION_LOCK:
+        for user_id in dict.fromkeys(u for u in user_ids if u is not None):
+            entry = USER_LOCATION_CACHE.get(user_id)
+            if entry is not None and now - entry[0] < USER_LOCATION_CACHE_TTL_S:
+                USER_LOCATION_CACHE.move_to_end(user_id)
+                result[user_id] = entry[1]
+            else:
+                missing.append(user_id)
+        if not missing:
+            return result
+        generation = USER_LOCATION_GENERATION
+        USER_LOCATION_READERS += 1
+
+    fetched = dict.fromkeys(missing)
+    try:
+        for i in range(0, len(missing), USER_LOCATION_BATCH):
+            batch = missing[i:i + USER_LOCATION_BATCH]
+            cursor.execute(
+                f"SELECT user_id, latitude, longitude, tambon, district FROM user_locations WHERE user_id IN ({', '.join(['%s'] * len(batch))})",
+                tuple(batch)
+            )
+            for row in cursor.fetchall():
+                if fetched.get(row['user_id']) is None:
+                    fetched[row['user_id']] = {
+                        'latitude': float(row['latitude']) if row.get('latitude') is not None else None,
+                        'longitude': float(row['longitude']) if row.get('longitude') is not None else None,
+                        'tambon': row.get('tambon'),
+                        'district': row.get('district'),
+                    }
+        with USER_LOCATION_LOCK:
+            for user_id, loc in fetched.items():
+                if USER_LOCATION_INVALIDATED.get(user_id, 0) > generation:
+                    continue   # ถูก save ระหว่างที่ดึงอยู่: ค่าที่ได้อาจเก่าแล้ว ไม่ cache
+                USER_LOCATION_CACHE[user_id] = (now, loc)
+                USER_LOCATION_CACHE.move_to_end(user_id)
+            while len(USER_LOCATION_CACHE) > USER_LOCATION_CACHE_SIZE:
+                USER_LOCATION_CACHE.popitem(last=False)
+    finally:
+        with USER_LOCATION_LOCK:
+            USER_LOCATION_READERS -= 1
+            if not USER_LOCATION_READERS:
+                USER_LOCATION_INVALIDATED.clear()
+    result.update(fetched)
+    return result
+
 @app.post("/api/user-location/{user_id}")
-async def save_user_location(user_id: str, payload: SaveLocationRequest):
+def save_user_location(user_id: str, payload: SaveLocationRequest):
     conn = get_db_connection()
     if not conn:
         raise HTTPException(status_code=500, detail="Database connection error")
@@ -916,6 +2269,7 @@ async def save_user_location(user_id: str, payload: SaveLocationRequest):
                 (location_id, user_id, payload.latitude, payload.longitude, payload.location_name, payload.tambon, payload.district)
             )
         conn.commit()
+        invalidate_user_location(user_id)
         return {"status": "success", "message": "Location saved."}
     except Exception as e:
         conn.rollback()
@@ -926,7 +2280,7 @@ async def save_user_location(user_id: str, payload: SaveLocationRequest):
         conn.close()
 
 @app.get("/api/user-location/{user_id}")
-async def get_user_location(user_id: str):
+def get_user_location(user_id: str):
     conn = get_db_connection()
     if not conn:
         raise HTTPException(status_code=500, detail="Database connection error")
@@ -991,7 +2345,7 @@ def ensure_reports_table(conn):
         print(f"[WARN] ensure_reports_table: {e}")
 
 @app.post("/api/reports")
-async def submit_report(payload: UserReportRequest):
+def submit_report(payload: UserReportRequest):
     """User ส่งรายงานพร้อมรูปภาพ (base64) และพิกัด"""
     conn = get_db_connection()
     if not conn:
@@ -1036,7 +2390,7 @@ async def submit_report(payload: UserReportRequest):
         conn.close()
 
 @app.get("/api/reports")
-async def get_all_reports():
+def get_all_reports():
     """Admin ดูรายงานทั้งหมดจาก user พร้อมชื่อ + พิกัด (fallback จาก user_locations)"""
     conn = get_db_connection()
     if not conn:
@@ -1061,7 +2415,13 @@ async def get_all_reports():
         rows = cursor.fetchall()
         print(f"[DEBUG] get_all_reports: found {len(rows)} reports")
 
-        # ---- Step 2: เสริม tambon/district/พิกัด จาก user_locations ----
+        # ---- Step 2: เสริม tambon/district/พิกัด จาก user_locations (query เดียวทั้งหน้า + cache) ----
+        try:
+            locations = get_user_locations(cursor, [row['user_id'] for row in rows])
+        except Exception as loc_err:
+            print(f"[WARN] user_locations lookup failed: {loc_err}")
+            locations = {}
+
         for row in rows:
             # datetime → string
             for key, val in row.items():
@@ -1076,27 +2436,14 @@ async def get_all_reports():
                     except:
                         row[coord] = None
 
-            row['tambon'] = None
-            row['district'] = None
-
-            # ดึงพิกัด + tambon/district จาก user_locations
-            try:
-                c2 = conn.cursor(dictionary=True)
-                c2.execute(
-                    "SELECT latitude, longitude, tambon, district FROM user_locations WHERE user_id = %s LIMIT 1",
-                    (row['user_id'],)
-                )
-                loc = c2.fetchone()
-                c2.close()
-                if loc:
-                    if row.get('latitude') is None and loc.get('latitude') is not None:
-                        row['latitude'] = float(loc['latitude'])
-                    if row.get('longitude') is None and loc.get('longitude') is not None:
-                        row['longitude'] = float(loc['longitude'])
-                    row['tambon']   = loc.get('tambon')
-                    row['district'] = loc.get('district')
-            except Exception as loc_err:
-                print(f"[WARN] user_locations lookup failed: {loc_err}")
+            # พิกัด fallback + tambon/district จาก user_locations
+            loc = locations.get(row['user_id']) or {}
+            if row.get('latitude') is None:
+                row['latitude'] = loc.get('latitude')
+            if row.get('longitude') is None:
+                row['longitude'] = loc.get('longitude')
+            row['tambon'] = loc.get('tambon')
+            row['district'] = loc.get('district')
 
             # img_url → full URL
             if row.get('img_url') and not str(row['img_url']).startswith('http'):
@@ -1116,7 +2463,7 @@ async def get_all_reports():
 
 # ---- กดช่วยเหลือเสร็จสิ้น ----
 @app.put("/api/reports/{report_id}/complete")
-async def complete_report(report_id: str):
+def complete_report(report_id: str):
     """Admin กดยืนยันว่าช่วยเหลือเสร็จสิ้น"""
     conn = get_db_connection()
     if not conn:
@@ -1157,7 +2504,7 @@ async def complete_report(report_id: str):
 
 # ---- ประวัติการช่วยเหลือ (completed) ----
 @app.get("/api/reports/history")
-async def get_report_history():
+def get_report_history():
     """Admin ดูรายงานที่ช่วยเหลือเสร็จสิ้นแล้ว"""
     conn = get_db_connection()
     if not conn:
@@ -1177,6 +2524,11 @@ async def get_report_history():
             ORDER BY r.completed_at DESC
         """)
         rows = cursor.fetchall()
+        try:
+            locations = get_user_locations(cursor, [row['user_id'] for row in rows])
+        except Exception as loc_err:
+            print(f"[WARN] user_locations lookup failed: {loc_err}")
+            locations = {}
         for row in rows:
             for key, val in row.items():
                 if isinstance(val, (datetime.datetime, datetime.date)):
@@ -1189,13 +2541,9 @@ async def get_report_history():
                 base = os.environ.get('BASE_URL', 'http://10.0.2.2:8000')
                 row['img_url'] = base + row['img_url']
             # เสริม tambon/district
-            try:
-                c2 = conn.cursor(dictionary=True)
-                c2.execute("SELECT tambon, district FROM user_locations WHERE user_id = %s LIMIT 1", (row['user_id'],))
-                loc = c2.fetchone(); c2.close()
-                row['tambon']   = loc.get('tambon')   if loc else None
-                row['district'] = loc.get('district') if loc else None
-            except: row['tambon'] = row['district'] = None
+            loc = locations.get(row['user_id']) or {}
+            row['tambon']   = loc.get('tambon')
+            row['district'] = loc.get('district')
         return rows
     except Exception as e:
         print(f"[ERROR] get_report_history: {e}")
@@ -1209,7 +2557,7 @@ async def get_report_history():
 # ADMIN: UPDATE EMERGENCY SERVICE
 # =============================================================
 @app.put("/api/emergency/{service_id}")
-async def update_emergency(service_id: str, payload: UpdateEmergencyRequest):
+def update_emergency(service_id: str, payload: UpdateEmergencyRequest):
     conn = get_db_connection()
     if not conn:
         raise HTTPException(status_code=500, detail="Database connection error")
@@ -1238,7 +2586,7 @@ async def update_emergency(service_id: str, payload: UpdateEmergencyRequest):
 # ADMIN: ADD EMERGENCY SERVICE
 # =============================================================
 @app.post("/api/emergency")
-async def add_emergency_service(payload: UpdateEmergencyRequest):
+def add_emergency_service(payload: UpdateEmergencyRequest):
     conn = get_db_connection()
     if not conn:
         raise HTTPException(status_code=500, detail="Database connection error")
@@ -1264,7 +2612,7 @@ async def add_emergency_service(payload: UpdateEmergencyRequest):
 # ADMIN: DELETE EMERGENCY SERVICE
 # =============================================================
 @app.delete("/api/emergency/{service_id}")
-async def delete_emergency_service(service_id: str):
+def delete_emergency_service(service_id: str):
     conn = get_db_connection()
     if not conn:
         raise HTTPException(status_code=500, detail="Database connection error")
@@ -1298,7 +2646,7 @@ async def delete_emergency_service(service_id: str):
 # ADMIN: UPLOAD IMAGE FOR EMERGENCY SERVICE (base64)
 # =============================================================
 @app.post("/api/emergency/{service_id}/image")
-async def upload_emergency_image(service_id: str, payload: UploadImageRequest):
+def upload_emergency_image(service_id: str, payload: UploadImageRequest):
     """Receive base64 image, save to disk, update img_url in DB."""
     conn = get_db_connection()
     if not conn:
@@ -1340,17 +2688,16 @@ async def upload_emergency_image(service_id: str, payload: UploadImageRequest):
 # USER: GET PIN DASHBOARD
 # =============================================================
 @app.get("/api/pins/{pin_id}/dashboard")
-async def get_pin_dashboard(pin_id: str):
+def get_pin_dashboard(pin_id: str):
     conn = get_db_connection()
     if not conn:
         raise HTTPException(status_code=500, detail="Database connection error")
     try:
         cursor = conn.cursor(dictionary=True)
         query = """
-            SELECT p.label, p.latitude, p.longitude, rg.rain_values_json 
+            SELECT p.label, p.latitude, p.longitude, sn.grid_id
             FROM user_pinned_locations p
             JOIN static_nodes sn ON p.nearest_node_id = sn.node_id
-            LEFT JOIN rain_grids rg ON sn.grid_id = rg.grid_id
             WHERE p.pin_id = %s
         """
         cursor.execute(query, (pin_id,))
@@ -1359,12 +2706,7 @@ async def get_pin_dashboard(pin_id: str):
         if not row:
             raise HTTPException(status_code=404, detail="Pin not found")
             
-        rain_data = []
-        if row.get('rain_values_json') and isinstance(row['rain_values_json'], str):
-            try:
-                rain_data = json.loads(row['rain_values_json'])
-            except:
-                pass
+        rain_data = get_rain_trend(cursor, row['grid_id'])
                 
         return {
             "label": row['label'],
@@ -1382,7 +2724,7 @@ async def get_pin_dashboard(pin_id: str):
 # USER: GET DASHBOARD BY LOCATION (Fallback for User Profile Location)
 # =============================================================
 @app.get("/api/dashboard/by-location")
-async def get_dashboard_by_location(lat: float, lon: float):
+def get_dashboard_by_location(lat: float, lon: float):
     conn = get_db_connection()
     if not conn:
         raise HTTPException(status_code=500, detail="Database connection error")
@@ -1390,21 +2732,15 @@ async def get_dashboard_by_location(lat: float, lon: float):
         cursor = conn.cursor(dictionary=True)
         # Find nearest static node
         query_node = """
-        SELECT sn.node_id, sn.latitude, sn.longitude, rg.rain_values_json 
+        SELECT sn.node_id, sn.latitude, sn.longitude, sn.grid_id
         FROM static_nodes sn
-        LEFT JOIN rain_grids rg ON sn.grid_id = rg.grid_id
         ORDER BY (POW(sn.latitude - %s, 2) + POW(sn.longitude - %s, 2)) ASC 
         LIMIT 1
         """
         cursor.execute(query_node, (lat, lon))
         row = cursor.fetchone()
         
-        rain_data = []
-        if row and row.get('rain_values_json') and isinstance(row['rain_values_json'], str):
-            try:
-                rain_data = json.loads(row['rain_values_json'])
-            except:
-                pass
+        rain_data = get_rain_trend(cursor, row['grid_id']) if row else []
                 
         return {
             "label": "พิกัดปัจจุบัน",
@@ -1422,7 +2758,14 @@ async def get_dashboard_by_location(lat: float, lon: float):
 # ADMIN: TRIGGER GEE (static features - rarely changes)
 # =============================================================
 @app.post("/trigger-gee")
-async def trigger_gee():
+async def trigger_gee(wait: bool = False):
+    """Fetch static features from Google Earth Engine and update DB (background job)."""
+    return await submit_job_response("gee", wait)
+
+async def run_gee_job(job=None):
+    return await run_db(run_gee_extraction, job)
+
+def run_gee_extraction(job=None):
     """Fetch static features from Google Earth Engine and update DB."""
     global STATIC_DATA_CACHE
     import sys, math
@@ -1494,6 +2837,7 @@ async def trigger_gee():
         for chunk_start in range(0, len(nodes), CHUNK_SIZE):
             chunk = nodes[chunk_start:chunk_start + CHUNK_SIZE]
             print(f"[GEE] Processing chunk {chunk_start // CHUNK_SIZE + 1}/{math.ceil(len(nodes) / CHUNK_SIZE)} ({len(chunk)} nodes)...")
+            report_progress(job, chunk_start / len(nodes), f"Processing chunk {chunk_start // CHUNK_SIZE + 1}/{math.ceil(len(nodes) / CHUNK_SIZE)}")
             
             # Create ee.FeatureCollection
             ee_features = []
@@ -1555,8 +2899,9 @@ async def trigger_gee():
                 updated_count += len(batch_updates)
                 print(f"[GEE] Updated {len(batch_updates)} nodes in this chunk. Total: {updated_count}")
         
-        # 6. Reload cache
+        # 6. Fill tambon/district for any node that doesn't have it yet, then reload cache
         cursor.close()
+        ensure_node_admin_area(conn)
         query = "SELECT * FROM static_nodes"
         STATIC_DATA_CACHE = pd.read_sql(query, conn)
         
@@ -1571,10 +2916,133 @@ async def trigger_gee():
     finally:
         conn.close()
 
+# =============================================================
+# ADMIN: MODEL REGISTRY — hot reload / rollback (ดู model_registry.py)
+# =============================================================
+async def run_model_activation(job):
+    """
+    โหลด version ใหม่และเตรียม process pool ให้ worker โหลด model เสร็จก่อน แล้วสลับ MODEL_BUNDLE ด้วยการ assign ครั้งเดียว
+    ระหว่างนี้ prediction ยังใช้ version เดิมได้ตามปกติ (ไม่มีช่วงที่ไม่มี model / ไม่มี cold start)
+    """
+    global MODEL_BUNDLE, PREVIOUS_BUNDLE
+    version = job.params.get('version')
+    if not version:
+        raise ValueError("Model version is required")
+    current = MODEL_BUNDLE
+    if current is not None and current.version == version and current.model is not None and not current.files_changed():
+        return {"status": "success", "message": f"Model {version} is already active", "model": current.info()}
+
+    previous = PREVIOUS_BUNDLE
+    if previous is not None and previous.version == version and previous.model is not None and not previous.files_changed():
+        bundle = previous  # rollback: ยังอยู่ใน memory ไม่ต้องโหลดใหม่
+    else:
+        report_progress(job, 0.1, f"Loading model {version}")
+        bundle = await run_db(load_bundle, version, FEATURE_ORDER, RISK_THRESHOLDS)
+
+    report_progress(job, 0.6, "Starting inference workers")
+    await INFERENCE.prepare(bundle.model_path, bundle.scaler_path, bundle.fingerprint)
+
+    write_active(version, current.version if current is not None else None)
+    PREVIOUS_BUNDLE, MODEL_BUNDLE = current, bundle
+    INFERENCE.activate(bundle.fingerprint)
+    print(f"[MODEL] Activated {version} ({type(bundle.model).__name__}), previous: {current.version if current else None}")
+    return {"status": "success", "model": bundle.info(), "previous": current.info() if current is not None else None}
+
+@app.get("/api/admin/models")
+def get_models():
+    current, previous = MODEL_BUNDLE, PREVIOUS_BUNDLE
+    return {
+        "active": current.info() if current is not None else None,
+        "previous": previous.info() if previous is not None else None,
+        "versions": list_versions(),
+    }
+
+@app.post("/api/admin/models/rollback")
+async def rollback_model(wait: bool = False):
+    """กลับไปใช้ version ก่อนหน้า (ยังอยู่ใน memory จึงสลับได้ทันทีโดยไม่ต้องโหลดใหม่)"""
+    previous = PREVIOUS_BUNDLE.version if PREVIOUS_BUNDLE is not None else read_active()['previous']
+    if not previous:
+        raise HTTPException(status_code=409, detail="No previous model version to roll back to")
+    return await submit_job_response("model", wait, params={"version": previous})
+
+@app.post("/api/admin/models/{version}/activate")
+async def activate_model(version: str, wait: bool = False):
+    """โหลด version จาก registry เป็น background job แล้วสลับเข้าใช้งาน (wait=true เพื่อรอผล)"""
+    try:
+        model_path, _, _ = version_paths(validate_version(version))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not os.path.exists(model_path):
+        raise HTTPException(status_code=404, detail="Model version not found")
+    return await submit_job_response("model", wait, params={"version": version})
+
 # =============================================================
 # ADMIN: TRIGGER RAIN FETCH + PREDICT
 # =============================================================
 @app.post("/trigger-rain")
-async def trigger_rain():
+async def trigger_rain(wait: bool = False, force: bool = False):
     """Fetch rain from Open-Meteo and run ML prediction."""
-    return await trigger_prediction()
+    return await trigger_prediction(wait, force)
+
+# =============================================================
+# BACKGROUND JOBS: scheduler + status/progress
+# =============================================================
+# ตั้งรอบได้ผ่าน env: "off", "30m", "6h", "00:30,12:30" (ดู scheduler.py)
+SCHEDULER_ENABLED = os.environ.get('SCHEDULER_ENABLED', '1') != '0'
+SCHEDULE_RAIN = os.environ.get('SCHEDULE_RAIN', '00:30')
+SCHEDULE_PREDICTION = os.environ.get('SCHEDULE_PREDICTION', '6h')
+SCHEDULE_GEE = os.environ.get('SCHEDULE_GEE', 'off')
+SCHEDULE_RETENTION = os.environ.get('SCHEDULE_RETENTION', '03:30')
+# สั่ง prediction ซ้ำภายในช่วงนี้หลังรอบที่สำเร็จ จะได้ผลรอบล่าสุดแทนการรันใหม่ (0 = ปิด)
+PREDICTION_MIN_INTERVAL_S = float(os.environ.get('PREDICTION_MIN_INTERVAL_S', 300))
+
+SCHEDULER = JobScheduler()
+# prediction ดึงฝนเองด้วย จึงอยู่ lock group เดียวกับงานดึงฝน (รันต่อกัน ไม่ยิง Open-Meteo ซ้อนกัน)
+SCHEDULER.register("rain", run_rain_refresh, SCHEDULE_RAIN, lock_group="weather",
+                   description="Fetch missing daily rain into rain_daily")
+SCHEDULER.register("prediction", run_prediction, SCHEDULE_PREDICTION, lock_group="weather",
+                   description="Refresh rain and run the landslide model", min_interval_s=PREDICTION_MIN_INTERVAL_S)
+SCHEDULER.register("gee", run_gee_job, SCHEDULE_GEE,
+                   description="Extract static node features from Google Earth Engine")
+SCHEDULER.register("retention", run_retention, SCHEDULE_RETENTION,
+                   description="Partition prediction_logs by month, roll up old pending logs and drop expired data")
+SCHEDULER.register("model", run_model_activation,
+                   description="Load a model version from the registry and swap it in (params: version)")
+
+async def submit_job_response(name, wait=False, force=False, params=None):
+    """สั่งรัน job (ซ้อนกับ job ที่รันอยู่จะได้ job เดิม) แล้วตอบทันทีพร้อม job_id หรือรอผลถ้า wait"""
+    job, coalesced = SCHEDULER.submit(name, force=force, params=params)
+    if coalesced and params is not None and job.params != params:
+        raise HTTPException(status_code=409, detail=f"Job '{name}' is already running with {job.params} (job {job.job_id})")
+    if job.finished:
+        # เพิ่งรันเสร็จไม่เกิน min interval -> ส่งผลรอบล่าสุดกลับไปเลย
+        return {**(job.result or {}), "job_id": job.job_id, "reused": True, "finished_at": job.finished_at.isoformat()}
+    if wait:
+        await SCHEDULER.wait(job)
+        if job.status == 'failed':
+            raise HTTPException(status_code=500, detail=job.error)
+        return {**(job.result or {}), "job_id": job.job_id}
+    return {
+        "status": "accepted",
+        "message": f"Job '{name}' is {'already running' if coalesced else 'queued'}.",
+        "job_id": job.job_id,
+        "coalesced": coalesced,
+        "status_url": f"/api/jobs/{job.job_id}",
+    }
+
+@app.get("/api/jobs")
+def list_jobs(name: Optional[str] = None, limit: int = 20):
+    return {"schedules": SCHEDULER.schedules(), "jobs": SCHEDULER.list_jobs(name, max(1, min(limit, 50)))}
+
+@app.get("/api/jobs/{job_id}")
+def get_job(job_id: str):
+    job = SCHEDULER.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+@app.post("/api/jobs/{name}/run")
+async def run_job(name: str, wait: bool = False, force: bool = False):
+    if name not in SCHEDULER.definitions:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return await submit_job_response(name, wait, force)
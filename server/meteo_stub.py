@@ -0,0 +1,77 @@
+"""
+Open-Meteo stub สำหรับทดสอบ/benchmark weather.py แบบ offline
+
+รองรับ latitude/longitude แบบหลายพิกัด (comma-separated) เหมือนของจริง
+คืน precipitation_sum ที่คำนวณจากพิกัด (deterministic) พร้อมจำลอง latency และ HTTP 429
+
+Usage:
+    cd server
+    py meteo_stub.py                          # http://127.0.0.1:8089/v1/forecast
+    py meteo_stub.py --port 8089 --latency 0.15 --throttle-rate 0.05
+    set OPEN_METEO_URL=http://127.0.0.1:8089/v1/forecast   แล้วรัน main.py ได้เลย
+"""
+import argparse
+import asyncio
+import datetime
+import random
+from typing import Optional
+
+from fastapi import FastAPI, Query
+from fastapi.responses import JSONResponse
+
+STUB_SETTINGS = {"latency": 0.15, "throttle_rate": 0.0}
+STUB_STATS = {"requests": 0, "locations": 0, "throttled": 0}
+
+stub_app = FastAPI()
+
+
+def stub_precipitation(lat, lon, date):
+    """ฝนของพิกัด/วันนั้น คงที่ทุกครั้งที่ขอ (ขอเป็นช่วงหรือทีละวันก็ได้ค่าเดียวกัน)"""
+    rng = random.Random(f"{lat:.4f},{lon:.4f},{date.isoformat()}")
+    return round(rng.random() * 20, 1) if rng.random() < 0.4 else 0.0
+
+
+@stub_app.get("/v1/forecast")
+async def forecast(latitude: str, longitude: str, past_days: int = Query(10), forecast_days: int = Query(1),
+                   start_date: Optional[str] = None, end_date: Optional[str] = None):
+    STUB_STATS["requests"] += 1
+    await asyncio.sleep(STUB_SETTINGS["latency"])
+    if random.random() < STUB_SETTINGS["throttle_rate"]:
+        STUB_STATS["throttled"] += 1
+        return JSONResponse({"error": True, "reason": "Too many concurrent requests"}, status_code=429, headers={"Retry-After": "0.2"})
+
+    lats = [float(v) for v in latitude.split(',')]
+    lons = [float(v) for v in longitude.split(',')]
+    if len(lats) != len(lons):
+        return JSONResponse({"error": True, "reason": "latitude and longitude must have the same length"}, status_code=400)
+    STUB_STATS["locations"] += len(lats)
+
+    if start_date:
+        start = datetime.date.fromisoformat(start_date)
+        days = (datetime.date.fromisoformat(end_date or start_date) - start).days + 1
+    else:
+        start = datetime.date.today() - datetime.timedelta(days=past_days)
+        days = past_days + forecast_days
+    dates = [start + datetime.timedelta(days=i) for i in range(days)]
+    locations = [
+        {"latitude": la, "longitude": lo,
+         "daily": {"time": [d.isoformat() for d in dates], "precipitation_sum": [stub_precipitation(la, lo, d) for d in dates]}}
+        for la, lo in zip(lats, lons)
+    ]
+    return locations if len(locations) > 1 else locations[0]
+
+
+def main():
+    import uvicorn
+    parser = argparse.ArgumentParser(description="Local Open-Meteo stub")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=STUB_SETTINGS["latency"], help="วินาทีต่อ request")
+    parser.add_argument("--throttle-rate", type=float, default=STUB_SETTINGS["throttle_rate"], help="สัดส่วน request ที่ตอบ 429")
+    args = parser.parse_args()
+    STUB_SETTINGS.update(latency=args.latency, throttle_rate=args.throttle_rate)
+    uvicorn.run(stub_app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+Model registry: เก็บ model + scaler หลาย version พร้อม metadata แล้วโหลด/สลับ version ได้ขณะ server รันอยู่
+
+โครงสร้างไดเรกทอรี (MODEL_REGISTRY_DIR, default ml_pipeline/models/registry):
+    <version>/model.pkl
+    <version>/scaler.pkl
+    <version>/metadata.json   {"version", "created_at", "model_type", "feature_order": [...],
+                               "thresholds": {"medium": 0.18, "high": 0.60}, "metrics": {...}}
+    ACTIVE.json               {"active": "<version>", "previous": "<version>"}
+
+- retrain_model.py เขียน version ใหม่ลง registry (ยังไม่ใช้งาน) แล้วสั่งใช้ผ่าน POST /api/admin/models/{version}/activate
+- ถ้ายังไม่เคย activate version ใดเลย ใช้ไฟล์เดิม best_ml_model.pkl / landslide_scaler.pkl เป็น version "legacy"
+- ModelBundle โหลดครบทุกอย่าง (model, scaler, predictor, fingerprint) ก่อนสลับ แล้ว main.py สลับด้วยการ assign ครั้งเดียว
+
+ตั้งค่าได้ผ่าน environment variables:
+    MODEL_REGISTRY_DIR   ที่เก็บ registry
+"""
+import datetime
+import hashlib
+import json
+import os
+import re
+
+import joblib
+
+from inference import build_predictor
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODEL_REGISTRY_DIR = os.environ.get('MODEL_REGISTRY_DIR', os.path.join(PROJECT_ROOT, 'ml_pipeline', 'models', 'registry'))
+LEGACY_VERSION = 'legacy'
+LEGACY_MODEL_PATH = os.path.join(PROJECT_ROOT, 'ml_pipeline', 'models', 'best_ml_model.pkl')
+LEGACY_SCALER_PATH = os.path.join(PROJECT_ROOT, 'ml_pipeline', 'models', 'landslide_scaler.pkl')
+
+ACTIVE_FILE = 'ACTIVE.json'
+_VERSION_RE = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._-]{0,63}$')
+
+
+def file_fingerprint(*paths):
+    """sha1 ของไฟล์ทั้งหมดรวมกัน (ไฟล์ที่ไม่มีนับเป็นค่าว่าง)"""
+    h = hashlib.sha1()
+    for path in paths:
+        try:
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    h.update(block)
+        except OSError:
+            h.update(b'-')
+    return h.hexdigest()
+
+
+class ModelBundle:
+    """model 1 version ที่โหลดพร้อมใช้ (ไม่แก้ไขหลังสร้าง — เปลี่ยน model = สร้าง bundle ใหม่แล้วสลับทั้งก้อน)"""
+
+    def __init__(self, version, model, scaler, model_path, scaler_path, metadata, feature_order, thresholds, files, predictor):
+        self.version = version
+        self.model = model
+        self.scaler = scaler
+        self.model_path = model_path
+        self.scaler_path = scaler_path
+        self.metadata = metadata
+        self.feature_order = feature_order    # ชื่อคอลัมน์ของ static_nodes/df เรียงตามที่ model train มา
+        self.thresholds = thresholds          # (medium, high)
+        self.files = files                    # ไฟล์ที่ใช้คิด fingerprint (model, scaler, metadata)
+        self.fingerprint = file_fingerprint(*files)
+        self.predictor = predictor
+        self.loaded_at = datetime.datetime.now()
+
+    def files_changed(self):
+        """ไฟล์บน disk ไม่ตรงกับที่โหลดไว้แล้ว (เช่น legacy ถูก retrain_model.py เขียนทับ) -> worker จะโหลดได้คนละ model"""
+        return file_fingerprint(*self.files) != self.fingerprint
+
+    def info(self):
+        return {
+            "version": self.version,
+            "model_type": type(self.model).__name__ if self.model is not None else None,
+            "loaded": self.model is not None,
+            "thresholds": {"medium": self.thresholds[0], "high": self.thresholds[1]},
+            "metrics": self.metadata.get('metrics'),
+            "created_at": self.metadata.get('created_at'),
+            "fingerprint": self.fingerprint,
+            "loaded_at": self.loaded_at.isoformat(),
+        }
+
+
+def validate_version(version):
+    if version != LEGACY_VERSION and not _VERSION_RE.match(version or ''):
+        raise ValueError(f"Invalid model version: {version!r}")
+    return version
+
+
+def version_paths(version, registry_dir=MODEL_REGISTRY_DIR):
+    """(model_path, scaler_path, metadata_path) ของ version"""
+    if validate_version(version) == LEGACY_VERSION:
+        return LEGACY_MODEL_PATH, LEGACY_SCALER_PATH, None
+    base = os.path.join(registry_dir, version)
+    return os.path.join(base, 'model.pkl'), os.path.join(base, 'scaler.pkl'), os.path.join(base, 'metadata.json')
+
+
+def read_metadata(version, registry_dir=MODEL_REGISTRY_DIR):
+    _, _, metadata_path = version_paths(version, registry_dir)
+    if metadata_path is None:
+        return {"version": LEGACY_VERSION}
+    with open(metadata_path, encoding='utf-8') as f:
+        metadata = json.load(f)
+    metadata.setdefault('version', version)
+    return metadata
+
+
+def list_versions(registry_dir=MODEL_REGISTRY_DIR):
+    """metadata ของทุก version ใน registry (ใหม่สุดก่อน) ข้าม version ที่ไฟล์ไม่ครบ"""
+    versions = []
+    try:
+        names = os.listdir(registry_dir)
+    except OSError:
+        return versions
+    for name in names:
+        if not _VERSION_RE.match(name) or not os.path.isdir(os.path.join(registry_dir, name)):
+            continue
+        model_path, _, _ = version_paths(name, registry_dir)
+        if not os.path.exists(model_path):
+            continue
+        try:
+            versions.append(read_metadata(name, registry_dir))
+        except (OSError, ValueError) as e:
+            print(f"[MODEL] Skipping {name}: bad metadata.json ({e})")
+    versions.sort(key=lambda m: (str(m.get('created_at') or ''), m['version']), reverse=True)
+    return versions
+
+
+def read_active(registry_dir=MODEL_REGISTRY_DIR):
+    """{"active": version หรือ None, "previous": version หรือ None}"""
+    try:
+        with open(os.path.join(registry_dir, ACTIVE_FILE), encoding='utf-8') as f:
+            data = json.load(f)
+        return {"active": data.get('active'), "previous": data.get('previous')}
+    except (OSError, ValueError):
+        return {"active": None, "previous": None}
+
+
+def write_active(active, previous, registry_dir=MODEL_REGISTRY_DIR):
+    """บันทึก version ที่ใช้อยู่ (atomic: เขียนไฟล์ชั่วคราวแล้ว replace) ให้ restart แล้วได้ version เดิม"""
+    os.makedirs(registry_dir, exist_ok=True)
+    path = os.path.join(registry_dir, ACTIVE_FILE)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"active": active, "previous": previous,
+                   "updated_at": datetime.datetime.now().isoformat()}, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def resolve_feature_order(names, available):
+    """
+    จับคู่ชื่อ feature ใน metadata (ตาม CSV ตอน train เช่น Elevation_Extracted) กับคอลัมน์ของ server
+    (เช่น elevation_extracted) แบบไม่สนตัวพิมพ์ — feature ที่ไม่มีใน server ถือว่า version นี้ใช้ไม่ได้
+    """
+    by_lower = {c.lower(): c for c in available}
+    missing = [n for n in names if n.lower() not in by_lower]
+    if missing:
+        raise ValueError(f"Model features not available on the server: {', '.join(missing)}")
+    return [by_lower[n.lower()] for n in names]
+
+
+def resolve_thresholds(metadata, default):
+    t = metadata.get('thresholds') or {}
+    medium = float(t.get('medium', default[0]))
+    high = float(t.get('high', default[1]))
+    if not 0.0 <= medium <= high <= 1.0:
+        raise ValueError(f"Invalid risk thresholds: medium={medium}, high={high}")
+    return medium, high
+
+
+def load_bundle(version, feature_columns, default_thresholds, registry_dir=MODEL_REGISTRY_DIR, required=True):
+    """
+    โหลด version (blocking: joblib) — เรียกใน thread/background job
+    required=False (legacy ตอน startup): ไม่มีไฟล์ model ก็คืน bundle ที่ model=None แทนการ raise
+    """
+    model_path, scaler_path, _ = version_paths(version, registry_dir)
+    metadata = read_metadata(version, registry_dir)
+    feature_order = resolve_feature_order(metadata.get('feature_order') or feature_columns, feature_columns)
+    thresholds = resolve_thresholds(metadata, default_thresholds)
+
+    model = scaler = None
+    try:
+        model = joblib.load(model_path)
+    except Exception as e:
+        if required:
+            raise
+        print(f"Warning: {os.path.basename(model_path)} not found ({e}).")
+    try:
+        scaler = joblib.load(scaler_path)
+    except Exception as e:
+        if required and os.path.exists(scaler_path):
+            raise
+        print(f"Warning: {os.path.basename(scaler_path)} not found.")
+
+    n_features = getattr(model, 'n_features_in_', None)
+    if required and n_features is not None and n_features != len(feature_order):
+        raise ValueError(f"Model expects {n_features} features, metadata lists {len(feature_order)}")
+
+    # metadata อยู่ใน fingerprint ด้วย: เปลี่ยน threshold/feature order ก็ต้อง re-score ทุก node
+    _, _, metadata_path = version_paths(version, registry_dir)
+    files = (model_path, scaler_path) + ((metadata_path,) if metadata_path else ())
+    return ModelBundle(version, model, scaler, model_path, scaler_path, metadata, feature_order, thresholds,
+                       files, build_predictor(model, scaler))
@@ -0,0 +1,367 @@
+"""
+Retention ของ prediction_logs: แบ่ง partition รายเดือน + rollup log เก่า + ลบข้อมูลหมดอายุ
+
+- prediction_logs แบ่ง RANGE partition รายเดือนด้วย UNIX_TIMESTAMP(timestamp) (pYYYYMM ... + pmax)
+  ข้อจำกัดของ partition: ทุก unique key ต้องมี timestamp -> PK เป็น (log_id, timestamp) และใช้ foreign key ไม่ได้
+  จึงถอด FK node_id -> static_nodes และ notifications.log_id -> prediction_logs ออก
+  (ก่อนลบ log จะ set notifications.log_id = NULL เองแทน ON DELETE SET NULL เดิม
+  และ job ลบ log ของ node ที่ถูกลบออกจาก static_nodes เองแทน ON DELETE CASCADE เดิม — delete_orphaned_logs)
+- rollup: log ที่ไม่เคยถูกตรวจ (status = 'pending' ซึ่งรวม Low เกือบทั้งหมด) ที่เก่ากว่า PREDICTION_ROLLUP_AFTER_DAYS วัน
+  และมี log ใหม่กว่าของ node เดียวกันแล้ว ยุบเป็นสถิติรายวันต่อ node ใน prediction_log_daily แล้วลบแถวเดิม
+  (log ล่าสุดของ node ยังเป็น alert ที่รอตรวจอยู่จึงไม่ยุบ) — approved/rejected เก็บไว้เป็นประวัติจนหมดอายุ
+- หมดอายุ: partition ที่เก่ากว่า PREDICTION_LOG_RETENTION_MONTHS เดือน DROP ทั้งก้อน (ไม่ต้อง DELETE ทีละแถว)
+  ถ้า DB แบ่ง partition ไม่ได้ (ลองกับตารางเปล่าก่อนถอด FK) จะ DELETE เป็น batch แทนโดย FK เดิมยังอยู่
+- สร้าง partition ของเดือนถัดไปล่วงหน้า PARTITION_MONTHS_AHEAD เดือน (แตกจาก pmax ที่ว่างอยู่ จึงเร็ว)
+
+ตั้งค่าได้ผ่าน environment variables:
+    PREDICTION_LOG_RETENTION_MONTHS   เก็บ log / run / สถิติรายวันกี่เดือน (default 24, 0 = ไม่ลบ)
+    PREDICTION_ROLLUP_AFTER_DAYS      rollup log pending ที่เก่ากว่ากี่วัน (default 30, 0 = ไม่ rollup)
+    PARTITION_MONTHS_AHEAD            สร้าง partition ล่วงหน้ากี่เดือน (default 3)
+"""
+import datetime
+import os
+
+PREDICTION_LOG_RETENTION_MONTHS = int(os.environ.get('PREDICTION_LOG_RETENTION_MONTHS', 24))
+PREDICTION_ROLLUP_AFTER_DAYS = int(os.environ.get('PREDICTION_ROLLUP_AFTER_DAYS', 30))
+PARTITION_MONTHS_AHEAD = max(1, int(os.environ.get('PARTITION_MONTHS_AHEAD', 3)))
+
+LOG_TABLE = 'prediction_logs'
+DELETE_BATCH = 5000
+# log ล่าสุดของ node คือสถานะปัจจุบัน (pending alert ที่ยังไม่มีใครตรวจ) จึงไม่ถูก rollup
+LATEST_TABLE = 'prediction_log_latest_tmp'
+PROBE_TABLE = 'prediction_logs_partition_probe'
+
+
+def month_start(d):
+    return datetime.date(d.year, d.month, 1)
+
+
+def add_months(month, n):
+    y, m = divmod(month.month - 1 + n, 12)
+    return datetime.date(month.year + y, m + 1, 1)
+
+
+def partition_name(month):
+    return f"p{month:%Y%m}"
+
+
+def partition_month(name):
+    """pYYYYMM -> วันแรกของเดือน (pmax / ชื่ออื่น -> None)"""
+    try:
+        return datetime.datetime.strptime(name, 'p%Y%m').date()
+    except (TypeError, ValueError):
+        return None
+
+
+def partition_clause(month):
+    return f"PARTITION {partition_name(month)} VALUES LESS THAN (UNIX_TIMESTAMP('{add_months(month, 1)} 00:00:00'))"
+
+
+def list_partitions(cursor):
+    cursor.execute("""
+        SELECT PARTITION_NAME FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL
+        ORDER BY PARTITION_ORDINAL_POSITION
+    """, (LOG_TABLE,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def partition_statements(table, months):
+    """DDL ที่แปลง table เป็น partition รายเดือน (PK ต้องมี timestamp ก่อน)"""
+    return [
+        f"""
+            ALTER TABLE {table}
+              MODIFY timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+              DROP PRIMARY KEY,
+              ADD PRIMARY KEY (log_id, timestamp)
+        """,
+        f"""
+            ALTER TABLE {table} PARTITION BY RANGE (UNIX_TIMESTAMP(timestamp)) (
+              {", ".join(partition_clause(m) for m in months)},
+              PARTITION pmax VALUES LESS THAN MAXVALUE
+            )
+        """,
+    ]
+
+
+def partitioning_supported(cursor, months):
+    """
+    ลอง DDL ชุดเดียวกันกับตารางเปล่าที่โครงสร้างเหมือน prediction_logs ก่อน (CREATE TABLE ... LIKE ไม่ copy foreign key)
+    DDL commit ทันที ถ้าไปลองกับตารางจริงหลังถอด FK แล้วล้ม rollback ก็เอา FK คืนไม่ได้
+    """
+    cursor.execute(f"DROP TABLE IF EXISTS {PROBE_TABLE}")
+    try:
+        cursor.execute(f"CREATE TABLE {PROBE_TABLE} LIKE {LOG_TABLE}")
+        for statement in partition_statements(PROBE_TABLE, months):
+            cursor.execute(statement)
+        return True
+    except Exception as e:
+        print(f"[WARN] Partitioning not supported for {LOG_TABLE}, using batched DELETE for retention: {e}")
+        return False
+    finally:
+        cursor.execute(f"DROP TABLE IF EXISTS {PROBE_TABLE}")
+
+
+def _text(value):
+    return value.decode() if isinstance(value, (bytes, bytearray)) else value
+
+
+def foreign_keys(cursor):
+    """FK ที่ผูกกับ prediction_logs (ทั้งขาออกและขาเข้า) พร้อมนิยามสำหรับสร้างคืน"""
+    cursor.execute("""
+        SELECT rc.TABLE_NAME, rc.CONSTRAINT_NAME, rc.REFERENCED_TABLE_NAME, rc.DELETE_RULE, rc.UPDATE_RULE,
+               GROUP_CONCAT(k.COLUMN_NAME ORDER BY k.ORDINAL_POSITION),
+               GROUP_CONCAT(k.REFERENCED_COLUMN_NAME ORDER BY k.ORDINAL_POSITION)
+        FROM information_schema.REFERENTIAL_CONSTRAINTS rc
+        JOIN information_schema.KEY_COLUMN_USAGE k
+          ON k.CONSTRAINT_SCHEMA = rc.CONSTRAINT_SCHEMA AND k.TABLE_NAME = rc.TABLE_NAME AND k.CONSTRAINT_NAME = rc.CONSTRAINT_NAME
+        WHERE rc.CONSTRAINT_SCHEMA = DATABASE() AND (rc.TABLE_NAME = %s OR rc.REFERENCED_TABLE_NAME = %s)
+        GROUP BY rc.TABLE_NAME, rc.CONSTRAINT_NAME, rc.REFERENCED_TABLE_NAME, rc.DELETE_RULE, rc.UPDATE_RULE
+    """, (LOG_TABLE, LOG_TABLE))
+    return [tuple(_text(v) for v in row) for row in cursor.fetchall()]
+
+
+def restore_foreign_keys(cursor, keys):
+    for table, constraint, ref_table, on_delete, on_update, columns, ref_columns in keys:
+        try:
+            cursor.execute(
+                f"ALTER TABLE {table} ADD CONSTRAINT {constraint} FOREIGN KEY ({columns}) "
+                f"REFERENCES {ref_table} ({ref_columns}) ON DELETE {on_delete} ON UPDATE {on_update}"
+            )
+            print(f"[RETENTION] Restored foreign key {table}.{constraint}")
+        except Exception as e:
+            print(f"[WARN] Could not restore foreign key {table}.{constraint}: {e}")
+
+
+def ensure_partitioned(conn, today=None):
+    """
+    แปลง prediction_logs เป็น partition รายเดือน (ครั้งเดียว, copy ทั้งตาราง) คืน True ถ้าแบ่งแล้ว
+    แปลงไม่ได้ (เช่น DB ไม่รองรับ) คืน False -> ใช้ DELETE แบบ batch แทน โดย FK เดิมยังอยู่ครบ
+    """
+    cursor = conn.cursor()
+    dropped = []
+    try:
+        if list_partitions(cursor):
+            return True
+        cursor.execute(f"SELECT MIN(timestamp) FROM {LOG_TABLE}")
+        oldest = cursor.fetchone()[0]
+        current = month_start(today or datetime.date.today())
+        first = month_start(oldest.date()) if oldest else current
+        months = []
+        month = first
+        while month <= add_months(current, PARTITION_MONTHS_AHEAD):
+            months.append(month)
+            month = add_months(month, 1)
+        if not partitioning_supported(cursor, months):
+            return False
+
+        for key in foreign_keys(cursor):
+            cursor.execute(f"ALTER TABLE {key[0]} DROP FOREIGN KEY {key[1]}")
+            dropped.append(key)
+            print(f"[RETENTION] Dropped foreign key {key[0]}.{key[1]} (not allowed on partitioned tables)")
+
+        for statement in partition_statements(LOG_TABLE, months):
+            cursor.execute(statement)
+        conn.commit()
+        print(f"[RETENTION] Partitioned {LOG_TABLE} into {len(months)} monthly partitions")
+        return True
+    except Exception as e:
+        conn.rollback()
+        print(f"[WARN] Could not partition {LOG_TABLE}, using batched DELETE for retention: {e}")
+        # DDL commit ไปแล้ว rollback ไม่คืน FK ให้ ต้องสร้างคืนเอง
+        restore_foreign_keys(cursor, dropped)
+        return False
+    finally:
+        cursor.close()
+
+
+def ensure_future_partitions(conn, today=None):
+    """แตก pmax (ว่าง) เป็นเดือนถัดไปให้ครบ PARTITION_MONTHS_AHEAD เดือน คืนจำนวน partition ที่เพิ่ม"""
+    cursor = conn.cursor()
+    try:
+        months = [m for m in map(partition_month, list_partitions(cursor)) if m]
+        if not months:
+            return 0
+        target = add_months(month_start(today or datetime.date.today()), PARTITION_MONTHS_AHEAD)
+        new_months = []
+        month = add_months(max(months), 1)
+        while month <= target:
+            new_months.append(month)
+            month = add_months(month, 1)
+        if new_months:
+            cursor.execute(f"""
+                ALTER TABLE {LOG_TABLE} REORGANIZE PARTITION pmax INTO (
+                  {", ".join(partition_clause(m) for m in new_months)},
+                  PARTITION pmax VALUES LESS THAN MAXVALUE
+                )
+            """)
+        return len(new_months)
+    finally:
+        cursor.close()
+
+
+def rollup_pending_logs(conn, after_days=PREDICTION_ROLLUP_AFTER_DAYS, today=None, progress=None):
+    """
+    ยุบ log pending ที่เก่ากว่า after_days วันเป็นสถิติรายวันต่อ node ทีละวัน (1 transaction ต่อวัน)
+    upsert แบบรวมค่า จึงรันซ้ำ/ต่อจากรอบที่ค้างได้ คืน (จำนวนวัน, จำนวน log ที่ยุบ)
+    """
+    if after_days <= 0:
+        return 0, 0
+    cutoff = (today or datetime.date.today()) - datetime.timedelta(days=after_days)
+    cursor = conn.cursor()
+    days = rows = 0
+    try:
+        # snapshot log ล่าสุดของแต่ละ node ครั้งเดียวต่อรอบ (log ที่เขียนระหว่างรันมีแต่ใหม่กว่า จึงไม่ยุบผิดตัว)
+        # ใช้ temporary table เพราะ DELETE อ่านตารางเดียวกับที่ลบใน subquery ไม่ได้
+        cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS {LATEST_TABLE}")
+        cursor.execute(f"""
+            CREATE TEMPORARY TABLE {LATEST_TABLE} (node_id INT PRIMARY KEY, latest TIMESTAMP NOT NULL)
+            SELECT node_id, MAX(timestamp) AS latest FROM {LOG_TABLE} GROUP BY node_id
+        """)
+        superseded = f"""
+            FROM {LOG_TABLE} pl
+            JOIN {LATEST_TABLE} latest ON latest.node_id = pl.node_id
+            WHERE pl.status = 'pending' AND pl.timestamp < latest.latest"""
+        cursor.execute(f"SELECT MIN(pl.timestamp) {superseded} AND pl.timestamp < %s", (cutoff,))
+        oldest = cursor.fetchone()[0]
+        first_day = day = oldest.date() if oldest is not None else cutoff
+        total_days = (cutoff - first_day).days
+        while day < cutoff:
+            start, end = day, day + datetime.timedelta(days=1)
+            # risk_level + 0 = ลำดับของ ENUM (1=Low, 2=Medium, 3=High) -> risk code 0..2 แบบเดียวกับ classify_risk
+            cursor.execute(f"""
+                INSERT INTO prediction_log_daily (node_id, log_date, samples, prob_min, prob_max, prob_sum, max_risk_code)
+                SELECT pl.node_id, DATE(pl.timestamp), COUNT(*), MIN(pl.probability), MAX(pl.probability), SUM(pl.probability),
+                       MAX(pl.risk_level + 0) - 1
+                {superseded} AND pl.timestamp >= %s AND pl.timestamp < %s
+                GROUP BY pl.node_id, DATE(pl.timestamp)
+                ON DUPLICATE KEY UPDATE
+                  samples = samples + VALUES(samples),
+                  prob_min = LEAST(prob_min, VALUES(prob_min)),
+                  prob_max = GREATEST(prob_max, VALUES(prob_max)),
+                  prob_sum = prob_sum + VALUES(prob_sum),
+                  max_risk_code = GREATEST(max_risk_code, VALUES(max_risk_code))
+            """, (start, end))
+            cursor.execute(f"DELETE pl {superseded} AND pl.timestamp >= %s AND pl.timestamp < %s", (start, end))
+            if cursor.rowcount:
+                days += 1
+                rows += cursor.rowcount
+            conn.commit()
+            if progress:
+                progress((day - first_day).days / max(1, total_days))
+            day = end
+        cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS {LATEST_TABLE}")
+
+        # ฝนของรอบเก่าที่ไม่เหลือ log แล้วไม่มีใครอ่าน
+        cursor.execute(f"""
+            DELETE rr FROM prediction_run_rain rr
+            JOIN prediction_runs r ON r.run_id = rr.run_id
+            WHERE r.started_at < %s
+              AND NOT EXISTS (SELECT 1 FROM {LOG_TABLE} pl WHERE pl.run_id = rr.run_id)
+        """, (cutoff,))
+        conn.commit()
+        return days, rows
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def delete_orphaned_logs(conn):
+    """
+    ลบ log (และสถิติรายวัน) ของ node ที่ไม่อยู่ใน static_nodes แล้ว ทีละ DELETE_BATCH แถว คืนจำนวน log ที่ลบ
+    แทน ON DELETE CASCADE ของ FK node_id ที่ถอดออกตอนแบ่ง partition (ลบ/seed node ใหม่แล้ว log เดิมค้าง
+    และถูก JOIN ของ pending alerts / history ซ่อนไว้เงียบๆ)
+    """
+    cursor = conn.cursor()
+    deleted = 0
+    try:
+        # DISTINCT node_id อ่านจาก idx_prediction_logs_node_time (loose index scan) ไม่ต้องไล่ทุกแถว — ปกติไม่มี orphan เลย
+        cursor.execute(f"""
+            SELECT d.node_id FROM (SELECT DISTINCT node_id FROM {LOG_TABLE}) d
+            LEFT JOIN static_nodes sn ON sn.node_id = d.node_id
+            WHERE sn.node_id IS NULL
+        """)
+        node_ids = [row[0] for row in cursor.fetchall()]
+        if node_ids:
+            node_clause = ", ".join(["%s"] * len(node_ids))
+            while True:
+                cursor.execute(f"SELECT log_id FROM {LOG_TABLE} WHERE node_id IN ({node_clause}) LIMIT {DELETE_BATCH}", tuple(node_ids))
+                log_ids = [row[0] for row in cursor.fetchall()]
+                if not log_ids:
+                    break
+                in_clause = ", ".join(["%s"] * len(log_ids))
+                cursor.execute(f"UPDATE notifications SET log_id = NULL WHERE log_id IN ({in_clause})", tuple(log_ids))
+                cursor.execute(f"DELETE FROM {LOG_TABLE} WHERE log_id IN ({in_clause})", tuple(log_ids))
+                deleted += cursor.rowcount
+                conn.commit()
+                if len(log_ids) < DELETE_BATCH:
+                    break
+        cursor.execute("""
+            DELETE d FROM prediction_log_daily d
+            LEFT JOIN static_nodes sn ON sn.node_id = d.node_id
+            WHERE sn.node_id IS NULL
+        """)
+        conn.commit()
+        return deleted
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def drop_expired(conn, retention_months=PREDICTION_LOG_RETENTION_MONTHS, partitioned=True, today=None):
+    """
+    ลบ log / run / สถิติรายวัน ที่เก่ากว่า retention_months เดือน (นับเป็นเดือนเต็ม)
+    partitioned -> DROP PARTITION ทีละเดือน, ไม่งั้น DELETE ทีละ DELETE_BATCH แถว
+    คืน dict สรุป
+    """
+    if retention_months <= 0:
+        return {"partitions_dropped": [], "logs_deleted": 0}
+    cutoff = add_months(month_start(today or datetime.date.today()), -retention_months)
+    cursor = conn.cursor()
+    dropped, deleted = [], 0
+    try:
+        expired = [name for name in list_partitions(cursor)
+                   if partition_month(name) and partition_month(name) < cutoff] if partitioned else []
+        for name in expired:
+            cursor.execute(f"""
+                UPDATE notifications n JOIN {LOG_TABLE} PARTITION ({name}) pl ON n.log_id = pl.log_id
+                SET n.log_id = NULL
+            """)
+            cursor.execute(f"ALTER TABLE {LOG_TABLE} DROP PARTITION {name}")
+            conn.commit()
+            dropped.append(name)
+
+        if not partitioned:
+            cursor.execute(f"""
+                UPDATE notifications n JOIN {LOG_TABLE} pl ON n.log_id = pl.log_id
+                SET n.log_id = NULL
+                WHERE pl.timestamp < %s
+            """, (cutoff,))
+            conn.commit()
+            while True:
+                cursor.execute(f"DELETE FROM {LOG_TABLE} WHERE timestamp < %s LIMIT {DELETE_BATCH}", (cutoff,))
+                batch = cursor.rowcount
+                conn.commit()
+                deleted += batch
+                if batch < DELETE_BATCH:
+                    break
+
+        cursor.execute("""
+            DELETE rr FROM prediction_run_rain rr
+            JOIN prediction_runs r ON r.run_id = rr.run_id
+            WHERE r.started_at < %s
+        """, (cutoff,))
+        cursor.execute("DELETE FROM prediction_runs WHERE started_at < %s", (cutoff,))
+        runs_deleted = cursor.rowcount
+        cursor.execute("DELETE FROM prediction_log_daily WHERE log_date < %s", (cutoff,))
+        conn.commit()
+        return {"cutoff": cutoff.isoformat(), "partitions_dropped": dropped, "logs_deleted": deleted, "runs_deleted": runs_deleted}
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
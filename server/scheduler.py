@@ -0,0 +1,248 @@
+"""
+Background job scheduler (asyncio) สำหรับงานหนักของ main.py เช่น ดึงฝน / รันโมเดล / GEE
+
+- งานแต่ละชื่อรันได้ทีละ 1 ครั้ง (single-flight): สั่งซ้ำระหว่างที่กำลังรัน/รอคิว จะได้ job เดิมกลับไป
+- min_interval_s: ถ้างานเพิ่งสำเร็จไปไม่ถึงช่วงนี้ สั่งซ้ำจะได้ job ที่สำเร็จล่าสุด (ผลเดิม) แทนการรันใหม่
+- งานใน lock_group เดียวกันรันต่อกันทีละงาน (เช่น ดึงฝน กับ prediction ที่ดึงฝนเองด้วย)
+- ตั้งรอบอัตโนมัติแบบ cron อย่างง่ายด้วย schedule spec:
+    "off" / ""          ไม่รันอัตโนมัติ (สั่งเองได้อย่างเดียว)
+    "30m", "6h", "1d"   ทุกช่วงเวลา นับจากเที่ยงคืน (6h -> 00:00, 06:00, 12:00, 18:00; 1d -> ทุกเที่ยงคืน, 2d -> เที่ยงคืนเว้นวัน)
+    "00:30,12:30"       ทุกวันตามเวลาที่กำหนด (เวลาเครื่อง server)
+- เก็บประวัติ job ล่าสุดไว้ใน memory สำหรับ endpoint ดูสถานะ/ความคืบหน้า
+"""
+import asyncio
+import datetime
+import re
+import uuid
+from collections import deque
+
+_INTERVAL_RE = re.compile(r'^(\d+)\s*([smhd])$')
+_INTERVAL_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+_SCHEDULE_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+class Schedule:
+    """รอบเวลาของงาน: ทุก interval (นับจากเที่ยงคืน) หรือเวลาที่กำหนดในแต่ละวัน"""
+
+    def __init__(self, spec):
+        self.spec = (spec or '').strip().lower()
+        self.interval = None
+        self.times = []
+        if self.spec in ('', 'off', 'none'):
+            return
+        m = _INTERVAL_RE.match(self.spec)
+        if m:
+            self.interval = datetime.timedelta(seconds=int(m.group(1)) * _INTERVAL_UNITS[m.group(2)])
+            if self.interval.total_seconds() <= 0:
+                raise ValueError(f"Invalid schedule interval: {spec!r}")
+            return
+        try:
+            self.times = sorted(datetime.time.fromisoformat(t.strip()) for t in self.spec.split(','))
+        except ValueError:
+            raise ValueError(f"Invalid schedule spec: {spec!r} (use 'off', '30m', '6h' or 'HH:MM,HH:MM')")
+
+    @property
+    def enabled(self):
+        return self.interval is not None or bool(self.times)
+
+    def next_after(self, now):
+        if self.interval is not None:
+            if self.interval >= datetime.timedelta(days=1):
+                # นับจากเที่ยงคืนของ _SCHEDULE_EPOCH: "1d" = ทุกเที่ยงคืน, "2d" = เที่ยงคืนเว้นวัน ไม่ขึ้นกับเวลาที่ server start
+                steps = int((now - _SCHEDULE_EPOCH) / self.interval) + 1
+                return _SCHEDULE_EPOCH + steps * self.interval
+            midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+            steps = int((now - midnight) / self.interval) + 1
+            nxt = midnight + steps * self.interval
+            next_midnight = midnight + datetime.timedelta(days=1)
+            return min(nxt, next_midnight)
+        if self.times:
+            for t in self.times:
+                candidate = datetime.datetime.combine(now.date(), t)
+                if candidate > now:
+                    return candidate
+            return datetime.datetime.combine(now.date() + datetime.timedelta(days=1), self.times[0])
+        return None
+
+
+class Job:
+    """งาน 1 ครั้ง: สถานะ queued -> running -> succeeded/failed พร้อม progress 0..1"""
+
+    def __init__(self, name, trigger, params=None):
+        self.job_id = str(uuid.uuid4())
+        self.name = name
+        self.trigger = trigger
+        self.params = params or {}
+        self.status = 'queued'
+        self.progress = 0.0
+        self.message = None
+        self.result = None
+        self.error = None
+        self.created_at = datetime.datetime.now()
+        self.started_at = None
+        self.finished_at = None
+        self.done = asyncio.Event()
+
+    def update(self, progress=None, message=None):
+        """ให้งานรายงานความคืบหน้า (เรียกจาก thread อื่นได้ เป็นแค่การ set ค่า)"""
+        if progress is not None:
+            self.progress = max(0.0, min(1.0, float(progress)))
+        if message is not None:
+            self.message = message
+
+    @property
+    def finished(self):
+        return self.status in ('succeeded', 'failed')
+
+    def to_dict(self):
+        duration = None
+        if self.started_at:
+            duration = round(((self.finished_at or datetime.datetime.now()) - self.started_at).total_seconds(), 3)
+        return {
+            "job_id": self.job_id,
+            "name": self.name,
+            "trigger": self.trigger,
+            "params": self.params,
+            "status": self.status,
+            "progress": round(self.progress, 3),
+            "message": self.message,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "duration_s": duration,
+        }
+
+
+class JobScheduler:
+    def __init__(self, history_size=50):
+        self.definitions = {}    # name -> {'fn', 'schedule', 'lock_group', 'description'}
+        self.active = {}         # name -> Job ที่กำลังรัน/รอคิว (single-flight)
+        self.last_success = {}   # name -> Job ที่สำเร็จล่าสุด (ใช้กับ min_interval_s)
+        self.history = deque(maxlen=history_size)
+        self.jobs_by_id = {}
+        self.next_runs = {}
+        self.group_locks = {}
+        self.tasks = []
+        self._running = set()    # task ของ job ที่ยังไม่จบ (event loop อ้าง task แบบ weak — ไม่เก็บไว้อาจโดน GC กลางทาง)
+        self.started = False
+
+    def register(self, name, fn, schedule=None, lock_group=None, description=None, min_interval_s=0):
+        """fn = async def fn(job) -> dict ผลลัพธ์ (ใช้ job.update() รายงานความคืบหน้า)"""
+        self.definitions[name] = {
+            'fn': fn,
+            'schedule': Schedule(schedule),
+            'lock_group': lock_group or name,
+            'description': description,
+            'min_interval': datetime.timedelta(seconds=max(0.0, float(min_interval_s or 0))),
+        }
+
+    def start(self):
+        """เริ่ม loop ของงานที่มีรอบอัตโนมัติ (เรียกจาก startup hook ใน event loop)"""
+        if self.started:
+            return
+        self.started = True
+        for name, definition in self.definitions.items():
+            if definition['schedule'].enabled:
+                self.tasks.append(asyncio.create_task(self._schedule_loop(name)))
+                print(f"[SCHEDULER] {name}: every '{definition['schedule'].spec}'")
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        self.started = False
+
+    def submit(self, name, trigger='manual', force=False, params=None):
+        """
+        สั่งรันงาน คืน (job, coalesced) — params ส่งให้งานผ่าน job.params
+        - งานชื่อนี้กำลังรัน/รอคิวอยู่ -> job เดิม (รวมถึงตอน force)
+        - สำเร็จล่าสุดยังไม่เกิน min_interval_s -> job ที่สำเร็จล่าสุด (finished แล้ว) ยกเว้น force
+        """
+        if name not in self.definitions:
+            raise KeyError(name)
+        current = self.active.get(name)
+        if current is not None and not current.finished:
+            return current, True
+        recent = self.last_success.get(name)
+        min_interval = self.definitions[name]['min_interval']
+        if not force and recent is not None and min_interval and datetime.datetime.now() - recent.finished_at < min_interval:
+            return recent, True
+        job = Job(name, trigger, params)
+        self.active[name] = job
+        self.jobs_by_id[job.job_id] = job
+        if len(self.history) == self.history.maxlen:
+            self.jobs_by_id.pop(self.history[0].job_id, None)
+        self.history.append(job)
+        task = asyncio.create_task(self._run(job))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+        return job, False
+
+    async def wait(self, job):
+        await job.done.wait()
+        return job
+
+    def get(self, job_id):
+        return self.jobs_by_id.get(job_id)
+
+    def list_jobs(self, name=None, limit=20):
+        jobs = [j for j in reversed(self.history) if name is None or j.name == name]
+        return [j.to_dict() for j in jobs[:limit]]
+
+    def schedules(self):
+        out = []
+        for name, definition in self.definitions.items():
+            active = self.active.get(name)
+            next_run = self.next_runs.get(name)
+            out.append({
+                "name": name,
+                "description": definition['description'],
+                "schedule": definition['schedule'].spec or 'off',
+                "next_run": next_run.isoformat() if next_run else None,
+                "active_job_id": active.job_id if active is not None and not active.finished else None,
+            })
+        return out
+
+    async def _run(self, job):
+        definition = self.definitions[job.name]
+        lock = self.group_locks.setdefault(definition['lock_group'], asyncio.Lock())
+        try:
+            async with lock:
+                job.status = 'running'
+                job.started_at = datetime.datetime.now()
+                print(f"[SCHEDULER] {job.name} started ({job.trigger}, job {job.job_id})")
+                try:
+                    job.result = await definition['fn'](job)
+                    job.status = 'succeeded'
+                    job.progress = 1.0
+                except Exception as e:
+                    job.status = 'failed'
+                    job.error = str(getattr(e, 'detail', None) or e)
+                    print(f"[SCHEDULER] {job.name} failed: {job.error}")
+                job.finished_at = datetime.datetime.now()
+                if job.status == 'succeeded':
+                    self.last_success[job.name] = job
+                print(f"[SCHEDULER] {job.name} {job.status} in {(job.finished_at - job.started_at).total_seconds():.1f}s")
+        finally:
+            if self.active.get(job.name) is job:
+                del self.active[job.name]
+            job.done.set()
+
+    async def _schedule_loop(self, name):
+        schedule = self.definitions[name]['schedule']
+        last_run = None
+        while True:
+            now = datetime.datetime.now()
+            if last_run is not None and now < last_run:
+                now = last_run  # ตื่นก่อนเวลาเล็กน้อย -> อย่าได้รอบเดิมซ้ำ
+            next_run = schedule.next_after(now)
+            self.next_runs[name] = next_run
+            await asyncio.sleep(max(0.0, (next_run - datetime.datetime.now()).total_seconds()))
+            last_run = next_run
+            try:
+                self.submit(name, trigger='schedule')
+            except Exception as e:
+                print(f"[SCHEDULER] {name}: failed to submit: {e}")
@@ -1,7 +1,6 @@
 import pandas as pd
 import mysql.connector
 import os
-import json
 import uuid
 import bcrypt
 
@@ -60,19 +59,17 @@ def seed_database():
             unique_grids[grid_id] = {
                 'center_lat': grid_lat,
                 'center_long': grid_lon,
-                # Initial empty rain values formatted as JSON array
-                'rain_values_json': json.dumps([0] * 10) 
             }
 
     # 2. Insert into rain_grids table
     print(f"Inserting {len(unique_grids)} unique grids into 'rain_grids' table...")
     grid_insert_query = """
-    INSERT IGNORE INTO rain_grids (grid_id, center_lat, center_long, rain_values_json) 
-    VALUES (%s, %s, %s, %s)
+    INSERT IGNORE INTO rain_grids (grid_id, center_lat, center_long) 
+    VALUES (%s, %s, %s)
     """
-    
+    # ฝนรายวันเก็บใน rain_daily (main.py ดึงเติมให้เองตอน /trigger-prediction)
     grid_data_tuples = [
-        (g_id, data['center_lat'], data['center_long'], data['rain_values_json']) 
+        (g_id, data['center_lat'], data['center_long']) 
         for g_id, data in unique_grids.items()
     ]
     
@@ -88,13 +85,25 @@ def seed_database():
 
     # 3. Insert into static_nodes table
     print(f"Inserting {len(df)} nodes into 'static_nodes' table...")
+    # tambon/district ของแต่ละ node มาจาก CSV โดยตรง (node ไม่ขยับ จึงเก็บครั้งเดียวตอน seed)
+    for col_sql in ("ADD COLUMN tambon VARCHAR(255) DEFAULT NULL", "ADD COLUMN district VARCHAR(100) DEFAULT NULL"):
+        try:
+            cursor.execute(f"ALTER TABLE static_nodes {col_sql}")
+        except Exception:
+            pass
+    try:
+        cursor.execute("CREATE INDEX idx_static_nodes_district ON static_nodes (district)")
+    except Exception:
+        pass
+
     node_insert_query = """
     INSERT IGNORE INTO static_nodes (
         grid_id, latitude, longitude, 
         elevation_extracted, slope_extracted, aspect_extracted, 
-        modis_lc, ndvi, ndwi, twi, soil_type, road_zone
+        modis_lc, ndvi, ndwi, twi, soil_type, road_zone,
+        tambon, district
     ) 
-    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
     """
     
     node_data_tuples = []
@@ -124,11 +133,16 @@ def seed_database():
         twi = 0 if pd.isna(twi) else twi
         soil = 0 if pd.isna(soil) else soil
         road_zone = 0 if pd.isna(road_zone) else road_zone
+        tambon = row.get('TAMBON')
+        district = row.get('DISTRICT')
+        tambon = None if pd.isna(tambon) else str(tambon)
+        district = None if pd.isna(district) else str(district)
         
         node_data_tuples.append((
             grid_id, lat, lon, 
             elevation, slope, aspect, 
-            modis_lc, ndvi, ndwi, twi, soil, road_zone
+            modis_lc, ndvi, ndwi, twi, soil, road_zone,
+            tambon, district
         ))
         
     try:
@@ -0,0 +1,32 @@
+import datetime
+import os
+import sys
+import uuid
+
+import pytest
+from fastapi import HTTPException
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+def test_log_cursor_round_trip_uuid():
+    timestamp = datetime.datetime(2026, 10, 17, 6, 30, 15)
+    log_id = str(uuid.uuid4())
+    assert main.decode_log_cursor(main.encode_log_cursor(timestamp, log_id)) == (timestamp, log_id)
+
+
+def test_log_cursor_filter_compares_log_id_as_string():
+    timestamp = datetime.datetime(2026, 10, 17, 6, 30, 15)
+    log_id = str(uuid.uuid4())
+    sql, args = main.history_filters(before=main.encode_log_cursor(timestamp, log_id))
+    assert "pl.log_id < %s" in sql
+    assert args == [timestamp, timestamp, log_id]
+
+
+@pytest.mark.parametrize("value", ["not-base64!", main.encode_log_cursor("2026-10-17T06:30:15", ""), "MjAyNg=="])
+def test_log_cursor_invalid(value):
+    with pytest.raises(HTTPException) as exc:
+        main.decode_log_cursor(value)
+    assert exc.value.status_code == 400
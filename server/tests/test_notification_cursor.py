@@ -0,0 +1,133 @@
+import datetime
+import os
+import sys
+
+import pytest
+from fastapi import HTTPException
+from starlette.responses import Response
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.executed = []
+
+    def execute(self, query, args=()):
+        self.executed.append((query, args))
+
+    def fetchall(self):
+        return [dict(row) for row in self.rows]
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, rows):
+        self.cursor_obj = FakeCursor(rows)
+
+    def cursor(self, dictionary=False):
+        return self.cursor_obj
+
+    def close(self):
+        pass
+
+
+def test_notification_cursor_round_trip():
+    assert main.decode_notification_cursor(main.encode_notification_cursor(12345678901)) == 12345678901
+
+
+@pytest.mark.parametrize("value", ["not-base64!", main.base64.urlsafe_b64encode(b"2026-10-17T06:30:15|abc").decode()])
+def test_notification_cursor_invalid(value):
+    with pytest.raises(HTTPException) as exc:
+        main.decode_notification_cursor(value)
+    assert exc.value.status_code == 400
+
+
+def test_since_uses_seq_and_returns_next_cursor(monkeypatch):
+    rows = [
+        {"seq": 8, "notification_id": "ffffffff-0000-4000-8000-000000000000", "sent_at": None},
+        {"seq": 9, "notification_id": "00000000-0000-4000-8000-000000000000", "sent_at": None},
+    ]
+    conn = FakeConnection(rows)
+    monkeypatch.setattr(main, "get_db_connection", lambda: conn)
+    response = Response()
+
+    result = main.get_notifications("u1", response, since=main.encode_notification_cursor(7), limit=10)
+
+    query, args = conn.cursor_obj.executed[0]
+    assert "seq > %s ORDER BY seq ASC" in query
+    assert args == ("u1", 7, 11)
+    assert [row["notification_id"] for row in result] == [r["notification_id"] for r in rows]
+    assert all("seq" not in row for row in result)
+    assert main.decode_notification_cursor(response.headers["X-Next-Cursor"]) == 9
+    assert response.headers["X-Has-More"] == "false"
+
+
+class FakeNotificationTable:
+    """notifications ใน memory: รองรับเฉพาะ statement ที่ ensure_notification_seq ใช้"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.seq_extra = None   # None = ยังไม่มี column seq
+        self.executed = []
+        self.result = []
+        self.rowcount = 0
+
+    def cursor(self):
+        return self
+
+    def execute(self, query, args=()):
+        self.executed.append(query)
+        if query.startswith("SHOW COLUMNS"):
+            self.result = [] if self.seq_extra is None else [("seq", "bigint(20)", "YES", "", None, self.seq_extra)]
+        elif query.startswith("ALTER TABLE notifications ADD COLUMN seq"):
+            self.seq_extra = ""
+            for row in self.rows:
+                row["seq"] = None
+        elif query.startswith("UPDATE notifications SET seq"):
+            order = [col.strip() for col in query.split("ORDER BY", 1)[1].split(",")]
+            for seq, row in enumerate(sorted(self.rows, key=lambda r: [r[col] for col in order]), start=1):
+                row["seq"] = seq
+            self.rowcount = len(self.rows)
+        elif query.startswith("ALTER TABLE notifications MODIFY seq"):
+            assert all(row["seq"] is not None for row in self.rows)
+            self.seq_extra = "auto_increment"
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_notification_seq_backfill_follows_sent_at_not_uuid():
+    # uuid (PK) เรียงกลับด้านกับเวลาที่ส่ง
+    rows = [
+        {"notification_id": "ffffffff-0000-4000-8000-000000000000", "sent_at": datetime.datetime(2026, 10, 1, 8, 0, 0)},
+        {"notification_id": "88888888-0000-4000-8000-000000000000", "sent_at": datetime.datetime(2026, 10, 2, 8, 0, 0)},
+        {"notification_id": "00000000-0000-4000-8000-000000000002", "sent_at": datetime.datetime(2026, 10, 3, 8, 0, 0)},
+        {"notification_id": "00000000-0000-4000-8000-000000000001", "sent_at": datetime.datetime(2026, 10, 3, 8, 0, 0)},
+    ]
+    table = FakeNotificationTable(rows)
+
+    main.ensure_notification_seq(table)
+
+    assert table.seq_extra == "auto_increment"
+    by_seq = sorted(rows, key=lambda r: r["seq"])
+    assert [r["sent_at"] for r in by_seq] == sorted(r["sent_at"] for r in rows)
+    assert [r["notification_id"] for r in by_seq[2:]] == [
+        "00000000-0000-4000-8000-000000000001",
+        "00000000-0000-4000-8000-000000000002",
+    ]
+
+    executed = len(table.executed)
+    main.ensure_notification_seq(table)
+    assert table.executed[executed:] == ["SHOW COLUMNS FROM notifications LIKE 'seq'"]
@@ -0,0 +1,33 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+def make_snapshot(lats, lons):
+    lats, lons = np.array(lats, dtype=float), np.array(lons, dtype=float)
+    return {"lats": lats, "lons": lons, "grid_index": main.build_prediction_grid_index(lats, lons)}
+
+
+@pytest.mark.parametrize("bbox", ["nan,0,1,1", "0,-inf,1,1", "0,0,inf,1", "0,0,1,NaN"])
+def test_parse_bbox_rejects_non_finite(bbox):
+    with pytest.raises(HTTPException) as exc:
+        main.parse_bbox(bbox)
+    assert exc.value.status_code == 400
+
+
+def test_huge_bbox_is_clamped_to_world():
+    snapshot = make_snapshot([18.5, 19.2, -45.0], [100.7, 101.1, 170.0])
+    bbox = main.parse_bbox("-1e12,-1e12,1e12,1e12")
+    assert main.query_prediction_bbox(snapshot, *bbox).tolist() == [0, 1, 2]
+
+
+def test_bbox_outside_world_returns_nothing():
+    snapshot = make_snapshot([18.5], [100.7])
+    assert main.query_prediction_bbox(snapshot, 200.0, 100.0, 300.0, 1e12).tolist() == []
@@ -0,0 +1,133 @@
+import datetime
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import retention  # noqa: E402
+
+FOREIGN_KEYS = [
+    ("prediction_logs", "prediction_logs_ibfk_1", "static_nodes", "CASCADE", "RESTRICT", "node_id", "node_id"),
+    ("notifications", "fk_notifications_prediction_log", "prediction_logs", "SET NULL", "RESTRICT", b"log_id", b"log_id"),
+]
+
+
+class ScriptedCursor:
+    """บันทึก statement และ raise เมื่อ statement มีข้อความใน fail_on"""
+
+    def __init__(self, fail_on=()):
+        self.fail_on = fail_on
+        self.executed = []
+        self.result = []
+
+    def execute(self, query, args=()):
+        sql = " ".join(query.split())
+        self.executed.append(sql)
+        if any(pattern in sql for pattern in self.fail_on):
+            raise RuntimeError(f"unsupported: {sql[:40]}")
+        if "information_schema.PARTITIONS" in sql:
+            self.result = []
+        elif "REFERENTIAL_CONSTRAINTS" in sql:
+            self.result = FOREIGN_KEYS
+        elif sql.startswith("SELECT MIN(timestamp)"):
+            self.result = [(datetime.datetime(2026, 8, 3),)]
+
+    def fetchone(self):
+        return self.result[0]
+
+    def fetchall(self):
+        return self.result
+
+    def close(self):
+        pass
+
+
+class ScriptedConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.rolled_back = False
+
+    def cursor(self):
+        return self._cursor
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        self.rolled_back = True
+
+
+def statements(cursor, prefix):
+    return [sql for sql in cursor.executed if sql.startswith(prefix)]
+
+
+def test_unsupported_partitioning_keeps_foreign_keys():
+    cursor = ScriptedCursor(fail_on=(f"ALTER TABLE {retention.PROBE_TABLE} PARTITION BY",))
+    assert retention.ensure_partitioned(ScriptedConnection(cursor), today=datetime.date(2026, 10, 17)) is False
+    assert not [sql for sql in cursor.executed if "DROP FOREIGN KEY" in sql]
+    assert not statements(cursor, f"ALTER TABLE {retention.LOG_TABLE} ")
+    assert cursor.executed[-1] == f"DROP TABLE IF EXISTS {retention.PROBE_TABLE}"
+
+
+def test_failed_partition_after_probe_restores_foreign_keys():
+    cursor = ScriptedCursor(fail_on=(f"ALTER TABLE {retention.LOG_TABLE} PARTITION BY",))
+    conn = ScriptedConnection(cursor)
+    assert retention.ensure_partitioned(conn, today=datetime.date(2026, 10, 17)) is False
+    assert conn.rolled_back
+    assert len([sql for sql in cursor.executed if "DROP FOREIGN KEY" in sql]) == 2
+    assert statements(cursor, "ALTER TABLE prediction_logs ADD CONSTRAINT") == [
+        "ALTER TABLE prediction_logs ADD CONSTRAINT prediction_logs_ibfk_1 FOREIGN KEY (node_id) "
+        "REFERENCES static_nodes (node_id) ON DELETE CASCADE ON UPDATE RESTRICT"
+    ]
+    assert statements(cursor, "ALTER TABLE notifications ADD CONSTRAINT") == [
+        "ALTER TABLE notifications ADD CONSTRAINT fk_notifications_prediction_log FOREIGN KEY (log_id) "
+        "REFERENCES prediction_logs (log_id) ON DELETE SET NULL ON UPDATE RESTRICT"
+    ]
+
+
+def test_supported_partitioning_drops_foreign_keys_and_partitions():
+    cursor = ScriptedCursor()
+    assert retention.ensure_partitioned(ScriptedConnection(cursor), today=datetime.date(2026, 10, 17)) is True
+    partition = statements(cursor, f"ALTER TABLE {retention.LOG_TABLE} PARTITION BY")
+    assert len(partition) == 1 and "PARTITION p202608 " in partition[0] and "PARTITION p202701 " in partition[0]
+    assert not [sql for sql in cursor.executed if "ADD CONSTRAINT" in sql]
+
+
+class OrphanCursor(ScriptedCursor):
+    """SELECT log ที่ไม่มี node คืน orphan_batches ทีละชุด"""
+
+    def __init__(self, orphan_nodes, orphan_batches):
+        super().__init__()
+        self.orphan_nodes = orphan_nodes
+        self.orphan_batches = list(orphan_batches)
+        self.rowcount = 0
+
+    def execute(self, query, args=()):
+        sql = " ".join(query.split())
+        self.executed.append((sql, args))
+        if sql.startswith("SELECT d.node_id"):
+            self.result = [(node_id,) for node_id in self.orphan_nodes]
+        elif sql.startswith("SELECT log_id"):
+            self.result = [(log_id,) for log_id in (self.orphan_batches.pop(0) if self.orphan_batches else [])]
+        self.rowcount = len(args)
+
+
+def test_delete_orphaned_logs_in_batches(monkeypatch):
+    monkeypatch.setattr(retention, "DELETE_BATCH", 2)
+    cursor = OrphanCursor([7, 9], [["a", "b"], ["c"]])
+    assert retention.delete_orphaned_logs(ScriptedConnection(cursor)) == 3
+
+    selects = [args for sql, args in cursor.executed if sql.startswith("SELECT log_id")]
+    assert selects == [(7, 9), (7, 9)]
+
+    deletes = [(sql, args) for sql, args in cursor.executed if sql.startswith(f"DELETE FROM {retention.LOG_TABLE}")]
+    assert [args for _, args in deletes] == [("a", "b"), ("c",)]
+    unlinks = [args for sql, args in cursor.executed if sql.startswith("UPDATE notifications SET log_id = NULL")]
+    assert unlinks == [("a", "b"), ("c",)]
+    assert any(sql.startswith("DELETE d FROM prediction_log_daily d") for sql, _ in cursor.executed)
+
+
+def test_delete_orphaned_logs_without_orphans_only_checks_nodes():
+    cursor = OrphanCursor([], [])
+    assert retention.delete_orphaned_logs(ScriptedConnection(cursor)) == 0
+    assert not [sql for sql, _ in cursor.executed if sql.startswith(("SELECT log_id", "DELETE FROM", "UPDATE"))]
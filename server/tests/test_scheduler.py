@@ -0,0 +1,53 @@
+import asyncio
+import datetime
+import gc
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scheduler import JobScheduler  # noqa: E402
+
+
+def test_submitted_job_survives_gc_and_finishes():
+    async def scenario():
+        scheduler = JobScheduler()
+        release = asyncio.Event()
+
+        async def work(job):
+            await release.wait()
+            return {"ok": True}
+
+        scheduler.register("work", work)
+        job, coalesced = scheduler.submit("work")
+        assert not coalesced
+        await asyncio.sleep(0)
+        gc.collect()
+        assert len(scheduler._running) == 1
+        release.set()
+        await asyncio.wait_for(scheduler.wait(job), timeout=1)
+        await asyncio.sleep(0)
+        assert job.status == "succeeded"
+        assert "work" not in scheduler.active
+        assert not scheduler._running
+
+    asyncio.run(scenario())
+
+
+def test_daily_interval_aligns_to_midnight():
+    from scheduler import Schedule
+
+    now = datetime.datetime(2026, 10, 17, 14, 37, 12)
+    assert Schedule("1d").next_after(now) == datetime.datetime(2026, 10, 18)
+    assert Schedule("24h").next_after(datetime.datetime(2026, 10, 18)) == datetime.datetime(2026, 10, 19)
+
+    two_days = Schedule("2d")
+    first = two_days.next_after(now)
+    assert first.time() == datetime.time(0, 0) and first > now
+    assert two_days.next_after(first) == first + datetime.timedelta(days=2)
+
+
+def test_sub_daily_interval_unchanged():
+    from scheduler import Schedule
+
+    assert Schedule("6h").next_after(datetime.datetime(2026, 10, 17, 14, 37)) == datetime.datetime(2026, 10, 17, 18, 0)
@@ -0,0 +1,67 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+class LocationCursor:
+    """user_locations ใน memory; on_execute จำลอง request อื่นที่ทำงานระหว่าง SELECT ของ reader"""
+
+    def __init__(self, locations, on_execute=None):
+        self.locations = locations
+        self.on_execute = on_execute
+        self.rows = []
+
+    def execute(self, query, args=()):
+        self.rows = [{"user_id": u, **self.locations[u]} for u in args if u in self.locations]
+        if self.on_execute is not None:
+            self.on_execute()
+
+    def fetchall(self):
+        return self.rows
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    main.USER_LOCATION_CACHE.clear()
+    main.USER_LOCATION_INVALIDATED.clear()
+    yield
+    main.USER_LOCATION_CACHE.clear()
+    main.USER_LOCATION_INVALIDATED.clear()
+
+
+def location(lat):
+    return {"latitude": lat, "longitude": 100.0, "tambon": "t", "district": "d"}
+
+
+def test_save_during_read_is_not_overwritten_by_stale_value():
+    locations = {"u1": location(18.0), "u2": location(19.0)}
+
+    def save_new_location():
+        # save_user_location commit + invalidate หลังจาก reader ได้แถวเก่าไปแล้ว
+        locations["u1"] = location(18.5)
+        main.invalidate_user_location("u1")
+
+    stale = main.get_user_locations(LocationCursor(locations, save_new_location), ["u1", "u2"])
+    assert stale["u1"]["latitude"] == 18.0
+    assert "u1" not in main.USER_LOCATION_CACHE
+    assert "u2" in main.USER_LOCATION_CACHE
+    assert main.USER_LOCATION_READERS == 0 and not main.USER_LOCATION_INVALIDATED
+
+    fresh = main.get_user_locations(LocationCursor(locations), ["u1"])
+    assert fresh["u1"]["latitude"] == 18.5
+    assert main.USER_LOCATION_CACHE["u1"][1]["latitude"] == 18.5
+
+
+def test_failed_read_releases_reader_and_caches_nothing():
+    def fail():
+        raise RuntimeError("db down")
+
+    with pytest.raises(RuntimeError):
+        main.get_user_locations(LocationCursor({"u1": location(18.0)}, fail), ["u1"])
+    assert main.USER_LOCATION_READERS == 0
+    assert not main.USER_LOCATION_CACHE
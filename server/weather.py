@@ -0,0 +1,243 @@
+"""
+Open-Meteo rain fetcher แบบ batch หลายพิกัดต่อ 1 request
+
+- Open-Meteo รับ latitude/longitude เป็น list คั่นด้วย comma ได้ในคำขอเดียว
+  จึงรวม grid เป็นกลุ่มละ METEO_BATCH_SIZE พิกัด แทนการยิง 1 request ต่อ 1 grid
+- จำกัดอัตรายิงด้วย token bucket (METEO_RATE_PER_SEC) และจำนวน request พร้อมกันแบบ adaptive (AIMD):
+  สำเร็จ -> เพิ่มทีละ 1 จนถึง METEO_MAX_CONCURRENCY, โดน 429/5xx -> ลดลงครึ่งหนึ่ง
+- retry แบบ exponential backoff + jitter (เคารพ Retry-After ถ้ามี)
+- batch ที่ล้มเหลวจน retry หมด จะได้ฝนเป็น 0 ทั้ง 10 วัน (พฤติกรรมเดิมของ fetch_weather_for_grid)
+- fetch_rain_ranges ขอเฉพาะช่วงวันที่ขาด (start_date/end_date) สำหรับ delta refresh ของ rain_daily
+
+ตั้งค่าได้ผ่าน environment variables:
+    OPEN_METEO_URL          endpoint (default https://api.open-meteo.com/v1/forecast, ชี้ไป meteo_stub.py ได้)
+    METEO_BATCH_SIZE        จำนวนพิกัดต่อ 1 request (default 100)
+    METEO_RATE_PER_SEC      request ต่อวินาทีสูงสุด (default 5)
+    METEO_MAX_CONCURRENCY   request พร้อมกันสูงสุด (default 8)
+    METEO_MAX_RETRIES       จำนวนครั้งที่ลองใหม่ต่อ batch (default 4)
+    METEO_TIMEOUT           timeout ต่อ request เป็นวินาที (default 20)
+"""
+import asyncio
+import datetime
+import os
+import random
+import time
+
+import httpx
+
+OPEN_METEO_URL = os.environ.get('OPEN_METEO_URL', 'https://api.open-meteo.com/v1/forecast')
+METEO_BATCH_SIZE = max(1, int(os.environ.get('METEO_BATCH_SIZE', 100)))
+METEO_RATE_PER_SEC = float(os.environ.get('METEO_RATE_PER_SEC', 5))
+METEO_MAX_CONCURRENCY = max(1, int(os.environ.get('METEO_MAX_CONCURRENCY', 8)))
+METEO_MAX_RETRIES = int(os.environ.get('METEO_MAX_RETRIES', 4))
+METEO_TIMEOUT = float(os.environ.get('METEO_TIMEOUT', 20))
+
+METEO_PAST_DAYS = 10
+METEO_BACKOFF_BASE_S = 0.5
+METEO_BACKOFF_MAX_S = 10.0
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Token bucket แบบ async: เติม rate token/วินาที เก็บได้สูงสุด capacity"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AdaptiveLimiter:
+    """จำกัดจำนวน request พร้อมกันแบบ AIMD (additive increase / multiplicative decrease)"""
+
+    def __init__(self, max_limit, initial=None, min_limit=1):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = initial if initial is not None else max(min_limit, max_limit // 2)
+        self.in_flight = 0
+        self.cond = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self.cond:
+            await self.cond.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        async with self.cond:
+            self.in_flight -= 1
+            self.cond.notify_all()
+
+    async def on_success(self):
+        async with self.cond:
+            if self.limit < self.max_limit:
+                self.limit += 1
+                self.cond.notify_all()
+
+    async def on_throttle(self):
+        async with self.cond:
+            self.limit = max(self.min_limit, self.limit // 2)
+
+
+def chunk_grids(grids, size=METEO_BATCH_SIZE):
+    return [grids[i:i + size] for i in range(0, len(grids), size)]
+
+
+def build_batch_params(batch, start_date=None, end_date=None):
+    """
+    query string ของ 1 batch (ทศนิยม 5 ตำแหน่ง ~1 m พอสำหรับ grid 2 km และช่วยให้ URL สั้น)
+    ถ้าให้ start_date/end_date จะขอเฉพาะช่วงวันนั้น ไม่งั้นขอ 10 วันย้อนหลัง + วันนี้
+    """
+    params = {
+        'latitude': ','.join(f"{float(g['lat']):.5f}" for g in batch),
+        'longitude': ','.join(f"{float(g['lon']):.5f}" for g in batch),
+        'daily': 'precipitation_sum',
+        'timezone': 'auto',
+    }
+    if start_date is not None:
+        params['start_date'] = start_date.isoformat()
+        params['end_date'] = (end_date or start_date).isoformat()
+    else:
+        params['past_days'] = METEO_PAST_DAYS
+        params['forecast_days'] = 1
+    return params
+
+
+def parse_batch_response(batch, data):
+    """
+    Open-Meteo คืน object เดียวเมื่อขอ 1 พิกัด และคืน list ตามลำดับพิกัดเมื่อขอหลายพิกัด
+    คืน list ของ (dates, values) ต่อพิกัด ตามลำดับของ batch
+    ค่า null (วันที่ Open-Meteo ยังไม่สรุปยอด) คงเป็น None — ผู้เรียกตัดสินใจเองว่าจะใช้ 0 หรือข้ามไป
+    """
+    locations = data if isinstance(data, list) else [data]
+    if len(locations) != len(batch):
+        raise ValueError(f"expected {len(batch)} locations, got {len(locations)}")
+    parsed = []
+    for loc in locations:
+        daily = loc.get('daily') or {}
+        values = [float(v) if v is not None else None for v in (daily.get('precipitation_sum') or [])]
+        parsed.append((daily.get('time') or [], values))
+    return parsed
+
+
+def empty_rain(batch):
+    return [{"grid_id": g['grid_id'], "lat": g['lat'], "lon": g['lon'], "rain": [0] * METEO_PAST_DAYS} for g in batch]
+
+
+def _retry_delay(attempt, response=None):
+    if response is not None:
+        retry_after = response.headers.get('Retry-After')
+        if retry_after:
+            try:
+                return min(METEO_BACKOFF_MAX_S, float(retry_after))
+            except ValueError:
+                pass
+    backoff = min(METEO_BACKOFF_MAX_S, METEO_BACKOFF_BASE_S * (2 ** attempt))
+    return backoff * (0.5 + random.random() / 2)
+
+
+async def fetch_rain_batch(client, batch, params, bucket, limiter, stats=None):
+    """ยิง 1 batch พร้อม retry/backoff คืนผลของ parse_batch_response หรือ None ถ้าล้มเหลว"""
+    for attempt in range(METEO_MAX_RETRIES + 1):
+        response = None
+        await bucket.acquire()
+        async with limiter:
+            try:
+                if stats is not None:
+                    stats['requests'] += 1
+                response = await client.get(OPEN_METEO_URL, params=params, timeout=METEO_TIMEOUT)
+            except (httpx.TransportError, httpx.TimeoutException) as e:
+                error = e
+            else:
+                error = None
+        if response is not None and response.status_code == 200:
+            try:
+                parsed = parse_batch_response(batch, response.json())
+            except ValueError as e:
+                print(f"[METEO] Bad response for batch of {len(batch)} grids: {e}")
+                break
+            await limiter.on_success()
+            return parsed
+        if response is not None and response.status_code not in RETRYABLE_STATUS:
+            print(f"[METEO] HTTP {response.status_code} for batch of {len(batch)} grids, giving up")
+            break
+        await limiter.on_throttle()
+        if stats is not None:
+            stats['retries'] += 1
+        if attempt < METEO_MAX_RETRIES:
+            reason = f"HTTP {response.status_code}" if response is not None else repr(error)
+            delay = _retry_delay(attempt, response)
+            print(f"[METEO] {reason}, retry {attempt + 1}/{METEO_MAX_RETRIES} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+    if stats is not None:
+        stats['failed_batches'] += 1
+    print(f"[METEO] Failed batch of {len(batch)} grids")
+    return None
+
+
+async def _run_batches(jobs, stats=None):
+    """jobs = list ของ (batch, params) ใช้ client/token bucket/limiter ร่วมกันทั้งหมด"""
+    bucket = TokenBucket(METEO_RATE_PER_SEC)
+    limiter = AdaptiveLimiter(METEO_MAX_CONCURRENCY)
+    limits = httpx.Limits(max_connections=METEO_MAX_CONCURRENCY, max_keepalive_connections=METEO_MAX_CONCURRENCY)
+    async with httpx.AsyncClient(limits=limits) as client:
+        return await asyncio.gather(*[fetch_rain_batch(client, b, p, bucket, limiter, stats) for b, p in jobs])
+
+
+async def fetch_weather_batch(grids, batch_size=METEO_BATCH_SIZE, stats=None):
+    """
+    ดึงฝนย้อนหลัง 10 วันของทุก grid (list ของ {'grid_id','lat','lon'})
+    คืน list ของ {'grid_id','lat','lon','rain'} ตามลำดับเดิมของ grids (batch ที่ล้มเหลว -> ฝน 0)
+    """
+    if not grids:
+        return []
+    batches = chunk_grids(list(grids), batch_size)
+    parts = await _run_batches([(b, build_batch_params(b)) for b in batches], stats)
+    results = []
+    for batch, parsed in zip(batches, parts):
+        if parsed is None:
+            results.extend(empty_rain(batch))
+            continue
+        for g, (_, values) in zip(batch, parsed):
+            rain = [v if v is not None else 0.0 for v in values[:METEO_PAST_DAYS]]
+            rain += [0.0] * (METEO_PAST_DAYS - len(rain))
+            results.append({"grid_id": g['grid_id'], "lat": g['lat'], "lon": g['lon'], "rain": rain})
+    return results
+
+
+async def fetch_rain_ranges(groups, batch_size=METEO_BATCH_SIZE, stats=None):
+    """
+    ดึงฝนรายวันเฉพาะช่วงวันที่ต้องการ: groups = {(start_date, end_date): [grid, ...]}
+    grid ที่ขอช่วงวันเดียวกันถูกรวมเป็น batch เดียวกัน
+    คืน dict grid_id -> {date: mm}; grid ที่ดึงไม่สำเร็จจะไม่อยู่ในผลลัพธ์ (ให้รอบถัดไปลองใหม่)
+    วันที่ค่าเป็น null ก็ไม่อยู่ในผลลัพธ์เช่นกัน — ถ้าบันทึกเป็น 0 รอบถัดไปจะถือว่ามีแล้วและไม่ดึงค่าจริงอีกเลย
+    """
+    jobs = []
+    for (start_date, end_date), grids in groups.items():
+        for batch in chunk_grids(list(grids), batch_size):
+            jobs.append((batch, build_batch_params(batch, start_date, end_date)))
+    if not jobs:
+        return {}
+    parts = await _run_batches(jobs, stats)
+    fetched = {}
+    for (batch, _), parsed in zip(jobs, parts):
+        if parsed is None:
+            continue
+        for g, (dates, values) in zip(batch, parsed):
+            fetched[g['grid_id']] = {datetime.date.fromisoformat(d): v for d, v in zip(dates, values) if v is not None}
+    return fetched